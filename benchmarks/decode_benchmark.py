@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Compare the legacy cover render path with the draft-decode, single-resample path.
+
+Each render runs in a fresh child process so peak RSS can be measured per album:
+    python benchmarks/decode_benchmark.py --sizes 600 1200 3000 5000 --json results.json
+"""
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from PIL import Image, ImageEnhance
+import wallpaper_render
+
+WALLPAPER_SIZE = (1920, 1080)
+MAX_IMAGE_SIZE = (1920, 1080)
+SHARPNESS_FACTOR = 1.1
+
+def make_cover(size):
+    """Synthetic JPEG cover with enough detail that resampling does real work"""
+    image = Image.radial_gradient('L').resize((size, size)).convert('RGB')
+    noise = Image.effect_noise((size, size), 64).convert('RGB')
+    image = Image.blend(image, noise, 0.5)
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+def legacy_render(data, encode):
+    """The pre-draft path: full decode, thumbnail, sharpen, second LANCZOS resize"""
+    image = Image.open(io.BytesIO(data))
+    if image.size[0] > MAX_IMAGE_SIZE[0] or image.size[1] > MAX_IMAGE_SIZE[1]:
+        image.thumbnail(MAX_IMAGE_SIZE, Image.Resampling.LANCZOS)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    image = ImageEnhance.Sharpness(image).enhance(SHARPNESS_FACTOR)
+    image = image.resize(WALLPAPER_SIZE, Image.Resampling.LANCZOS)
+    return wallpaper_render.encode_png(image) if encode else image
+
+def draft_render(data, encode):
+    image = wallpaper_render.render_wallpaper(data, MAX_IMAGE_SIZE, WALLPAPER_SIZE, SHARPNESS_FACTOR)
+    return wallpaper_render.encode_png(image) if encode else image
+
+PATHS = {'legacy': legacy_render, 'draft': draft_render}
+
+def _peak_rss_kb():
+    # VmHWM is reset by exec; ru_maxrss can carry over the parent's peak on Linux
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    # ru_maxrss is kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+def _measure(path, data, encode, queue):
+    baseline = _peak_rss_kb()
+    start_cpu = time.process_time()
+    start_wall = time.perf_counter()
+    PATHS[path](data, encode)
+    queue.put({
+        'cpu_ms': (time.process_time() - start_cpu) * 1000,
+        'wall_ms': (time.perf_counter() - start_wall) * 1000,
+        'peak_rss_delta_kb': _peak_rss_kb() - baseline
+    })
+
+def measure(path, data, encode, repeats):
+    """Median CPU/wall time and peak RSS growth over several fresh processes"""
+    ctx = multiprocessing.get_context('spawn')
+    runs = []
+    for _ in range(repeats):
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_measure, args=(path, data, encode, queue))
+        proc.start()
+        runs.append(queue.get())
+        proc.join()
+
+    def median(field):
+        values = sorted(run[field] for run in runs)
+        return round(values[len(values) // 2], 1)
+
+    return {field: median(field) for field in ('cpu_ms', 'wall_ms', 'peak_rss_delta_kb')}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[300, 600, 1200, 3000, 5000],
+                        help='Square cover sizes in pixels')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--encode', action='store_true', help='Include PNG encoding in the measurement')
+    parser.add_argument('--json', help='Write results to this file')
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'cover':>7} {'path':>7} {'cpu ms':>9} {'wall ms':>9} {'peak RSS KB':>12}")
+    for size in args.sizes:
+        data = make_cover(size)
+        row = {'cover_size': size, 'cover_bytes': len(data)}
+        for path in PATHS:
+            row[path] = measure(path, data, args.encode, args.repeats)
+            stats = row[path]
+            print(f"{size:>7} {path:>7} {stats['cpu_ms']:>9} {stats['wall_ms']:>9} {stats['peak_rss_delta_kb']:>12}")
+        row['cpu_ms_saved'] = round(row['legacy']['cpu_ms'] - row['draft']['cpu_ms'], 1)
+        row['peak_rss_kb_saved'] = row['legacy']['peak_rss_delta_kb'] - row['draft']['peak_rss_delta_kb']
+        print(f"{size:>7} {'saved':>7} {row['cpu_ms_saved']:>9} {'':>9} {row['peak_rss_kb_saved']:>12}")
+        results.append(row)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'encode': args.encode, 'wallpaper_size': WALLPAPER_SIZE, 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Check the app's import time against a budget.
+
+Imports lastfm_wallpaper in fresh interpreters (with throwaway caches and dummy
+credentials), reports the median wall time and the slowest modules it imports,
+and fails if the median is over --budget-ms or if a dependency that should load
+lazily (numpy, Pillow, requests, psutil) was imported eagerly.
+
+    python benchmarks/import_time.py --runs 7 --budget-ms 350 --json import.json
+
+The interpreter's own startup is not counted. Exits 1 when over budget.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Modules that must stay off the import path - see wallpaper_lazy
+DEFERRED = ('numpy', 'PIL', 'requests', 'psutil', 'asyncio')
+
+CHILD = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+import lastfm_wallpaper
+elapsed = time.perf_counter() - start
+print(json.dumps({{'ms': elapsed * 1000, 'loaded': [name for name in {deferred!r} if name in sys.modules]}}))
+"""
+
+def child_env(work_dir):
+    env = dict(os.environ)
+    env.setdefault('LASTFM_API_KEY', 'import-time')
+    env.setdefault('LASTFM_SHARED_SECRET', 'import-time')
+    env['WALLPAPER_CACHE_DIR'] = os.path.join(work_dir, 'cache')
+    env['JOB_DB_PATH'] = os.path.join(work_dir, 'jobs.sqlite3')
+    return env
+
+def measure(env, deferred):
+    code = CHILD.format(root=ROOT, deferred=deferred)
+    output = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+def slowest_imports(env, count):
+    """Top-level imports of lastfm_wallpaper by cumulative time, from -X importtime"""
+    code = f"import sys; sys.path.insert(0, {ROOT!r}); import lastfm_wallpaper"
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], env=env, capture_output=True, text=True, check=True)
+    modules = []
+    for line in output.stderr.splitlines():
+        if not line.startswith('import time:') or line.count('|') != 2:
+            continue
+        _, cumulative, name = line.split('|')
+        if not cumulative.strip().isdigit():
+            continue
+        depth = len(name) - len(name.lstrip(' '))
+        # -X importtime lists a module's imports, indented one level, right before the module itself
+        if depth == 1:
+            if name.strip() == 'lastfm_wallpaper':
+                break
+            modules = []
+        elif depth == 3:
+            modules.append((name.strip(), int(cumulative) / 1000))
+    return sorted(modules, key=lambda module: module[1], reverse=True)[:count]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=350)
+    parser.add_argument('--top', type=int, default=10, help='Slowest imports to list')
+    parser.add_argument('--json', help='Write results to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='import-time-') as work_dir:
+        env = child_env(work_dir)
+        # The first run compiles bytecode and creates the caches; it isn't counted
+        measure(env, DEFERRED)
+        runs = [measure(env, DEFERRED) for _ in range(args.runs)]
+        slowest = slowest_imports(env, args.top)
+
+    median_ms = statistics.median(run['ms'] for run in runs)
+    eager = sorted({name for run in runs for name in run['loaded']})
+    result = {
+        'median_ms': round(median_ms, 1),
+        'runs_ms': [round(run['ms'], 1) for run in runs],
+        'budget_ms': args.budget_ms,
+        'eager_imports': eager,
+        'slowest_imports_ms': {name: round(ms, 1) for name, ms in slowest},
+        'ok': median_ms <= args.budget_ms and not eager
+    }
+    print(json.dumps(result, indent=2))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    if eager:
+        print(f"Imported eagerly, should be deferred: {', '.join(eager)}", file=sys.stderr)
+    if median_ms > args.budget_ms:
+        print(f"Import took {median_ms:.0f}ms, over the {args.budget_ms:.0f}ms budget", file=sys.stderr)
+    return 0 if result['ok'] else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark against a local stand-in for the Last.fm API and its image CDN.
+
+The fake server serves paged user.gettopalbums charts drawn from a shared pool of
+synthetic JPEG covers of several sizes, with configurable latency and failure rates.
+Two modes drive the real code:
+    generator  calls LastFMWallpaperGenerator.generate_wallpapers_to_disk from N threads
+    http       runs the Flask app and drives POST /generate, GET /jobs/<id>, GET /download
+
+    python benchmarks/pipeline_benchmark.py --users 8 --limit 25 --concurrency 4 --json results.json
+
+Every run starts from empty caches unless --warm is given.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from decode_benchmark import make_cover
+
+# Size prefixes the app rewrites cover URLs to; the CDN serves a variant if the cover is that large
+CDN_VARIANTS = {'300x300': 300, '800x800': 800, '1200x1200': 1200}
+COVER_VARIETIES = 3  # Distinct encoded images per cover size
+MODES = ('generator', 'http')
+
+class FakeLastFM:
+    """Deterministic Last.fm API + CDN stand-in running on a background thread"""
+
+    def __init__(self, covers, cover_sizes, chart_size, api_latency, cdn_latency, failure_rate, seed):
+        self.chart_size = chart_size
+        self.api_latency = api_latency
+        self.cdn_latency = cdn_latency
+        self.failure_rate = failure_rate
+        self.seed = seed
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = {'api': 0, 'cdn': 0, 'failures': 0}
+
+        # Cover i is one of a few encoded images of its size, addressed by a Last.fm-like hash
+        self.images = {
+            (size, variety): make_cover(size) for size in cover_sizes for variety in range(COVER_VARIETIES)
+        }
+        self.covers = {}
+        for i in range(covers):
+            cover_hash = hashlib.md5(f'{seed}-{i}'.encode()).hexdigest()
+            self.covers[cover_hash] = (cover_sizes[i % len(cover_sizes)], i % COVER_VARIETIES)
+        self.cover_hashes = list(self.covers)
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        server.daemon_threads = True
+        self.server = server
+        self.url = f'http://127.0.0.1:{server.server_address[1]}'
+        threading.Thread(target=server.serve_forever, name='fake-lastfm', daemon=True).start()
+
+    def _sleep(self, latency):
+        mean, jitter = latency
+        with self._lock:
+            delay = max(0.0, self._random.gauss(mean, jitter))
+        time.sleep(delay / 1000)
+
+    def _fails(self):
+        with self._lock:
+            failed = self._random.random() < self.failure_rate
+            if failed:
+                self.requests['failures'] += 1
+        return failed
+
+    def chart(self, username):
+        """A user's chart: popular covers are shared by many users, the tail is personal"""
+        rng = random.Random(f'{self.seed}-{username}')
+        weights = [1 / (rank + 1) for rank in range(len(self.cover_hashes))]
+        chart = []
+        seen = set()
+        while len(chart) < min(self.chart_size, len(self.cover_hashes)):
+            cover_hash = rng.choices(self.cover_hashes, weights)[0]
+            if cover_hash not in seen:
+                seen.add(cover_hash)
+                chart.append(cover_hash)
+        return chart
+
+    def _top_albums(self, query):
+        limit = int(query.get('limit', 50))
+        page = int(query.get('page', 1))
+        chart = self.chart(query.get('user', ''))
+        albums = [
+            {
+                'name': f'Album {cover_hash[:8]}',
+                'artist': {'name': f'Artist {cover_hash[8:12]}'},
+                'image': [{'size': 'extralarge', '#text': f'{self.url}/i/u/300x300/{cover_hash}.jpg'}]
+            }
+            for cover_hash in chart[(page - 1) * limit:page * limit]
+        ]
+        return {'topalbums': {'album': albums, '@attr': {
+            'page': str(page), 'perPage': str(limit),
+            'totalPages': str(max(1, -(-len(chart) // limit))), 'total': str(len(chart))
+        }}}
+
+    def _cover(self, path):
+        """Bytes for /i/u/<variant>/<hash>.jpg, or None if that variant doesn't exist"""
+        parts = path.split('/')
+        if len(parts) != 5 or parts[3] not in CDN_VARIANTS:
+            return None
+        entry = self.covers.get(parts[4].split('.')[0])
+        if entry is None:
+            return None
+        size, variety = entry
+        # Larger variants only exist for covers that big; 300x300 always exists
+        if CDN_VARIANTS[parts[3]] > size and parts[3] != '300x300':
+            return None
+        return self.images[(size, variety)]
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body, content_type, head=False):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if not head:
+                    self.wfile.write(body)
+
+            def _serve(self, head):
+                url = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                if url.path.startswith('/2.0'):
+                    with fake._lock:
+                        fake.requests['api'] += 1
+                    fake._sleep(fake.api_latency)
+                    if query.get('method') == 'user.getinfo':
+                        data = {'user': {'name': query.get('user'), 'playcount': '1000'}}
+                    else:
+                        data = fake._top_albums(query)
+                    return self._send(200, json.dumps(data).encode(), 'application/json', head)
+
+                if url.path.startswith('/i/u/'):
+                    with fake._lock:
+                        fake.requests['cdn'] += 1
+                    fake._sleep(fake.cdn_latency)
+                    if fake._fails():
+                        return self._send(503, b'unavailable', 'text/plain', head)
+                    image = fake._cover(url.path)
+                    if image is None:
+                        return self._send(404, b'not found', 'text/plain', head)
+                    return self._send(200, image, 'image/jpeg', head)
+
+                self._send(404, b'not found', 'text/plain', head)
+
+            def do_GET(self):
+                self._serve(False)
+
+            def do_HEAD(self):
+                self._serve(True)
+
+        return Handler
+
+def _peak_rss_kb(pid='self'):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def _reset_peak_rss():
+    # Linux resets VmHWM to the current RSS when 5 is written to clear_refs
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def _children_peak_rss_kb():
+    """Summed peak RSS of child processes still alive - the render pool"""
+    import psutil
+    peaks = [_peak_rss_kb(child.pid) for child in psutil.Process().children(recursive=True)]
+    return sum(peak for peak in peaks if peak) or None
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))], 3)
+
+def summarize(latencies, wall, wallpapers, bytes_written, errors, rss_reset):
+    return {
+        'runs': len(latencies),
+        'errors': errors,
+        'wall_seconds': round(wall, 3),
+        'runs_per_second': round(len(latencies) / wall, 3) if wall else None,
+        'wallpapers': wallpapers,
+        'wallpapers_per_second': round(wallpapers / wall, 3) if wall else None,
+        'latency_p50_seconds': percentile(latencies, 0.5),
+        'latency_p99_seconds': percentile(latencies, 0.99),
+        'latency_max_seconds': round(max(latencies), 3) if latencies else None,
+        'bytes_written': bytes_written,
+        'peak_rss_kb': _peak_rss_kb(),
+        'peak_rss_is_per_run': rss_reset,
+        'render_pool_peak_rss_kb': _children_peak_rss_kb()
+    }
+
+def run_generator(app_module, users, args):
+    """Call generate_wallpapers_to_disk for every user, args.concurrency at a time"""
+    effects = app_module.parse_effects(args.effects)
+    targets = app_module.parse_render_targets(args.sizes, app_module.default_aspect_mode(effects))
+    lock = threading.Lock()
+    totals = {'wallpapers': 0, 'bytes': 0, 'errors': 0}
+    latencies = []
+
+    def one(username):
+        start = time.perf_counter()
+        temp_dir = None
+        try:
+            generator = app_module.LastFMWallpaperGenerator()
+            saved_files, temp_dir = generator.generate_wallpapers_to_disk(
+                username, 'overall', args.limit, output_format=args.format, targets=targets, effects=effects
+            )
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                totals['wallpapers'] += len(saved_files)
+                totals['bytes'] += sum(saved_file['bytes'] for saved_file in saved_files)
+        except Exception as e:
+            print(f"{username}: {e}", file=sys.stderr)
+            with lock:
+                totals['errors'] += 1
+        finally:
+            if temp_dir:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+
+    rss_reset = _reset_peak_rss()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(one, users))
+    wall = time.perf_counter() - start
+    return summarize(latencies, wall, totals['wallpapers'], totals['bytes'], totals['errors'], rss_reset)
+
+def run_http(app_module, users, args):
+    """Drive POST /generate, poll /jobs/<id> and GET /download for every user through a real HTTP server"""
+    import requests
+    from werkzeug.serving import make_server
+
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-app', daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+    lock = threading.Lock()
+    totals = {'wallpapers': 0, 'bytes': 0, 'errors': 0}
+    latencies = []
+    body = {'limit': args.limit, 'format': args.format, 'sizes': args.sizes, 'effects': args.effects}
+
+    def one(username):
+        session = requests.Session()
+        start = time.perf_counter()
+        try:
+            response = session.post(f'{base}/generate', json=dict(body, username=username), timeout=60)
+            response.raise_for_status()
+            status_url = response.json()['status_url']
+            while True:
+                status = session.get(f'{base}{status_url}', timeout=60).json()
+                if status['status'] in ('done', 'failed'):
+                    break
+                time.sleep(args.poll_interval)
+            if status['status'] != 'done':
+                raise RuntimeError(status.get('error'))
+            download = session.get(f"{base}{status['download_url']}", timeout=300)
+            download.raise_for_status()
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                totals['wallpapers'] += status['count']
+                totals['bytes'] += len(download.content)
+        except Exception as e:
+            print(f"{username}: {e}", file=sys.stderr)
+            with lock:
+                totals['errors'] += 1
+        finally:
+            session.close()
+
+    rss_reset = _reset_peak_rss()
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            list(executor.map(one, users))
+    finally:
+        server.shutdown()
+    wall = time.perf_counter() - start
+    return summarize(latencies, wall, totals['wallpapers'], totals['bytes'], totals['errors'], rss_reset)
+
+RUNNERS = {'generator': run_generator, 'http': run_http}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--users', type=int, default=8, help='Distinct users, each with its own chart')
+    parser.add_argument('--limit', type=int, default=25, help='Albums per user')
+    parser.add_argument('--concurrency', type=int, default=4, help='Users in flight at once')
+    parser.add_argument('--format', default='png')
+    parser.add_argument('--sizes', nargs='+', default=['1080p'])
+    parser.add_argument('--effects', nargs='*', default=[])
+    parser.add_argument('--covers', type=int, default=300, help='Size of the cover pool charts draw from')
+    parser.add_argument('--cover-sizes', type=int, nargs='+', default=[300, 600, 1200, 3000],
+                        help='Native cover sizes in pixels, assigned round-robin')
+    parser.add_argument('--chart-size', type=int, default=200, help='Albums on every user chart')
+    parser.add_argument('--api-latency-ms', type=float, nargs=2, default=[50, 10], metavar=('MEAN', 'JITTER'))
+    parser.add_argument('--cdn-latency-ms', type=float, nargs=2, default=[30, 10], metavar=('MEAN', 'JITTER'))
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Fraction of CDN requests answered with 503')
+    parser.add_argument('--poll-interval', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--warm', action='store_true', help='Keep caches between modes instead of starting cold')
+    parser.add_argument('--json', help='Write results to this file')
+    args = parser.parse_args()
+
+    fake = FakeLastFM(
+        args.covers, args.cover_sizes, args.chart_size, args.api_latency_ms, args.cdn_latency_ms,
+        args.failure_rate, args.seed
+    )
+    work_dir = tempfile.mkdtemp(prefix='wallpaper-bench-')
+    # Must be set before the app is imported - these are read at import time
+    os.environ['LASTFM_API_URL'] = f'{fake.url}/2.0/'
+    os.environ.setdefault('LASTFM_API_KEY', 'benchmark')
+    os.environ.setdefault('LASTFM_SHARED_SECRET', 'benchmark')
+    os.environ['WALLPAPER_CACHE_DIR'] = os.path.join(work_dir, 'cache')
+    os.environ['JOB_DB_PATH'] = os.path.join(work_dir, 'jobs.sqlite3')
+    # The fake CDN serves a few images for every cover, which hash matching would drop as repeats
+    os.environ.setdefault('COVER_HASH_DISTANCE', '-1')
+    import lastfm_wallpaper
+
+    results = {}
+    try:
+        for mode in args.modes:
+            if not args.warm:
+                for cache in (lastfm_wallpaper.cover_cache, lastfm_wallpaper.render_cache, lastfm_wallpaper.tile_cache):
+                    shutil.rmtree(cache.root, ignore_errors=True)
+                    os.makedirs(cache.root, exist_ok=True)
+                lastfm_wallpaper.api_cache = lastfm_wallpaper.TTLResponseCache()
+            # Separate users per mode so the manifest store can't turn a run into pure reuse
+            users = [f'bench-{mode}-{i}' for i in range(args.users)]
+            results[mode] = RUNNERS[mode](lastfm_wallpaper, users, args)
+            print(json.dumps({mode: results[mode]}, indent=2))
+    finally:
+        lastfm_wallpaper.reset_render_pool()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'config': vars(args),
+        'upstream_requests': fake.requests,
+        'results': results
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
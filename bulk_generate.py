@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Generate wallpaper archives for many Last.fm users in one run, e.g. from a scheduled job.
+
+Every chart is fetched concurrently and covers shared between users are downloaded
+and rendered once. One ZIP per user is written to --output-dir, and a report with
+throughput and the dedup ratio is printed (and written to --json if given).
+
+    python bulk_generate.py alice bob carol:7day --limit 25 --format webp --output-dir archives/
+    python bulk_generate.py --users-file accounts.txt --period 1month --json report.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+
+def read_users(args):
+    specs = list(args.users)
+    if args.users_file:
+        with open(args.users_file) as f:
+            specs.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+    return specs
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('users', nargs='*', help='Usernames, optionally as username:period')
+    parser.add_argument('--users-file', help='File with one username or username:period per line')
+    parser.add_argument('--period', default='overall', help='Period for users given without one')
+    parser.add_argument('--limit', type=int, default=10, help='Albums per user')
+    parser.add_argument('--format', default='png')
+    parser.add_argument('--sizes', nargs='+', default=None, help='Presets or WIDTHxHEIGHT[:mode]')
+    parser.add_argument('--effects', nargs='*', default=[])
+    parser.add_argument('--output-dir', default='.', help='Where the per-user ZIPs are written')
+    parser.add_argument('--json', help='Write the report to this file')
+    args = parser.parse_args()
+
+    # Imported here so spawned render processes don't load the app twice
+    import lastfm_wallpaper
+
+    try:
+        charts = lastfm_wallpaper.parse_bulk_charts(read_users(args), args.period)
+        effects = lastfm_wallpaper.parse_effects(args.effects)
+        targets = lastfm_wallpaper.parse_render_targets(args.sizes, lastfm_wallpaper.default_aspect_mode(effects))
+    except ValueError as e:
+        parser.error(str(e))
+    if args.format not in lastfm_wallpaper.wallpaper_render.ENCODERS:
+        parser.error(f'Unknown format: {args.format}')
+
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    def archive_path(username, period):
+        return os.path.join(args.output_dir, f'{username}_{period}_wallpapers.zip')
+
+    def show_progress(done, total):
+        print(f'\rRendered {done}/{total} unique covers', end='', file=sys.stderr, flush=True)
+
+    generator = lastfm_wallpaper.LastFMWallpaperGenerator()
+    temp_dir = None
+    try:
+        report, temp_dir = generator.generate_bulk_to_disk(
+            charts, lastfm_wallpaper.clamp_limit(args.limit), archive_path=archive_path, progress_callback=show_progress,
+            output_format=args.format, targets=targets, effects=effects, trace_id=lastfm_wallpaper.new_trace_id()
+        )
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        lastfm_wallpaper.reset_render_pool()
+    print(file=sys.stderr)
+
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 1 if report['users_failed'] == len(charts) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,45 @@
+"""
+gunicorn settings, picked up automatically from the working directory.
+
+The app is imported and warmed up once in the master, then forked, so every
+worker - including the ones max_requests recycles - starts serving at once and
+shares numpy, Pillow and the rest copy-on-write. Set GUNICORN_PRELOAD=0 to load
+the app in each worker instead; each then warms up before taking requests.
+
+Workers serve requests on threads, so a browser following a job's event stream
+doesn't hold up everyone else; GUNICORN_THREADS sets how many per worker.
+
+Generate jobs run on background threads inside the worker, so a worker that
+is recycled or shut down stops claiming new jobs and waits most of
+graceful_timeout (GUNICORN_GRACEFUL_TIMEOUT) for running ones before it exits;
+jobs that don't finish in time are marked failed so clients aren't left polling.
+Keep --max-requests high: polls and event-stream reconnects count toward it,
+and a job still running when the grace period ends is lost.
+"""
+
+import os
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 120))
+JOB_STOP_MARGIN = 15  # Seconds of graceful_timeout kept back for marking unfinished jobs failed
+
+def when_ready(server):
+    # Runs in the master after the preloaded app is imported, before any worker is forked
+    if preload_app:
+        import lastfm_wallpaper
+        lastfm_wallpaper.warm_up()
+
+def post_worker_init(worker):
+    if not preload_app:
+        import lastfm_wallpaper
+        lastfm_wallpaper.warm_up()
+
+def worker_exit(server, worker):
+    import lastfm_wallpaper
+    # Let running jobs finish before the worker goes away, leaving time to mark the rest failed
+    # before the master's graceful_timeout runs out and it kills the worker
+    lastfm_wallpaper.job_queue.stop(max(1, worker.cfg.graceful_timeout - JOB_STOP_MARGIN))
+    # Publish the last few seconds of metrics; /metrics folds them into the exited workers' totals
+    lastfm_wallpaper.metrics.write_snapshot()
@@ -1,8 +1,5 @@
 import os
-import requests
-from PIL import Image, ImageDraw, ImageFont, ImageFilter, ImageEnhance
-import numpy as np
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS
 from dotenv import load_dotenv
 import io
@@ -11,11 +8,32 @@ from urllib.parse import urlparse
 import tempfile
 import shutil
 import logging
-import gc  # Add garbage collection
 import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import psutil  # For memory monitoring
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import itertools
+import math
+import atexit
+import base64
+import hashlib
+import importlib
+import json
+import sqlite3
+import uuid
+from collections import OrderedDict, deque
+import wallpaper_effects
+import wallpaper_lazy
+import wallpaper_metrics
+import wallpaper_render
+from wallpaper_lazy import LazyModule
+
+# Heavy dependencies load on first use, keeping worker startup and health checks fast
+requests = LazyModule('requests')
+psutil = LazyModule('psutil')  # Identifies live processes holding memory reservations
+asyncio = LazyModule('asyncio')
+multiprocessing = LazyModule('multiprocessing')
+futures_process = LazyModule('concurrent.futures.process')
+Image = LazyModule('PIL.Image')
 
 load_dotenv()
 
@@ -30,11 +48,158 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 # Get port from environment variable for deployment
 PORT = int(os.environ.get('PORT', 5001))
 
+# Last.fm API endpoint - overridable so benchmarks can point it at a local stand-in
+LASTFM_API_URL = os.environ.get('LASTFM_API_URL', 'http://ws.audioscrobbler.com/2.0/')
+
 # Performance optimization constants
 MAX_WORKERS = min(2, (os.cpu_count() or 1))  # Reduce concurrent downloads for better memory management
-MEMORY_THRESHOLD = 70  # Lower threshold to prevent memory issues
 MAX_IMAGE_SIZE = (1920, 1080)  # Reduce maximum image size to save memory
 
+# Split render pipeline - threads download covers, a process pool decodes/resizes/encodes
+DOWNLOAD_WORKERS = int(os.environ.get('DOWNLOAD_WORKERS', 8))  # Concurrent cover requests per process
+DOWNLOAD_PER_HOST = int(os.environ.get('DOWNLOAD_PER_HOST', 6))  # Concurrent requests to any one host
+MAX_COVER_BYTES = 10 * 1024 * 1024  # 10MB limit
+
+# Learned index of which resolution rewrite works for each cover
+VARIANT_NEGATIVE_TTL = 7 * 24 * 3600  # Re-probe variants known to fail after a week
+# Comma-separated rewrite patterns to stop trying, e.g. "small_800x800,770x0"
+DISABLED_URL_PATTERNS = {p.strip() for p in os.environ.get('DISABLED_URL_PATTERNS', '').split(',') if p.strip()}
+RENDER_PROCESSES = int(os.environ.get('RENDER_PROCESSES', os.cpu_count() or 1))
+RENDER_QUEUE_DEPTH = RENDER_PROCESSES * 2  # Covers a pipeline keeps queued or rendering at once
+DOWNLOAD_QUEUE_DEPTH = RENDER_QUEUE_DEPTH * 2  # Covers a pipeline keeps downloading or waiting to render
+
+# HTTP connection pooling - per-host pool sizes, everything else uses the default
+HTTP_POOL_SIZES = {
+    'ws.audioscrobbler.com': 4,  # Last.fm API
+    'lastfm.freetls.fastly.net': 16,  # Album art CDN
+}
+HTTP_DEFAULT_POOL_SIZE = 8
+HTTP_MAX_RETRIES = 3
+HTTP_RETRY_BACKOFF = 0.5  # Seconds, doubled on each retry
+HTTP_RETRY_STATUSES = (429, 500, 502, 503, 504)
+# A Last.fm API 429 goes straight to the shared token bucket (LastFMWallpaperGenerator._back_off)
+# instead of holding the calling thread through urllib3's Retry-After sleeps
+API_RETRY_STATUSES = tuple(status for status in HTTP_RETRY_STATUSES if status != 429)
+
+# Wallpaper rendering settings - part of the render cache key
+WALLPAPER_SIZE = (1920, 1080)
+SHARPNESS_FACTOR = 1.1
+DEFAULT_OUTPUT_FORMAT = wallpaper_render.DEFAULT_ENCODER  # See wallpaper_render.ENCODERS
+DEFAULT_ASPECT_MODE = wallpaper_render.DEFAULT_ASPECT_MODE  # See wallpaper_render.ASPECT_MODES
+
+# Batch rendering - each album can be rendered at several (width, height, mode) targets from one decode
+DEFAULT_TARGETS = ((WALLPAPER_SIZE[0], WALLPAPER_SIZE[1], DEFAULT_ASPECT_MODE),)
+SIZE_PRESETS = {
+    '1080p': (1920, 1080),
+    '1440p': (2560, 1440),
+    '4k': (3840, 2160),
+    'phone': (1080, 1920),
+}
+MAX_RENDER_TARGETS = 6
+DEFAULT_EFFECTS = ()  # See wallpaper_effects.EFFECTS
+
+# Collage mode - one wallpaper from a grid of the user's top album covers
+DEFAULT_COLLAGE_GRID = (5, 5)
+MAX_COLLAGE_GRID = 10
+COLLAGE_SPARE_ALBUMS = 5  # Extra albums fetched to fill cells whose cover can't be downloaded
+MAX_TARGET_DIMENSION = 7680
+
+# On-disk cache for downloaded covers and finished wallpapers, shared by all workers
+CACHE_DIR = os.environ.get('WALLPAPER_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'lastfm_wallpaper_cache'))
+COVER_CACHE_MAX_BYTES = int(os.environ.get('COVER_CACHE_MAX_MB', 128)) * 1024 * 1024
+RENDER_CACHE_MAX_BYTES = int(os.environ.get('RENDER_CACHE_MAX_MB', 512)) * 1024 * 1024
+TILE_CACHE_MAX_BYTES = int(os.environ.get('TILE_CACHE_MAX_MB', 128)) * 1024 * 1024
+CACHE_VERSION = 2  # Bump to invalidate every cached render
+
+# Last.fm API response cache - seconds each response stays fresh, by chart period
+API_CACHE_TTLS = {
+    '7day': 300,
+    '1month': 900,
+    '3month': 1800,
+    '6month': 3600,
+    '12month': 3600,
+    'overall': 7200,
+}
+USER_INFO_TTL = 600
+
+# Paged chart fetching for large limits
+TOP_ALBUMS_PAGE_SIZE = 100  # Albums per user.gettopalbums request
+TOP_ALBUMS_PAGE_CONCURRENCY = 4  # Pages in flight per chart
+API_PAGE_THREADS = 8  # Threads per process shared by every chart being paged
+MAX_ALBUM_LIMIT = int(os.environ.get('MAX_ALBUM_LIMIT', 500))
+BULK_MAX_USERS = int(os.environ.get('BULK_MAX_USERS', 100))  # Charts one bulk request may cover
+BULK_CHART_CONCURRENCY = 8  # Charts of a bulk request fetched at once
+API_CACHE_MAX_ENTRIES = 1024
+VARIANT_INDEX_PATH = os.path.join(CACHE_DIR, 'variants.sqlite3')
+
+# Perceptual hashes of downloaded covers - placeholder art and repeated artwork are dropped before rendering
+COVER_INDEX_PATH = os.path.join(CACHE_DIR, 'cover_hashes.sqlite3')
+# Covers whose 64-bit hashes differ in at most this many bits show the same art; -1 turns matching off
+COVER_HASH_DISTANCE = int(os.environ.get('COVER_HASH_DISTANCE', 6))
+MIN_COVER_DETAIL = 1.0  # Grayscale standard deviation under which a cover is one flat color
+# Last.fm's grey star for albums without art; its hash is learned the first time it is downloaded
+PLACEHOLDER_IMAGE_KEYS = {'2a96cbd8b46e442fc41c2b86b821562f'}
+PLACEHOLDER_REFRESH_SECONDS = 60
+
+# Per-user manifests of the last run, so repeat requests only render new albums
+MANIFEST_DB_PATH = os.path.join(CACHE_DIR, 'manifests.sqlite3')
+MANIFEST_RETENTION_SECONDS = 30 * 24 * 3600
+
+# Admission control - work reserves its estimated decoded pixel memory from a budget shared by all workers
+MEMORY_BUDGET_BYTES = int(os.environ.get('MEMORY_BUDGET_MB', 1024)) * 1024 * 1024
+MEMORY_LEDGER_PATH = os.path.join(CACHE_DIR, 'memory.sqlite3')
+MEMORY_POLL_INTERVAL = 0.25  # Seconds between checks for memory released by other workers
+JOB_ADMISSION_TIMEOUT = 600  # Queued jobs wait this long for memory before failing
+MEMORY_WAIT_HEARTBEAT = 30  # Waiting jobs report progress this often so they are not marked stale
+REQUEST_ADMISSION_TIMEOUT = 5  # Streaming and collage requests are turned away after this
+
+# Rate limiting - token buckets shared by all workers, per client address and per Last.fm username
+RATE_LIMIT_DB_PATH = os.path.join(CACHE_DIR, 'ratelimits.sqlite3')
+CLIENT_RATE_PER_MINUTE = float(os.environ.get('CLIENT_RATE_PER_MINUTE', 30))
+CLIENT_BURST = int(os.environ.get('CLIENT_BURST', 10))
+USER_RATE_PER_HOUR = float(os.environ.get('USER_RATE_PER_HOUR', 20))  # Wallpaper requests per Last.fm user
+USER_BURST = int(os.environ.get('USER_BURST', 5))
+TRUST_X_FORWARDED_FOR = os.environ.get('TRUST_X_FORWARDED_FOR', '0') == '1'  # Only behind a proxy that sets it
+RATE_LIMIT_IDLE_SECONDS = 3600  # Buckets untouched this long are full again and get dropped
+
+# Our own Last.fm API calls - Last.fm allows about 5 per second per IP averaged over 5 minutes
+LASTFM_API_RATE = float(os.environ.get('LASTFM_API_RATE', 4))  # Calls per second, kept under the limit
+LASTFM_API_BURST = int(os.environ.get('LASTFM_API_BURST', 20))
+LASTFM_API_BUCKET = (f'upstream:{urlparse(LASTFM_API_URL).hostname}', LASTFM_API_RATE, LASTFM_API_BURST)
+UPSTREAM_MAX_WAIT = 10  # Seconds an API call waits for quota before giving up
+UPSTREAM_PENALTY = 30  # Seconds API calls pause when Last.fm says we are over its limit
+LASTFM_RATE_LIMIT_ERROR = 29  # Last.fm's 'Rate limit exceeded' error code
+
+# Prometheus metrics - every worker publishes snapshots here and /metrics merges them
+METRICS_DIR = os.path.join(CACHE_DIR, 'metrics')
+
+# Background job queue for /generate - the SQLite store is shared by all gunicorn workers
+JOB_DB_PATH = os.environ.get('JOB_DB_PATH', os.path.join(tempfile.gettempdir(), 'lastfm_wallpaper_jobs.sqlite3'))
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', MAX_WORKERS))  # Concurrent jobs per process
+JOB_QUEUE_LIMIT = int(os.environ.get('JOB_QUEUE_LIMIT', 20))  # Queued + running jobs across all workers
+JOB_POLL_INTERVAL = 1.0  # Seconds between checks for jobs queued by other workers
+JOB_STALE_SECONDS = 300  # Running jobs with no progress for this long are reported as failed
+JOB_RETENTION_SECONDS = 3600
+
+# Server-sent progress events - any worker can stream a job's events from the shared store
+JOB_EVENT_POLL_INTERVAL = 0.25  # Seconds between checks for new events
+JOB_EVENT_STREAM_SECONDS = 60  # Streams end after this and the browser reconnects where it left off
+JOB_EVENT_KEEPALIVE = 15  # Seconds of silence before a comment line keeps proxies from closing the stream
+
+# Finished job archives - indexed by job and user in SQLite and deleted by one reaper shared by all workers
+ARTIFACT_DIR = os.path.join(CACHE_DIR, 'artifacts')
+ARTIFACT_DB_PATH = os.path.join(CACHE_DIR, 'artifacts.sqlite3')
+ARTIFACT_TTL = 1800  # Archives nobody downloads are deleted after this long
+ARTIFACT_DOWNLOAD_GRACE = 300  # Downloaded archives are kept this long so interrupted downloads can resume
+ARTIFACT_REAP_INTERVAL = 60  # Longest the reaper sleeps; earlier expiries wake it sooner
+
+# Who sends archive bytes: '' streams them from Python (gunicorn uses os.sendfile for whole files),
+# 'x-accel' hands the path to nginx with X-Accel-Redirect, 'x-sendfile' to Apache/lighttpd with X-Sendfile
+DOWNLOAD_OFFLOAD = os.environ.get('DOWNLOAD_OFFLOAD', '').lower()
+# nginx 'internal' location aliased to ARTIFACT_DIR, e.g. location /artifacts/ { internal; alias <dir>/; }
+ACCEL_REDIRECT_PREFIX = os.environ.get('ACCEL_REDIRECT_PREFIX', '/artifacts/')
+app.config['USE_X_SENDFILE'] = DOWNLOAD_OFFLOAD == 'x-sendfile'
+
 # Global error handlers
 @app.errorhandler(404)
 def not_found_error(error):
@@ -54,42 +219,1522 @@ def handle_exception(error):
     logger.error(f"Unhandled exception: {error}")
     return jsonify({'error': f'An unexpected error occurred: {str(error)}'}), 500
 
+class HTTPSessionPool:
+    """Shared keep-alive HTTP session with per-host connection pools and retries"""
+
+    def __init__(self, pool_sizes=None, default_pool_size=HTTP_DEFAULT_POOL_SIZE, api_host=None):
+        self.pool_sizes = dict(HTTP_POOL_SIZES if pool_sizes is None else pool_sizes)
+        self.default_pool_size = default_pool_size
+        # Requests to the API host don't retry 429s - see API_RETRY_STATUSES
+        self.api_host = api_host or urlparse(LASTFM_API_URL).hostname
+        self.pool_sizes.setdefault(self.api_host, default_pool_size)
+        self._lock = threading.Lock()
+        self._requests = {}
+        self._errors = {}
+        self._adapters = {}
+        self._session = None
+
+    @property
+    def session(self):
+        # Built on first use, so requests isn't imported until something is fetched
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._build_session()
+        return self._session
+
+    def _make_retry(self, statuses=HTTP_RETRY_STATUSES):
+        from urllib3.util.retry import Retry
+        return Retry(
+            total=HTTP_MAX_RETRIES,
+            backoff_factor=HTTP_RETRY_BACKOFF,
+            status_forcelist=statuses,
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            respect_retry_after_header=True,
+            raise_on_status=False  # Hand the final response back so callers can inspect it
+        )
+
+    def _make_adapter(self, pool_size, retry_statuses=HTTP_RETRY_STATUSES):
+        from requests.adapters import HTTPAdapter
+        # pool_connections is the number of per-host pools kept alive by this adapter,
+        # pool_maxsize the number of keep-alive connections kept for each of them
+        return HTTPAdapter(
+            pool_connections=max(4, len(self.pool_sizes)),
+            pool_maxsize=pool_size,
+            max_retries=self._make_retry(retry_statuses)
+        )
+
+    def _build_session(self):
+        session = requests.Session()
+        session.headers.update({'User-Agent': 'lastfm-wallpaper-generator'})
+
+        default_adapter = self._make_adapter(self.default_pool_size)
+        session.mount('http://', default_adapter)
+        session.mount('https://', default_adapter)
+        self._adapters['*'] = default_adapter
+
+        # Host-specific prefixes take precedence over the scheme-wide default
+        for host, pool_size in self.pool_sizes.items():
+            adapter = self._make_adapter(pool_size, API_RETRY_STATUSES if host == self.api_host else HTTP_RETRY_STATUSES)
+            session.mount(f'http://{host}', adapter)
+            session.mount(f'https://{host}', adapter)
+            self._adapters[host] = adapter
+
+        return session
+
+    def request(self, method, url, **kwargs):
+        """Issue a request through the shared session, counting requests per host"""
+        host = urlparse(url).hostname or 'unknown'
+        with self._lock:
+            self._requests[host] = self._requests.get(host, 0) + 1
+        try:
+            return self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            with self._lock:
+                self._errors[host] = self._errors.get(host, 0) + 1
+            raise
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request('HEAD', url, **kwargs)
+
+    def stats(self):
+        """Return per-host request counts and connection pool hit/miss counters"""
+        hosts = {}
+        for adapter in self._adapters.values():
+            for key in list(adapter.poolmanager.pools.keys()):
+                pool = adapter.poolmanager.pools.get(key)
+                if pool is None:
+                    continue
+                entry = hosts.setdefault(pool.host, {'connections_opened': 0, 'pool_requests': 0})
+                entry['connections_opened'] += pool.num_connections
+                entry['pool_requests'] += pool.num_requests
+
+        with self._lock:
+            for host, count in self._requests.items():
+                hosts.setdefault(host, {'connections_opened': 0, 'pool_requests': 0})['requests'] = count
+            for host, count in self._errors.items():
+                hosts.setdefault(host, {'connections_opened': 0, 'pool_requests': 0})['errors'] = count
+
+        totals = {'pool_hits': 0, 'pool_misses': 0, 'requests': 0, 'errors': 0}
+        for entry in hosts.values():
+            entry.setdefault('requests', 0)
+            entry.setdefault('errors', 0)
+            # Every new connection is a pool miss, every reused one a hit
+            entry['pool_misses'] = entry.pop('connections_opened')
+            entry['pool_hits'] = max(0, entry.pop('pool_requests') - entry['pool_misses'])
+            for field in totals:
+                totals[field] += entry[field]
+
+        return {'hosts': hosts, 'totals': totals}
+
+class DiskCache:
+    """Size-bounded content-addressed file cache with LRU eviction.
+
+    Entries are written to a temp file and renamed into place, so readers in
+    other gunicorn workers only ever see complete files. Hits bump the file
+    mtime, and eviction removes the least recently used files first.
+    """
+
+    def __init__(self, root, max_bytes, name=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.name = name or os.path.basename(root)
+        self._lock = threading.Lock()
+        self._bytes_since_scan = max_bytes  # Force a size scan on the first write
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def make_key(*parts):
+        """Hash the given key parts into a stable hex digest"""
+        raw = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def _touch(self, path):
+        try:
+            os.utime(path, None)
+            return True
+        except OSError:
+            return False
+
+    def _record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        cache_lookups.inc(cache=self.name, result='hit' if hit else 'miss')
+
+    def get(self, key):
+        """Return cached bytes for key, or None on a miss"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            self._record(False)
+            return None
+        self._touch(path)
+        self._record(True)
+        return data
+
+    def copy_to(self, key, dest_path):
+        """Materialize a cached entry at dest_path, returning False on a miss"""
+        path = self._path(key)
+        if not self._touch(path):
+            self._record(False)
+            return False
+        try:
+            try:
+                # A hard link avoids copying the bytes when both live on one filesystem
+                os.link(path, dest_path)
+            except OSError:
+                shutil.copyfile(path, dest_path)
+        except OSError:
+            # Evicted between the touch and the link
+            self._record(False)
+            return False
+        self._record(True)
+        return True
+
+    def put(self, key, data):
+        """Atomically store bytes under key"""
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.part-')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                raise
+        except OSError as e:
+            logger.warning(f"Failed to write cache entry {key[:12]}: {e}")
+            return
+
+        with self._lock:
+            self._bytes_since_scan += len(data)
+            should_scan = self._bytes_since_scan >= self.max_bytes // 10
+            if should_scan:
+                self._bytes_since_scan = 0
+        if should_scan:
+            self.evict()
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits its budget"""
+        entries = []
+        total = 0
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if name.startswith('.part-'):
+                    # Leftover from a worker killed mid-write
+                    if time.time() - st.st_mtime > 300:
+                        try:
+                            os.remove(path)
+                        except OSError:
+                            pass
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+
+        if total <= self.max_bytes:
+            return
+
+        # Trim to 90% so we don't rescan on every following write
+        target = int(self.max_bytes * 0.9)
+        entries.sort()
+        removed = 0
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except OSError:
+                pass
+
+        with self._lock:
+            self.evictions += removed
+        logger.info(f"Evicted {removed} entries from cache {self.root}")
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+class TTLResponseCache:
+    """In-memory TTL cache that coalesces concurrent fetches of the same key.
+
+    The first caller for a missing key runs the fetch; everyone else asking for
+    that key while it is in flight waits for and shares its result.
+    """
+
+    def __init__(self, max_entries=API_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._inflight = {}  # key -> _InFlight
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    class _InFlight:
+        def __init__(self):
+            self.event = threading.Event()
+            self.value = None
+            self.error = None
+
+    def get_or_fetch(self, key, ttl, fetch, cacheable=None):
+        """Return the cached value for key, calling fetch() at most once per expiry.
+
+        cacheable, if given, decides whether a fetched value may be stored;
+        rejected values are still handed to every coalesced caller.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            inflight = self._inflight.get(key)
+            if inflight:
+                self.coalesced += 1
+                owner = False
+            else:
+                inflight = self._InFlight()
+                self._inflight[key] = inflight
+                self.misses += 1
+                owner = True
+
+        if not owner:
+            inflight.event.wait()
+            if inflight.error:
+                raise inflight.error
+            return inflight.value
+
+        try:
+            inflight.value = fetch()
+        except BaseException as e:
+            inflight.error = e
+            raise
+        finally:
+            with self._lock:
+                if inflight.error is None and ttl > 0 and (cacheable is None or cacheable(inflight.value)):
+                    self._entries[key] = (time.time() + ttl, inflight.value)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                del self._inflight[key]
+            inflight.event.set()
+
+        return inflight.value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced
+            }
+
+class VariantIndex:
+    """Persistent record of which URL rewrite pattern works for each cover image.
+
+    Stores the best known variant per image, negative entries for variants
+    that failed, and per-pattern attempt/success counters. Backed by SQLite
+    so every gunicorn worker learns from the others.
+    """
+
+    def __init__(self, path=VARIANT_INDEX_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS best_variants (
+                    image_key TEXT PRIMARY KEY,
+                    pattern TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS failed_variants (
+                    image_key TEXT NOT NULL,
+                    pattern TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (image_key, pattern)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS pattern_stats (
+                    pattern TEXT PRIMARY KEY,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    successes INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def image_key(url):
+        """Identify a cover independently of its size prefix.
+
+        Last.fm cover URLs end in a content hash (.../300x300/<hash>.png), so
+        every size variant of one cover shares a key.
+        """
+        name = os.path.splitext(os.path.basename(urlparse(url).path))[0]
+        if len(name) >= 16:
+            return name
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def lookup(self, image_key):
+        """Return (best (pattern, url) or None, set of patterns known to fail)"""
+        with self._connect() as conn:
+            best = conn.execute(
+                'SELECT pattern, url FROM best_variants WHERE image_key = ?', (image_key,)
+            ).fetchone()
+            failed = conn.execute(
+                'SELECT pattern FROM failed_variants WHERE image_key = ? AND expires_at > ?',
+                (image_key, time.time())
+            ).fetchall()
+        return (tuple(best) if best else None), {row[0] for row in failed}
+
+    def record(self, image_key, successes=(), failures=()):
+        """Record (pattern, url) variants that worked and patterns that failed"""
+        now = time.time()
+        with self._connect() as conn:
+            for pattern in failures:
+                conn.execute(
+                    'INSERT OR REPLACE INTO failed_variants (image_key, pattern, expires_at) VALUES (?, ?, ?)',
+                    (image_key, pattern, now + VARIANT_NEGATIVE_TTL)
+                )
+                conn.execute(
+                    'DELETE FROM best_variants WHERE image_key = ? AND pattern = ?', (image_key, pattern)
+                )
+            for pattern, url in successes:
+                conn.execute(
+                    'INSERT OR REPLACE INTO best_variants (image_key, pattern, url, updated_at) VALUES (?, ?, ?, ?)',
+                    (image_key, pattern, url, now)
+                )
+                conn.execute(
+                    'DELETE FROM failed_variants WHERE image_key = ? AND pattern = ?', (image_key, pattern)
+                )
+
+            attempted = [pattern for pattern, _ in successes] + list(failures)
+            for pattern in attempted:
+                conn.execute('INSERT OR IGNORE INTO pattern_stats (pattern) VALUES (?)', (pattern,))
+                conn.execute('UPDATE pattern_stats SET attempts = attempts + 1 WHERE pattern = ?', (pattern,))
+            for pattern, _ in successes:
+                conn.execute('UPDATE pattern_stats SET successes = successes + 1 WHERE pattern = ?', (pattern,))
+
+    def pattern_stats(self):
+        """Per-pattern attempts, successes and success rate, for pruning patterns that never work"""
+        with self._connect() as conn:
+            rows = conn.execute('SELECT pattern, attempts, successes FROM pattern_stats ORDER BY pattern').fetchall()
+        return {
+            pattern: {
+                'attempts': attempts,
+                'successes': successes,
+                'success_rate': round(successes / attempts, 3) if attempts else None
+            }
+            for pattern, attempts, successes in rows
+        }
+
+class ManifestStore:
+    """Per-user record of the albums and outputs of the last generate run.
+
+    Keyed by username, period and a signature of the render settings, so a
+    run only reuses outputs rendered exactly the same way. Each album entry
+    holds its cover URL and, per output file, the render cache key and the
+    SHA-256 of the bytes. Backed by SQLite so every gunicorn worker shares it.
+    """
+
+    def __init__(self, path=MANIFEST_DB_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS manifests (
+                    username TEXT NOT NULL,
+                    period TEXT NOT NULL,
+                    signature TEXT NOT NULL,
+                    albums TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (username, period, signature)
+                )
+            """)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def signature(output_format, targets, effects):
+        """Identify the render settings a manifest was produced with"""
+        return DiskCache.make_key(
+            'manifest', CACHE_VERSION, output_format, [list(target) for target in targets], list(effects)
+        )
+
+    def get(self, username, period, signature):
+        """Return {album key: entry} from the last matching run, or None"""
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT albums FROM manifests WHERE username = ? AND period = ? AND signature = ?',
+                (username.lower(), period, signature)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, username, period, signature, albums):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO manifests (username, period, signature, albums, updated_at) VALUES (?, ?, ?, ?, ?)',
+                (username.lower(), period, signature, json.dumps(albums), now)
+            )
+            conn.execute('DELETE FROM manifests WHERE updated_at < ?', (now - MANIFEST_RETENTION_SECONDS,))
+
+class CoverIndex:
+    """Persistent perceptual hashes of downloaded covers, keyed by image like VariantIndex.
+
+    Each entry holds a cover's hash, its detail score and, for covers that
+    shouldn't become wallpapers, why: 'placeholder' for Last.fm's no-art
+    image and anything hashing close to it, 'blank' for a single flat color.
+    Once any worker has hashed a cover it is judged from its URL alone, so
+    even the known placeholder is downloaded once, to learn its hash.
+    """
+
+    def __init__(self, path=COVER_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._placeholders = None
+        self._placeholders_loaded = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS covers (
+                    image_key TEXT PRIMARY KEY,
+                    hash TEXT NOT NULL,
+                    detail REAL NOT NULL,
+                    rejected TEXT,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute('CREATE INDEX IF NOT EXISTS covers_rejected ON covers (rejected)')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def lookup(self, url):
+        """(hash, rejection reason or None) of a cover hashed before, or None"""
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT hash, rejected FROM covers WHERE image_key = ?', (VariantIndex.image_key(url),)
+            ).fetchone()
+        return (int(row[0], 16), row[1]) if row else None
+
+    def rejected(self, urls):
+        """The urls whose covers are known placeholders or blank, without downloading them"""
+        keys = {}
+        for url in urls:
+            keys.setdefault(VariantIndex.image_key(url), []).append(url)
+        if not keys:
+            return set()
+        with self._connect() as conn:
+            found = [row[0] for row in conn.execute(
+                f"SELECT image_key FROM covers WHERE rejected IS NOT NULL AND image_key IN ({', '.join('?' * len(keys))})",
+                list(keys)
+            )]
+        return {url for key in found for url in keys[key]}
+
+    def _placeholder_hashes(self):
+        # Placeholders learned by other workers show up after the next refresh
+        with self._lock:
+            if self._placeholders is None or time.monotonic() - self._placeholders_loaded > PLACEHOLDER_REFRESH_SECONDS:
+                with self._connect() as conn:
+                    rows = conn.execute("SELECT hash FROM covers WHERE rejected = 'placeholder'").fetchall()
+                self._placeholders = [int(row[0], 16) for row in rows]
+                self._placeholders_loaded = time.monotonic()
+            return self._placeholders
+
+    def classify(self, url, data):
+        """Hash downloaded cover bytes and record the verdict, returning (hash, rejection reason or None)"""
+        cover_hash, detail = wallpaper_render.cover_hash(data)
+        image_key = VariantIndex.image_key(url)
+        if image_key in PLACEHOLDER_IMAGE_KEYS or any(
+            hash_distance(cover_hash, known) <= COVER_HASH_DISTANCE for known in self._placeholder_hashes()
+        ):
+            rejected = 'placeholder'
+        elif detail < MIN_COVER_DETAIL:
+            rejected = 'blank'
+        else:
+            rejected = None
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO covers (image_key, hash, detail, rejected, updated_at) VALUES (?, ?, ?, ?, ?)',
+                (image_key, f'{cover_hash:016x}', detail, rejected, time.time())
+            )
+        if image_key in PLACEHOLDER_IMAGE_KEYS:
+            with self._lock:
+                self._placeholders = None
+        return cover_hash, rejected
+
+    def stats(self):
+        with self._connect() as conn:
+            rows = conn.execute("SELECT COALESCE(rejected, 'kept'), COUNT(*) FROM covers GROUP BY rejected").fetchall()
+        return dict(rows)
+
+def hash_distance(a, b):
+    """Number of bits two perceptual hashes differ in"""
+    return (a ^ b).bit_count()
+
+class CoverDeduper:
+    """Drops placeholder art and repeats of artwork already in one run.
+
+    check_url judges an album from the cover index before anything is
+    downloaded; check_cover hashes downloaded bytes the index didn't know.
+    Both return why the album should be skipped - 'placeholder', 'blank' or
+    'near_duplicate' - or None to keep it. Covers are kept first come, first
+    served. With deduplicate off only placeholders and blanks are dropped.
+    """
+
+    def __init__(self, index, deduplicate=True):
+        self.index = index
+        self.deduplicate = deduplicate
+        self.skipped = {}
+        self._kept = []
+        self._judged = set()
+
+    def _verdict(self, cover_hash, rejected):
+        if not rejected and self.deduplicate:
+            if any(hash_distance(cover_hash, kept) <= COVER_HASH_DISTANCE for kept in self._kept):
+                rejected = 'near_duplicate'
+            else:
+                self._kept.append(cover_hash)
+        if rejected:
+            self.skipped[rejected] = self.skipped.get(rejected, 0) + 1
+            albums_skipped.inc(reason=rejected)
+        return rejected
+
+    def check_url(self, url):
+        known = self.index.lookup(url)
+        if known is None:
+            return None
+        self._judged.add(url)
+        return self._verdict(*known)
+
+    def check_cover(self, url, data):
+        if url in self._judged:
+            return None
+        self._judged.add(url)
+        try:
+            return self._verdict(*self.index.classify(url, data))
+        except Exception as e:
+            # A cover that can't be hashed is still worth trying to render
+            logger.warning(f"Could not hash cover {url}: {e}")
+            return None
+
+class MemoryBudgetExceeded(RuntimeError):
+    """Raised when work can't be admitted within the memory budget in time"""
+
+class MemoryBudget:
+    """Admission control for the decoded pixel memory of renders.
+
+    Work reserves its estimated peak footprint before it starts and releases
+    it when done; once the budget is spoken for, new work waits for a release
+    or is turned away. Reservations live in a SQLite ledger tagged with the
+    owning process, so every gunicorn worker draws from one budget and the
+    reservations of a worker that died are reclaimed.
+    """
+
+    def __init__(self, path=MEMORY_LEDGER_PATH, budget=MEMORY_BUDGET_BYTES):
+        self.path = path
+        self.budget = budget
+        self._released = threading.Condition()
+        self._identity = None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS reservations (
+                    id TEXT PRIMARY KEY,
+                    pid INTEGER NOT NULL,
+                    started REAL NOT NULL,
+                    bytes INTEGER NOT NULL,
+                    label TEXT,
+                    created_at REAL NOT NULL
+                )
+            """)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def _process(self):
+        # (pid, start time) survives fork correctly and can't be confused with a recycled pid
+        if self._identity is None or self._identity[0] != os.getpid():
+            self._identity = (os.getpid(), psutil.Process().create_time())
+        return self._identity
+
+    @staticmethod
+    def _alive(pid, started):
+        try:
+            return psutil.Process(pid).create_time() == started
+        except psutil.Error:
+            return False
+
+    def try_reserve(self, nbytes, label=None):
+        """Reserve nbytes if they fit right now, returning the reservation ID or None.
+
+        A request larger than the whole budget is admitted alone rather than never.
+        """
+        nbytes = min(nbytes, self.budget)
+        pid, started = self._process()
+        reservation_id = uuid.uuid4().hex
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            used = conn.execute('SELECT COALESCE(SUM(bytes), 0) FROM reservations').fetchone()[0]
+            if used + nbytes > self.budget:
+                # Only look for dead owners when the budget looks full
+                owners = conn.execute('SELECT DISTINCT pid, started FROM reservations WHERE pid != ?', (pid,)).fetchall()
+                dead = [owner for owner in owners if not self._alive(*owner)]
+                for owner in dead:
+                    conn.execute('DELETE FROM reservations WHERE pid = ? AND started = ?', owner)
+                if dead:
+                    logger.warning(f"Reclaimed memory reservations of {len(dead)} exited worker(s)")
+                    used = conn.execute('SELECT COALESCE(SUM(bytes), 0) FROM reservations').fetchone()[0]
+                if used + nbytes > self.budget:
+                    conn.execute('ROLLBACK')
+                    return None
+            conn.execute(
+                'INSERT INTO reservations (id, pid, started, bytes, label, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (reservation_id, pid, started, nbytes, label, time.time())
+            )
+            conn.execute('COMMIT')
+            return reservation_id
+        finally:
+            conn.close()
+
+    def reserve(self, nbytes, label=None, timeout=JOB_ADMISSION_TIMEOUT, heartbeat=None):
+        """Wait up to timeout seconds for nbytes to fit, returning the reservation ID or None.
+
+        heartbeat, if given, is called every MEMORY_WAIT_HEARTBEAT seconds
+        while waiting so a queued job keeps showing signs of life.
+        """
+        deadline = time.monotonic() + timeout
+        next_beat = time.monotonic() + MEMORY_WAIT_HEARTBEAT
+        while True:
+            reservation_id = self.try_reserve(nbytes, label)
+            remaining = deadline - time.monotonic()
+            if reservation_id or remaining <= 0:
+                return reservation_id
+            if heartbeat and time.monotonic() >= next_beat:
+                heartbeat()
+                next_beat = time.monotonic() + MEMORY_WAIT_HEARTBEAT
+            # Releases in this process wake us at once; other workers' are seen on the next poll
+            with self._released:
+                self._released.wait(min(MEMORY_POLL_INTERVAL, remaining))
+
+    def release(self, reservation_id):
+        if not reservation_id:
+            return
+        with self._connect() as conn:
+            conn.execute('DELETE FROM reservations WHERE id = ?', (reservation_id,))
+        with self._released:
+            self._released.notify_all()
+
+    def admit(self, label, parallel_bytes, sequential_bytes, timeout=JOB_ADMISSION_TIMEOUT,
+              heartbeat=None):
+        """Admit work that can run in parallel or, in less memory, one item at a time.
+
+        Takes the parallel footprint if it fits now, otherwise waits up to
+        timeout for the sequential one. Returns (reservation ID, sequential)
+        and raises MemoryBudgetExceeded if neither could be reserved.
+        """
+        reservation_id = self.try_reserve(parallel_bytes, label)
+        if reservation_id:
+            memory_admissions.inc(mode='parallel')
+            return reservation_id, False
+        logger.info(f"Memory budget is busy, running {label} one item at a time")
+        reservation_id = self.reserve(sequential_bytes, label, timeout, heartbeat)
+        if reservation_id:
+            memory_admissions.inc(mode='sequential')
+            return reservation_id, True
+        memory_admissions.inc(mode='rejected')
+        raise MemoryBudgetExceeded(f"Not enough memory to start {label}")
+
+    def stats(self):
+        with self._connect() as conn:
+            reserved, count = conn.execute('SELECT COALESCE(SUM(bytes), 0), COUNT(*) FROM reservations').fetchone()
+        return {'budget_bytes': self.budget, 'reserved_bytes': reserved, 'reservations': count}
+
+class ReservedIterator:
+    """Iterator that holds a memory reservation until it is exhausted, fails or is closed.
+
+    Closing releases the reservation even if iteration never started, which a
+    plain generator's finally can't do - e.g. a streamed response whose
+    client left before the first chunk. Closing twice is harmless.
+    """
+
+    def __init__(self, budget, reservation, iterator):
+        self.budget = budget
+        self._reservation = reservation
+        self._iterator = iterator
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._iterator)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        with self._lock:
+            reservation, self._reservation = self._reservation, None
+        if reservation is None:
+            return
+        try:
+            self._iterator.close()
+        finally:
+            self.budget.release(reservation)
+
+class RateLimited(RuntimeError):
+    """Raised when a call can't get a token in time; retry_after is in seconds"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class RateLimiter:
+    """Token buckets shared by every gunicorn worker.
+
+    A bucket holds up to burst tokens and refills at rate tokens per second.
+    Its level and the time it was last updated live in SQLite, so all workers
+    draw from the same buckets. Work charged to several buckets, such as a
+    client and the Last.fm user it asks for, takes a token from each or from
+    none of them. A bucket with a rate of 0 or less is unlimited.
+    """
+
+    def __init__(self, path=RATE_LIMIT_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._acquired = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS buckets (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute('CREATE INDEX IF NOT EXISTS buckets_updated ON buckets (updated_at)')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    @staticmethod
+    def _level(row, rate, burst, now):
+        if row is None:
+            return burst
+        tokens, updated_at = row
+        return min(burst, tokens + max(0, now - updated_at) * rate)
+
+    def acquire(self, buckets):
+        """Take a token from every (key, rate, burst) bucket if all have one.
+
+        Returns (0, None) on success, otherwise (seconds until the emptiest
+        bucket has a token, its key) and takes nothing.
+        """
+        buckets = [bucket for bucket in buckets if bucket[1] > 0]
+        if not buckets:
+            return 0, None
+        with self._lock:
+            self._acquired += 1
+            purge = self._acquired % 1000 == 0
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            levels = []
+            retry_after, limited_by = 0, None
+            for key, rate, burst in buckets:
+                row = conn.execute('SELECT tokens, updated_at FROM buckets WHERE key = ?', (key,)).fetchone()
+                tokens = self._level(row, rate, burst, now)
+                levels.append((key, tokens))
+                if tokens < 1 and (1 - tokens) / rate > retry_after:
+                    retry_after, limited_by = (1 - tokens) / rate, key
+            if not limited_by:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)',
+                    [(key, tokens - 1, now) for key, tokens in levels]
+                )
+            if purge:
+                conn.execute('DELETE FROM buckets WHERE updated_at < ?', (now - RATE_LIMIT_IDLE_SECONDS,))
+            conn.execute('COMMIT')
+            return retry_after, limited_by
+        finally:
+            conn.close()
+
+    def wait(self, buckets, timeout):
+        """Block until acquire succeeds, raising RateLimited if that would take more than timeout seconds"""
+        deadline = time.monotonic() + timeout
+        while True:
+            retry_after, limited_by = self.acquire(buckets)
+            if not limited_by:
+                return
+            if time.monotonic() + retry_after > deadline:
+                raise RateLimited(f"Out of quota for {limited_by}", retry_after)
+            # Other workers may take the token first, so try again rather than assume it's ours
+            time.sleep(retry_after)
+
+    def drain(self, bucket, seconds):
+        """Empty a bucket so it hands out nothing for the next seconds"""
+        key, rate, _ = bucket
+        if rate <= 0:
+            return
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)',
+                (key, -seconds * rate, time.time())
+            )
+
+    def tokens(self, bucket):
+        key, rate, burst = bucket
+        with self._connect() as conn:
+            row = conn.execute('SELECT tokens, updated_at FROM buckets WHERE key = ?', (key,)).fetchone()
+        return self._level(row, rate, burst, time.time())
+
+    def stats(self):
+        with self._connect() as conn:
+            count = conn.execute('SELECT COUNT(*) FROM buckets').fetchone()[0]
+        return {'buckets': count, 'lastfm_api_tokens': round(self.tokens(LASTFM_API_BUCKET), 1)}
+
+class ArtifactStore:
+    """Index of job work directories and the ZIP archives they end in.
+
+    Each job gets a directory under ARTIFACT_DIR, registered in SQLite with
+    its username and an expiry before anything is written to it, so every
+    directory can be found by job ID or username without scanning the disk
+    and none is left behind when a job dies. The expires_at index orders
+    entries like a min-heap: the reaper peeks the earliest expiry, sleeps
+    until then and deletes what is due. Only the worker holding the reaper
+    lease deletes, so workers never race over the same directory.
+    """
+
+    # Columns added after the first release, created on existing databases at startup
+    ADDED_COLUMNS = {
+        'etag': 'TEXT'  # SHA-256 of the archive, a strong validator for conditional and range requests
+    }
+
+    def __init__(self, path=ARTIFACT_DB_PATH, root=ARTIFACT_DIR):
+        self.path = path
+        self.root = root
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._owner = None
+        os.makedirs(root, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS artifacts (
+                    id TEXT PRIMARY KEY,
+                    username TEXT NOT NULL,
+                    directory TEXT NOT NULL,
+                    zip_path TEXT,
+                    bytes INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            conn.execute('CREATE INDEX IF NOT EXISTS artifacts_expiry ON artifacts (expires_at)')
+            conn.execute('CREATE INDEX IF NOT EXISTS artifacts_user ON artifacts (username, created_at)')
+            existing = {row[1] for row in conn.execute('PRAGMA table_info(artifacts)')}
+            for column, column_type in self.ADDED_COLUMNS.items():
+                if column not in existing:
+                    conn.execute(f'ALTER TABLE artifacts ADD COLUMN {column} {column_type}')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS reaper_lease (
+                    name TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def start(self):
+        """Start this process's reaper thread (gunicorn forks after import)"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._owner = f'{os.getpid()}-{uuid.uuid4().hex}'
+        threading.Thread(target=self._reap_loop, name='artifact-reaper', daemon=True).start()
+
+    def create(self, artifact_id, username, ttl=ARTIFACT_TTL):
+        """Register and create the work directory of a job, returning its path"""
+        self.start()
+        directory = os.path.join(self.root, artifact_id)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT INTO artifacts (id, username, directory, created_at, expires_at) VALUES (?, ?, ?, ?, ?)',
+                (artifact_id, username, directory, now, now + ttl)
+            )
+        os.makedirs(directory, exist_ok=True)
+        self._wakeup.set()
+        return directory
+
+    def publish(self, artifact_id, zip_path, ttl=ARTIFACT_TTL):
+        """Record a job's finished archive and its content hash, kept for ttl seconds from now"""
+        etag = file_sha256(zip_path)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                'UPDATE artifacts SET zip_path = ?, bytes = ?, etag = ?, expires_at = ? WHERE id = ?',
+                (zip_path, os.path.getsize(zip_path), etag, now + ttl, artifact_id)
+            )
+        self._wakeup.set()
+
+    def get(self, artifact_id):
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        try:
+            row = conn.execute(
+                'SELECT * FROM artifacts WHERE id = ? AND expires_at > ?', (artifact_id, time.time())
+            ).fetchone()
+        finally:
+            conn.close()
+        return dict(row) if row else None
+
+    def latest(self, username):
+        """The newest finished, unexpired archive of a user, or None"""
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        try:
+            row = conn.execute(
+                'SELECT * FROM artifacts WHERE username = ? AND zip_path IS NOT NULL AND expires_at > ? '
+                'ORDER BY created_at DESC LIMIT 1',
+                (username, time.time())
+            ).fetchone()
+        finally:
+            conn.close()
+        return dict(row) if row else None
+
+    def expire_within(self, artifact_id, seconds, extend=False):
+        """Bring an artifact's expiry forward to at most seconds from now, or with extend push it back to at least that"""
+        bound = 'MAX' if extend else 'MIN'
+        with self._connect() as conn:
+            conn.execute(
+                f'UPDATE artifacts SET expires_at = {bound}(expires_at, ?) WHERE id = ?', (time.time() + seconds, artifact_id)
+            )
+        self._wakeup.set()
+
+    def remove(self, artifact_id):
+        """Expire an artifact now, e.g. the work directory of a failed job"""
+        self.expire_within(artifact_id, 0)
+
+    def _hold_lease(self, now):
+        # The lease outlives a few sleeps, so a reaper that died is replaced soon after
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT INTO reaper_lease (name, owner, expires_at) VALUES (?, ?, ?) '
+                'ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at '
+                'WHERE reaper_lease.owner = excluded.owner OR reaper_lease.expires_at < ?',
+                ('artifacts', self._owner, now + 3 * ARTIFACT_REAP_INTERVAL, now)
+            )
+            owner = conn.execute("SELECT owner FROM reaper_lease WHERE name = 'artifacts'").fetchone()[0]
+        return owner == self._owner
+
+    def reap(self, now=None):
+        """Delete every artifact that has expired, returning how many were removed"""
+        now = time.time() if now is None else now
+        removed = 0
+        with self._connect() as conn:
+            while True:
+                due = conn.execute(
+                    'SELECT id, directory FROM artifacts WHERE expires_at <= ? ORDER BY expires_at LIMIT 100', (now,)
+                ).fetchall()
+                if not due:
+                    return removed
+                for artifact_id, directory in due:
+                    shutil.rmtree(directory, ignore_errors=True)
+                    conn.execute('DELETE FROM artifacts WHERE id = ?', (artifact_id,))
+                    logger.info(f"Removed expired artifact {artifact_id}")
+                removed += len(due)
+
+    def _next_expiry(self):
+        with self._connect() as conn:
+            return conn.execute('SELECT MIN(expires_at) FROM artifacts').fetchone()[0]
+
+    def _reap_loop(self):
+        while True:
+            delay = ARTIFACT_REAP_INTERVAL
+            try:
+                now = time.time()
+                if self._hold_lease(now):
+                    self.reap(now)
+                    next_expiry = self._next_expiry()
+                    if next_expiry is not None:
+                        delay = min(delay, max(0.0, next_expiry - time.time()))
+            except Exception as e:
+                logger.error(f"Artifact reaper failed: {e}")
+            # New or shortened expiries in this process wake us at once; other workers' within the interval
+            self._wakeup.wait(delay)
+            self._wakeup.clear()
+
+    def stats(self):
+        with self._connect() as conn:
+            count, total, next_expiry = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(bytes), 0), MIN(expires_at) FROM artifacts'
+            ).fetchone()
+        return {'artifacts': count, 'bytes': total, 'next_expiry': next_expiry}
+
+class AsyncCoverFetcher:
+    """asyncio front end that downloads many covers concurrently.
+
+    Runs its own event loop on a background thread, so synchronous callers
+    get back a concurrent.futures.Future per cover. All requests share one
+    global concurrency limit plus a per-host limit. Instead of walking the
+    resolution variants one by one, every variant is HEAD-probed at once and
+    the highest-resolution one that exists is fetched.
+
+    The blocking HTTP calls still go through the shared pooled session, so
+    keep-alive, retries and pool counters apply unchanged.
+    """
+
+    def __init__(self, max_concurrency=DOWNLOAD_WORKERS, per_host=DOWNLOAD_PER_HOST):
+        self.per_host = per_host
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='cover-io')
+        self._global_limit = asyncio.Semaphore(max_concurrency)
+        self._host_limits = {}
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'covers': 0, 'cache_hits': 0, 'index_hits': 0, 'probes': 0,
+            'probe_hits': 0, 'downloads': 0, 'failures': 0
+        }
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name='cover-fetcher', daemon=True).start()
+
+    def submit(self, generator, url):
+        """Schedule a cover download, returning a Future resolving to bytes or None"""
+        return asyncio.run_coroutine_threadsafe(self._fetch(generator, url), self._loop)
+
+    def _count(self, field, amount=1):
+        with self._stats_lock:
+            self._stats[field] += amount
+
+    async def _limited(self, url, func, *args):
+        # Semaphores are only touched from the loop thread, so no lock is needed
+        host = urlparse(url).hostname or 'unknown'
+        host_limit = self._host_limits.get(host)
+        if host_limit is None:
+            host_limit = self._host_limits[host] = asyncio.Semaphore(self.per_host)
+        async with self._global_limit:
+            async with host_limit:
+                return await self._loop.run_in_executor(self._executor, func, *args)
+
+    @staticmethod
+    def _download(generator, pattern, url):
+        """Download a variant, returning (bytes or None, True if it definitely doesn't exist)"""
+        start = time.perf_counter()
+        data, status = generator._download_variant(url)
+        cover_download_latency.observe(time.perf_counter() - start, variant=pattern, outcome='ok' if data else 'failed')
+        return data, status in (404, 410)
+
+    def _probe_variant(self, generator, url):
+        """HEAD a variant: True if it exists, False if it definitely doesn't, None if unknown"""
+        try:
+            response = generator.http.head(url, timeout=5, allow_redirects=True)
+        except requests.exceptions.RequestException:
+            return None
+        
+        if response.status_code == 200:
+            content_length = response.headers.get('content-length')
+            return not (content_length and int(content_length) > MAX_COVER_BYTES)
+        if response.status_code in (404, 410):
+            return False
+        # Some servers refuse HEAD (405/501) - that says nothing about the image
+        return None
+
+    async def _fetch(self, generator, url):
+        self._count('covers')
+        try:
+            # A cached cover skips the network entirely
+            cover_key = DiskCache.make_key('cover', url)
+            cached_data = await self._loop.run_in_executor(self._executor, generator.cover_cache.get, cover_key)
+            if cached_data:
+                self._count('cache_hits')
+                return cached_data
+            
+            # Go straight to the variant that worked last time
+            index = generator.variant_index
+            image_key = index.image_key(url)
+            best, failed = await self._loop.run_in_executor(self._executor, index.lookup, image_key)
+            if best:
+                pattern, best_url = best
+                data, gone = await self._limited(best_url, self._download, generator, pattern, best_url)
+                if data:
+                    self._count('index_hits')
+                    await self._store(generator, cover_key, data, image_key, successes=[best])
+                    return data
+                failed.add(pattern)
+                # Only a variant that is gone is remembered; a timeout or 5xx may pass
+                if gone:
+                    await self._loop.run_in_executor(self._executor, lambda: index.record(image_key, failures=[pattern]))
+            
+            # Best variants first, original URL last, skipping ones known to fail
+            variants = [(pattern, variant) for pattern, variant in generator._get_url_variants(url) if pattern not in failed]
+            if not variants:
+                variants = [('original', url)]
+            probes = await asyncio.gather(*(
+                self._limited(variant, self._probe_variant, generator, variant) for _, variant in variants
+            ))
+            self._count('probes', len(variants))
+            
+            found = [entry for entry, ok in zip(variants, probes) if ok]
+            missing = [pattern for (pattern, _), ok in zip(variants, probes) if ok is False]
+            self._count('probe_hits', len(found))
+            candidates = found + [entry for entry, ok in zip(variants, probes) if ok is None]
+            if ('original', url) not in candidates:
+                candidates.append(('original', url))
+            
+            for pattern, variant in candidates:
+                data, gone = await self._limited(variant, self._download, generator, pattern, variant)
+                if data:
+                    self._count('downloads')
+                    await self._store(generator, cover_key, data, image_key, successes=[(pattern, variant)], failures=missing)
+                    return data
+                if gone and pattern not in missing:
+                    missing.append(pattern)
+            
+            await self._loop.run_in_executor(self._executor, lambda: index.record(image_key, failures=missing))
+            logger.error(f"All download attempts failed for {url}")
+            self._count('failures')
+            return None
+            
+        except Exception as e:
+            logger.error(f"Error fetching cover {url}: {e}")
+            self._count('failures')
+            return None
+
+    async def _store(self, generator, cover_key, data, image_key, successes=(), failures=()):
+        """Cache downloaded bytes and teach the variant index what worked"""
+        def store():
+            generator.cover_cache.put(cover_key, data)
+            generator.variant_index.record(image_key, successes=successes, failures=failures)
+        await self._loop.run_in_executor(self._executor, store)
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats)
+
+_cover_fetcher = None
+_cover_fetcher_pid = None
+_cover_fetcher_lock = threading.Lock()
+
+def get_cover_fetcher():
+    """Return this process's cover fetcher, creating it lazily after gunicorn forks"""
+    global _cover_fetcher, _cover_fetcher_pid
+    with _cover_fetcher_lock:
+        if _cover_fetcher is None or _cover_fetcher_pid != os.getpid():
+            _cover_fetcher = AsyncCoverFetcher()
+            _cover_fetcher_pid = os.getpid()
+        return _cover_fetcher
+
+_render_pool = None
+_render_pool_pid = None
+_render_pool_lock = threading.Lock()
+
+def get_render_pool():
+    """Return this process's render pool, creating it lazily after gunicorn forks"""
+    global _render_pool, _render_pool_pid
+    with _render_pool_lock:
+        if _render_pool is None or _render_pool_pid != os.getpid():
+            # spawn rather than fork - forking a process with live threads can deadlock
+            _render_pool = futures_process.ProcessPoolExecutor(
+                max_workers=RENDER_PROCESSES,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            _render_pool_pid = os.getpid()
+            logger.info(f"Started render pool with {RENDER_PROCESSES} processes")
+        return _render_pool
+
+def reset_render_pool():
+    """Drop a broken render pool so the next caller gets a fresh one"""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is not None and _render_pool_pid == os.getpid():
+            _render_pool.shutdown(wait=False, cancel_futures=True)
+        _render_pool = None
+
+atexit.register(reset_render_pool)
+
+_page_executor = None
+_page_executor_pid = None
+_page_executor_lock = threading.Lock()
+
+def get_page_executor():
+    """Return this process's thread pool for Last.fm chart pages, creating it lazily after gunicorn forks"""
+    global _page_executor, _page_executor_pid
+    with _page_executor_lock:
+        if _page_executor is None or _page_executor_pid != os.getpid():
+            _page_executor = ThreadPoolExecutor(max_workers=API_PAGE_THREADS, thread_name_prefix='lastfm-pages')
+            _page_executor_pid = os.getpid()
+        return _page_executor
+
+class TopAlbumPager:
+    """A user's top albums, fetched page by page so large limits stream in.
+
+    Iterating yields lists of albums in chart order, one per Last.fm page, as
+    soon as each page and every page before it has arrived. Up to
+    TOP_ALBUMS_PAGE_CONCURRENCY pages are requested at once through the API
+    cache. Albums without a cover, or whose cover URL was already yielded,
+    are dropped, and no more pages are requested once enough usable albums
+    are in hand or in flight. expected is the limit, narrowed to the size of
+    the user's chart once the first page arrives. Covers the cover index
+    already knows to be placeholders are dropped from their URL alone.
+    """
+
+    def __init__(self, generator, username, period="overall", limit=50, page_size=TOP_ALBUMS_PAGE_SIZE):
+        self.generator = generator
+        self.username = username
+        self.period = period
+        self.limit = limit
+        # Small limits stay a single request, exactly as before paging
+        self.page_size = max(1, min(page_size, limit))
+        self.expected = limit
+        self.pages_fetched = 0
+        self.duplicates = 0
+        self.placeholders = 0
+
+    def _fetch_page(self, page):
+        params = {
+            'method': 'user.gettopalbums',
+            'user': self.username,
+            'api_key': self.generator.api_key,
+            'format': 'json',
+            'period': self.period,
+            'limit': self.page_size,
+            'page': page
+        }
+        data = self.generator._api_get(params, timeout=15, ttl=API_CACHE_TTLS.get(self.period, USER_INFO_TTL))
+        if 'error' in data:
+            raise ValueError(f"Last.fm error: {data.get('message', 'Unknown error')}")
+        top_albums = data.get('topalbums', {})
+        attributes = top_albums.get('@attr', {})
+        return top_albums.get('album', []), int(attributes.get('totalPages') or 0), int(attributes.get('total') or 0)
+
+    def __iter__(self):
+        executor = get_page_executor()
+        in_flight = {}
+        next_page = 1
+        total_pages = None
+        seen_urls = set()
+        found = 0
+
+        def fill_window():
+            nonlocal next_page
+            while (len(in_flight) < TOP_ALBUMS_PAGE_CONCURRENCY
+                   and found + len(in_flight) * self.page_size < self.limit
+                   and (total_pages is None or next_page <= total_pages)):
+                in_flight[next_page] = executor.submit(self._fetch_page, next_page)
+                next_page += 1
+
+        try:
+            page = 1
+            fill_window()
+            while page in in_flight and found < self.limit:
+                try:
+                    albums, page_count, chart_size = in_flight.pop(page).result()
+                except Exception as e:
+                    if page == 1:
+                        logger.error(f"Error fetching albums for user {self.username}: {e}")
+                    else:
+                        logger.warning(f"Stopping at page {page} of {self.username}'s chart: {e}")
+                    return
+                self.pages_fetched += 1
+                if page == 1:
+                    total_pages = page_count
+                    if chart_size:
+                        self.expected = min(self.limit, chart_size)
+
+                image_urls = [self.generator.get_best_album_image(album) for album in albums]
+                rejected = self.generator.cover_index.rejected([image_url for image_url in image_urls if image_url])
+                usable = []
+                for album, image_url in zip(albums, image_urls):
+                    if not image_url:
+                        continue
+                    if image_url in rejected:
+                        self.placeholders += 1
+                        albums_skipped.inc(reason='placeholder')
+                        continue
+                    if image_url in seen_urls:
+                        self.duplicates += 1
+                        continue
+                    seen_urls.add(image_url)
+                    usable.append(album)
+                usable = usable[:self.limit - found]
+                found += len(usable)
+                if not albums:
+                    return
+                # Request more pages before handing this one over, so they load while it renders
+                page += 1
+                fill_window()
+                yield usable
+        finally:
+            for future in in_flight.values():
+                future.cancel()
+
+# Metrics recorded by this worker
+metrics = wallpaper_metrics.Registry(METRICS_DIR)
+api_latency = metrics.histogram('lastfm_api_request_seconds', 'Last.fm API calls sent upstream', ['method'])
+cover_download_latency = metrics.histogram(
+    'cover_download_seconds', 'Cover downloads per URL variant pattern', ['variant', 'outcome']
+)
+render_stage_latency = metrics.histogram('render_stage_seconds', 'Render time per stage and target', ['stage'])
+zip_latency = metrics.histogram('zip_package_seconds', 'Packaging a finished job into its ZIP')
+generate_latency = metrics.histogram(
+    'generate_job_seconds', 'Generate jobs from submission until they finish', ['outcome']
+)
+cache_lookups = metrics.counter('cache_lookups_total', 'Cache lookups by cache and result', ['cache', 'result'])
+albums_skipped = metrics.counter('albums_skipped_total', 'Albums that produced no wallpaper', ['reason'])
+memory_admissions = metrics.counter(
+    'memory_admissions_total', 'Work admitted pipelined, reduced to one album at a time, or rejected', ['mode']
+)
+# Memory-based reductions are memory_admissions_total{mode!="parallel"}; this only counts MAX_ALBUM_LIMIT clamps
+limit_clamps = metrics.counter(
+    'album_limit_clamped_total',
+    'Requests whose album limit was lowered to MAX_ALBUM_LIMIT (memory reductions are memory_admissions_total)'
+)
+rate_limit_rejections = metrics.counter(
+    'rate_limit_rejections_total', 'Requests and Last.fm API calls turned away by a rate limit', ['scope']
+)
+upstream_quota_wait = metrics.histogram('lastfm_api_quota_wait_seconds', 'Time API calls waited for Last.fm quota')
+
+# Shared by every generator instance in this worker
+http_pool = HTTPSessionPool()
+cover_cache = DiskCache(os.path.join(CACHE_DIR, 'covers'), COVER_CACHE_MAX_BYTES, 'covers')
+render_cache = DiskCache(os.path.join(CACHE_DIR, 'wallpapers'), RENDER_CACHE_MAX_BYTES, 'wallpapers')
+tile_cache = DiskCache(os.path.join(CACHE_DIR, 'tiles'), TILE_CACHE_MAX_BYTES, 'tiles')
+canvas_pool = wallpaper_render.CanvasPool()
+api_cache = TTLResponseCache()
+variant_index = VariantIndex()
+cover_index = CoverIndex()
+manifest_store = ManifestStore()
+memory_budget = MemoryBudget()
+artifact_store = ArtifactStore()
+rate_limiter = RateLimiter()
+
 class LastFMWallpaperGenerator:
     def __init__(self):
         self.api_key = os.getenv('LASTFM_API_KEY')
         self.shared_secret = os.getenv('LASTFM_SHARED_SECRET')
-        self.base_url = "http://ws.audioscrobbler.com/2.0/"
+        self.base_url = LASTFM_API_URL
+        self.http = http_pool
+        self.cover_cache = cover_cache
+        self.render_cache = render_cache
+        self.tile_cache = tile_cache
+        self.api_cache = api_cache
+        self.variant_index = variant_index
+        self.cover_index = cover_index
         
         if not self.api_key:
             raise ValueError("LASTFM_API_KEY environment variable is required")
         if not self.shared_secret:
             raise ValueError("LASTFM_SHARED_SECRET environment variable is required")
     
-    def check_memory_usage(self):
-        """Check current memory usage and return True if it's safe to continue"""
-        try:
-            # Force garbage collection before checking
-            gc.collect()
-            
-            memory_percent = psutil.virtual_memory().percent
-            if memory_percent > MEMORY_THRESHOLD:
-                logger.warning(f"Memory usage high: {memory_percent}%")
-                
-                # Try more aggressive cleanup
-                gc.collect()
-                
-                # Check again after cleanup
-                memory_percent = psutil.virtual_memory().percent
-                if memory_percent > MEMORY_THRESHOLD:
-                    logger.warning(f"Memory still high after cleanup: {memory_percent}%")
-                    return False
-                else:
-                    logger.info(f"Memory reduced to {memory_percent}% after cleanup")
-            
-            return True
-        except:
-            return True  # If psutil fails, assume it's safe to continue
+    def _api_get(self, params, timeout, ttl):
+        """Call the Last.fm API through the shared response cache.
+
+        Identical concurrent calls share one upstream request. Error payloads
+        are returned to the caller but never cached.
+        """
+        # Usernames are case-insensitive on Last.fm
+        key = (
+            params.get('method'),
+            str(params.get('user', '')).lower(),
+            params.get('period'),
+            params.get('limit'),
+            params.get('page')
+        )
+        
+        fetched = False
+        
+        def fetch():
+            nonlocal fetched
+            fetched = True
+            self._take_api_quota()
+            with api_latency.time(method=params.get('method')):
+                response = self.http.get(self.base_url, params=params, timeout=timeout)
+                if response.status_code == 429:
+                    self._back_off(response.headers.get('Retry-After'))
+                response.raise_for_status()
+                data = response.json()
+            if data.get('error') == LASTFM_RATE_LIMIT_ERROR:
+                self._back_off()
+            return data
         
+        data = self.api_cache.get_or_fetch(key, ttl, fetch, cacheable=lambda data: 'error' not in data)
+        cache_lookups.inc(cache='api', result='miss' if fetched else 'hit')
+        return data
+    
+    @staticmethod
+    def _take_api_quota():
+        """Wait for a token from the Last.fm API bucket every worker shares, or raise RateLimited"""
+        started = time.monotonic()
+        try:
+            rate_limiter.wait([LASTFM_API_BUCKET], UPSTREAM_MAX_WAIT)
+        except RateLimited:
+            rate_limit_rejections.inc(scope='lastfm_api')
+            raise
+        upstream_quota_wait.observe(time.monotonic() - started)
+
+    @staticmethod
+    def _back_off(retry_after=None):
+        """Stop every worker's API calls for a while after Last.fm reports we are over its limit"""
+        try:
+            seconds = max(float(retry_after), 1)
+        except (TypeError, ValueError):
+            seconds = UPSTREAM_PENALTY
+        logger.warning(f"Last.fm rate limited us, pausing API calls for {seconds:.0f}s")
+        rate_limiter.drain(LASTFM_API_BUCKET, seconds)
+
     def validate_username(self, username):
         """Validate if a Last.fm username exists"""
         params = {
@@ -100,12 +1745,7 @@ class LastFMWallpaperGenerator:
         }
         
         try:
-            response = requests.get(self.base_url, params=params, timeout=10)
-            if response.status_code == 404:
-                return False, "Username not found on Last.fm"
-            
-            response.raise_for_status()
-            data = response.json()
+            data = self._api_get(params, timeout=10, ttl=USER_INFO_TTL)
             
             if 'error' in data:
                 return False, f"Last.fm error: {data.get('message', 'Unknown error')}"
@@ -119,120 +1759,123 @@ class LastFMWallpaperGenerator:
             
             return False, "Invalid response from Last.fm"
             
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                return False, "Username not found on Last.fm"
+            return False, f"Network error: {str(e)}"
         except requests.exceptions.Timeout:
             return False, "Request timeout - please try again"
         except requests.exceptions.RequestException as e:
             return False, f"Network error: {str(e)}"
+        except RateLimited:
+            raise
         except Exception as e:
             return False, f"Validation error: {str(e)}"
     
     def get_user_top_albums(self, username, period="overall", limit=50):
-        """Fetch user's top albums from Last.fm API"""
-        params = {
-            'method': 'user.gettopalbums',
-            'user': username,
-            'api_key': self.api_key,
-            'format': 'json',
-            'period': period,
-            'limit': limit
-        }
-        
-        try:
-            response = requests.get(self.base_url, params=params, timeout=15)
-            response.raise_for_status()
-            data = response.json()
-            
-            if 'topalbums' in data and 'album' in data['topalbums']:
-                return data['topalbums']['album']
-            else:
-                return []
-        except Exception as e:
-            logger.error(f"Error fetching albums for user {username}: {e}")
-            return []
+        """Fetch user's top albums from Last.fm API, skipping albums without a cover or with a repeated one"""
+        return [album for page in self.iter_top_album_pages(username, period, limit) for album in page]
+    
+    def iter_top_album_pages(self, username, period="overall", limit=50):
+        """Top albums as a TopAlbumPager - iterate it for lists of albums as each page arrives"""
+        return TopAlbumPager(self, username, period, limit)
     
     def download_image_optimized(self, url):
         """Optimized image download with memory management and quality handling"""
         try:
-            # Check memory before downloading
-            if not self.check_memory_usage():
-                logger.warning("Skipping download due to high memory usage")
+            data = self.download_image_bytes(url)
+            if not data:
                 return None
             
-            # Try high-resolution URLs first
-            high_res_urls = self._get_high_res_urls(url)
-            
-            for attempt_url in high_res_urls:
-                try:
-                    # Use streaming download with smaller chunks for memory efficiency
-                    response = requests.get(attempt_url, timeout=10, stream=True)
-                    response.raise_for_status()
-                    
-                    # Check content length to avoid downloading huge files
-                    content_length = response.headers.get('content-length')
-                    if content_length and int(content_length) > 10 * 1024 * 1024:  # 10MB limit
-                        logger.warning(f"Image too large: {content_length} bytes")
-                        continue
-                    
-                    # Download in chunks to manage memory
-                    image_data = io.BytesIO()
-                    total_size = 0
-                    for chunk in response.iter_content(chunk_size=4096):
-                        total_size += len(chunk)
-                        if total_size > 10 * 1024 * 1024:  # 10MB limit
-                            break
-                        image_data.write(chunk)
-                    
-                    image_data.seek(0)
-                    
-                    # Load and immediately optimize image
-                    image = Image.open(image_data)
-                    
-                    # Limit image size to prevent memory issues
-                    if image.size[0] > MAX_IMAGE_SIZE[0] or image.size[1] > MAX_IMAGE_SIZE[1]:
-                        image.thumbnail(MAX_IMAGE_SIZE, Image.Resampling.LANCZOS)
-                    
-                    # Convert to RGB immediately
-                    if image.mode != 'RGB':
-                        image = image.convert('RGB')
-                    
-                    logger.info(f"Downloaded optimized image: {image.size}")
-                    return image
-                    
-                except Exception as e:
-                    logger.debug(f"Failed to download from {attempt_url}: {e}")
-                    continue
-            
-            logger.error(f"All download attempts failed")
-            return None
+            image = self._decode_image(data)
+            logger.info(f"Downloaded optimized image: {image.size}")
+            return image
                 
         except Exception as e:
             logger.error(f"Error in download_image_optimized: {e}")
             return None
     
+    def download_image_bytes(self, url):
+        """Download the best available cover variant as compressed bytes"""
+        return get_cover_fetcher().submit(self, url).result()
+    
+    def _download_variant(self, attempt_url):
+        """Download one URL variant, returning (image bytes or None, HTTP status or None).
+
+        The status lets callers tell a variant that doesn't exist (404/410)
+        from one that failed for a reason that may not last.
+        """
+        status = None
+        try:
+            # Use streaming download with smaller chunks for memory efficiency.
+            # The context manager hands the connection back to the pool.
+            with self.http.get(attempt_url, timeout=10, stream=True) as response:
+                status = response.status_code
+                response.raise_for_status()
+                
+                # Check content length to avoid downloading huge files
+                content_length = response.headers.get('content-length')
+                if content_length and int(content_length) > MAX_COVER_BYTES:
+                    logger.warning(f"Image too large: {content_length} bytes")
+                    return None, status
+                
+                # Download in chunks to manage memory
+                image_data = io.BytesIO()
+                total_size = 0
+                for chunk in response.iter_content(chunk_size=4096):
+                    total_size += len(chunk)
+                    if total_size > MAX_COVER_BYTES:
+                        # Don't try to decode a truncated download
+                        logger.warning(f"Image too large: over 10MB from {attempt_url}")
+                        return None, status
+                    image_data.write(chunk)
+            
+            data = image_data.getvalue()
+            
+            # Only hand back bytes that are actually an image
+            with Image.open(io.BytesIO(data)) as probe:
+                probe.verify()
+            
+            return data, status
+            
+        except Exception as e:
+            logger.debug(f"Failed to download from {attempt_url}: {e}")
+            return None, status
+    
+    def _decode_image(self, data):
+        """Decode raw image bytes into a size-limited RGB image"""
+        return wallpaper_render.decode_cover(data, MAX_IMAGE_SIZE)
+    
     def _get_high_res_urls(self, url):
         """Generate high-resolution URL variants"""
+        return [variant_url for _, variant_url in self._get_url_variants(url)]
+    
+    def _get_url_variants(self, url):
+        """Generate (pattern, url) high-resolution variants, best first, original last"""
         high_res_urls = []
         
         # Pattern 1: Replace size indicators with larger ones
-        high_res_urls.append(url.replace('/300x300/', '/1200x1200/').replace('300x300', '1200x1200'))
-        high_res_urls.append(url.replace('/300x300/', '/800x800/').replace('300x300', '800x800'))
+        high_res_urls.append(('1200x1200', url.replace('/300x300/', '/1200x1200/').replace('300x300', '1200x1200')))
+        high_res_urls.append(('800x800', url.replace('/300x300/', '/800x800/').replace('300x300', '800x800')))
         
         # Pattern 2: Replace small size indicators
-        high_res_urls.append(url.replace('174s', '800x800').replace('64s', '800x800'))
+        high_res_urls.append(('small_800x800', url.replace('174s', '800x800').replace('64s', '800x800')))
         
         # Pattern 3: Last.fm specific patterns
         if 'lastfm' in url:
-            high_res_urls.append(url.replace('/i/u/300x300/', '/i/u/ar0/').replace('/i/u/174s/', '/i/u/ar0/'))
-            high_res_urls.append(url.replace('/i/u/300x300/', '/i/u/770x0/').replace('/i/u/174s/', '/i/u/770x0/'))
+            high_res_urls.append(('ar0', url.replace('/i/u/300x300/', '/i/u/ar0/').replace('/i/u/174s/', '/i/u/ar0/')))
+            high_res_urls.append(('770x0', url.replace('/i/u/300x300/', '/i/u/770x0/').replace('/i/u/174s/', '/i/u/770x0/')))
         
         # Remove duplicates and add original as fallback
         seen = set()
         unique_urls = []
-        for url_attempt in high_res_urls:
+        for pattern, url_attempt in high_res_urls:
+            if pattern in DISABLED_URL_PATTERNS:
+                continue
             if url_attempt not in seen and url_attempt != url:
                 seen.add(url_attempt)
-                unique_urls.append(url_attempt)
-        unique_urls.append(url)
+                unique_urls.append((pattern, url_attempt))
+        unique_urls.append(('original', url))
         
         return unique_urls
     
@@ -240,26 +1883,23 @@ class LastFMWallpaperGenerator:
         """Minimal image enhancement to reduce processing overhead"""
         try:
             # Only apply essential enhancements to save processing time
-            enhancer = ImageEnhance.Sharpness(image)
-            image = enhancer.enhance(1.1)  # Reduced sharpness enhancement
-            return image
+            return wallpaper_render.sharpen(image, SHARPNESS_FACTOR)  # Reduced sharpness enhancement
         except Exception as e:
             logger.warning(f"Failed to enhance image: {e}")
             return image
 
-    def create_wallpaper_optimized(self, album_cover, album_name, artist_name, wallpaper_size=(1920, 1080)):
-        """Create wallpaper with album cover filling the entire screen - NO BORDERS"""
+    def create_wallpaper_optimized(self, album_cover, album_name, artist_name, wallpaper_size=WALLPAPER_SIZE,
+                                   mode=DEFAULT_ASPECT_MODE):
+        """Create wallpaper with album cover filling the entire screen - NO BORDERS (unless mode is 'fit')"""
         if not album_cover:
             return None
         
         try:
-            wallpaper_width, wallpaper_height = wallpaper_size
-            
             # Minimal enhancement to save processing time
             album_cover = self.enhance_image_minimal(album_cover)
             
-            # Resize album cover to fill the ENTIRE 1920x1080 screen - NO BORDERS
-            album_cover = album_cover.resize((wallpaper_width, wallpaper_height), Image.Resampling.LANCZOS)
+            # Resize album cover to the wallpaper size using the requested aspect mode
+            album_cover = wallpaper_render.resize_to_target(album_cover, wallpaper_size, mode)
             
             # Return the resized album cover as the wallpaper (no black canvas needed)
             return album_cover
@@ -268,127 +1908,957 @@ class LastFMWallpaperGenerator:
             logger.error(f"Error creating wallpaper for {artist_name} - {album_name}: {e}")
             return None
     
-    def process_single_album(self, album_data, temp_dir, index, total):
-        """Process a single album - designed for parallel execution"""
+    def get_render_cache_key(self, image_url, wallpaper_size=WALLPAPER_SIZE, output_format=DEFAULT_OUTPUT_FORMAT,
+                             mode=DEFAULT_ASPECT_MODE, effects=DEFAULT_EFFECTS):
+        """Cache key for a finished wallpaper - changes whenever its bytes would"""
+        encoder = wallpaper_render.ENCODERS[output_format]
+        return DiskCache.make_key(
+            'wallpaper', CACHE_VERSION, image_url, list(wallpaper_size),
+            {'sharpness': SHARPNESS_FACTOR, 'resample': 'lanczos', 'mode': mode, 'effects': list(effects),
+             'encoder': output_format, 'options': encoder['options']}
+        )
+    
+    @staticmethod
+    def get_preview_cache_key(image_url):
+        """Cache key for a cover's progress preview - the same for every size, format and effect"""
+        return DiskCache.make_key(
+            'preview', CACHE_VERSION, image_url,
+            {'size': list(wallpaper_render.PREVIEW_SIZE), 'quality': wallpaper_render.PREVIEW_QUALITY}
+        )
+    
+    def album_event(self, results):
+        """Progress event for a finished album and its cached preview JPEG, as (event, preview or None).
+
+        results are the album's saved files, or None if it was skipped.
+        """
+        if not results:
+            return {'status': 'skipped'}, None
+        first = results[0]
+        if first.get('reused'):
+            status = 'reused'
+        elif any(result.get('encode_ms') is not None for result in results):
+            status = 'rendered'
+        else:
+            status = 'cached'
+        event = {'status': status, 'title': first['title'], 'files': [result['filename'] for result in results]}
+        return event, self.render_cache.get(self.get_preview_cache_key(first['image_url']))
+    
+    def _render_keys(self, image_url, output_format, targets, effects=DEFAULT_EFFECTS):
+        return [
+            self.get_render_cache_key(image_url, (width, height), output_format, mode, effects)
+            for width, height, mode in targets
+        ]
+    
+    def _render_output(self, image_url, album_name, artist_name, render_keys, output_format=DEFAULT_OUTPUT_FORMAT,
+                       targets=DEFAULT_TARGETS, effects=DEFAULT_EFFECTS, trace_id=None, deduper=None):
+        """Download a cover once, render and encode it for every target, storing each in the render cache.
+
+        Returns a list of (encoded bytes, encode time in ms, stage timings) in targets order, or None.
+        deduper, a CoverDeduper, can turn the cover away once it is downloaded.
+        """
+        # Download album cover
+        cover_data = self.download_image_bytes(image_url)
+        if not cover_data:
+            albums_skipped.inc(reason='download_failed')
+            return None
+        
+        if deduper:
+            rejected = deduper.check_cover(image_url, cover_data)
+            if rejected:
+                logger.info(f"{trace_prefix(trace_id)}Skipping {artist_name} - {album_name}: {rejected.replace('_', ' ')} cover")
+                return None
+        
+        # Decode near wallpaper size and resample once per target, same as the render pool
         try:
-            # Check memory before processing
-            if not self.check_memory_usage():
-                logger.warning(f"Skipping album {index+1}/{total} due to memory constraints")
+            outputs, preview = wallpaper_render.render_cover_set_with_preview(
+                cover_data, MAX_IMAGE_SIZE, targets, SHARPNESS_FACTOR, output_format, effects
+            )
+        except Exception as e:
+            logger.error(f"{trace_prefix(trace_id)}Error creating wallpaper for {artist_name} - {album_name}: {e}")
+            albums_skipped.inc(reason='render_failed')
+            return None
+        
+        self._observe_render(trace_id, artist_name, album_name, outputs)
+        self._cache_render(image_url, render_keys, outputs, preview)
+        return outputs
+    
+    def _cache_render(self, image_url, render_keys, outputs, preview):
+        """Store a fresh render's outputs and its cover preview in the render cache"""
+        for render_key, (output, _, _) in zip(render_keys, outputs):
+            self.render_cache.put(render_key, output)
+        self.render_cache.put(self.get_preview_cache_key(image_url), preview)
+    
+    @staticmethod
+    def _observe_render(trace_id, artist_name, album_name, outputs):
+        """Record the stage timings of a fresh render and log them under the trace ID"""
+        totals = {}
+        for _, _, stage_ms in outputs:
+            for stage, ms in stage_ms.items():
+                render_stage_latency.observe(ms / 1000, stage=stage)
+                totals[stage] = totals.get(stage, 0) + ms
+        stages = ', '.join(f"{stage} {ms:.0f}ms" for stage, ms in totals.items())
+        logger.info(f"{trace_prefix(trace_id)}Rendered {artist_name} - {album_name}: {stages}")
+    
+    @staticmethod
+    def album_key(album_data):
+        """Identify an album across chart fetches"""
+        return f"{album_data['artist']['name']}\n{album_data['name']}".lower()
+    
+    def _restore_album(self, entry, album_data, temp_dir):
+        """Copy an album's outputs from the last run into temp_dir, or None if any is gone or changed"""
+        if entry['image_url'] != self.get_best_album_image(album_data):
+            return None
+        
+        restored = []
+        for record in entry['files']:
+            filepath = os.path.join(temp_dir, record['filename'])
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            if not self.render_cache.copy_to(record['render_key'], filepath) or file_sha256(filepath) != record['sha256']:
+                for saved_file in restored + [{'filepath': filepath}]:
+                    try:
+                        os.remove(saved_file['filepath'])
+                    except OSError:
+                        pass
                 return None
+            restored.append(dict(
+                record, filepath=filepath, encode_ms=None, stage_ms=None, reused=True,
+                album=self.album_key(album_data), image_url=entry['image_url'],
+                title=f"{album_data['artist']['name']} - {album_data['name']}"
+            ))
+        return restored
+    
+    def _restore_from_manifest(self, albums, manifest, temp_dir):
+        """Split albums into those still to render and saved files reused from the last run's manifest"""
+        fresh = []
+        reused = []
+        for album in albums:
+            try:
+                entry = manifest.get(self.album_key(album))
+                restored = self._restore_album(entry, album, temp_dir) if entry else None
+            except Exception as e:
+                logger.warning(f"Could not reuse {album.get('name', 'Unknown')} from the last run: {e}")
+                restored = None
+            if restored:
+                reused.extend(restored)
+            else:
+                fresh.append(album)
+        logger.info(f"Reusing {len(albums) - len(fresh)} albums from the last run, rendering {len(fresh)}")
+        return fresh, reused
+    
+    def _prepare_album(self, album_data, index, total, output_format=DEFAULT_OUTPUT_FORMAT, targets=DEFAULT_TARGETS,
+                       trace_id=None):
+        """Resolve names, image URL and one output filename per target for an album, or None to skip it"""
+        album_name = album_data['name']
+        artist_name = album_data['artist']['name']
+        
+        logger.info(f"{trace_prefix(trace_id)}Processing {index+1}/{total}: {artist_name} - {album_name}")
+        
+        # Get image URL
+        image_url = self.get_best_album_image(album_data)
+        if not image_url:
+            logger.warning(f"{trace_prefix(trace_id)}No image found for {album_name} by {artist_name}")
+            albums_skipped.inc(reason='no_image')
+            return None
+        
+        filename = self.album_filename(album_data, output_format)
+        return album_name, artist_name, image_url, [target_filename(filename, target, targets) for target in targets]
+    
+    @staticmethod
+    def album_filename(album_data, output_format=DEFAULT_OUTPUT_FORMAT):
+        """Archive filename of an album's wallpaper, before any per-target subdirectory"""
+        extension = wallpaper_render.ENCODERS[output_format]['extension']
+        name = f"{album_data['artist']['name']} - {album_data['name']}"
+        return name.replace('/', '_').replace('\\', '_')[:100] + f'.{extension}'
+    
+    def process_single_album(self, album_data, temp_dir, index, total, output_format=DEFAULT_OUTPUT_FORMAT,
+                             targets=DEFAULT_TARGETS, effects=DEFAULT_EFFECTS, trace_id=None, deduper=None):
+        """Process a single album - designed for parallel execution
+
+        Returns one saved file dict per target, or None if the album was skipped.
+        trace_id prefixes its log lines so one job's albums can be followed.
+        deduper, a CoverDeduper shared by the run, drops placeholders and repeated artwork.
+        """
+        try:
+            prepared = self._prepare_album(album_data, index, total, output_format, targets, trace_id)
+            if not prepared:
+                return None
+            album_name, artist_name, image_url, filenames = prepared
             
-            album_name = album_data['name']
-            artist_name = album_data['artist']['name']
+            if deduper and deduper.check_url(image_url):
+                return None
             
-            logger.info(f"Processing {index+1}/{total}: {artist_name} - {album_name}")
+            # Cached renders skip the download, decode and encode entirely
+            render_keys = self._render_keys(image_url, output_format, targets, effects)
+            results = [None] * len(targets)
+            for position, (filename, render_key) in enumerate(zip(filenames, render_keys)):
+                filepath = os.path.join(temp_dir, filename)
+                os.makedirs(os.path.dirname(filepath), exist_ok=True)
+                if self.render_cache.copy_to(render_key, filepath):
+                    results[position] = {
+                        'filename': filename,
+                        'title': f"{artist_name} - {album_name}",
+                        'filepath': filepath,
+                        'bytes': os.path.getsize(filepath),
+                        'encode_ms': None,
+                        'stage_ms': None,
+                        'album': self.album_key(album_data),
+                        'image_url': image_url,
+                        'render_key': render_key,
+                        'sha256': file_sha256(filepath)
+                    }
             
-            # Get image URL
-            image_url = self.get_best_album_image(album_data)
-            if not image_url:
-                logger.warning(f"No image found for {album_name} by {artist_name}")
+            missing = [position for position, result in enumerate(results) if result is None]
+            if not missing:
+                logger.info(f"{trace_prefix(trace_id)}Using cached wallpaper for {artist_name} - {album_name}")
+                return results
+            
+            rendered = self._render_output(
+                image_url, album_name, artist_name, [render_keys[position] for position in missing],
+                output_format, [targets[position] for position in missing], effects, trace_id, deduper
+            )
+            if not rendered:
                 return None
             
-            # Download album cover
-            album_cover = self.download_image_optimized(image_url)
-            if not album_cover:
+            for position, (output, encode_ms, stage_ms) in zip(missing, rendered):
+                filepath = os.path.join(temp_dir, filenames[position])
+                with open(filepath, 'wb') as f:
+                    f.write(output)
+                
+                results[position] = {
+                    'filename': filenames[position],
+                    'title': f"{artist_name} - {album_name}",
+                    'filepath': filepath,
+                    'bytes': len(output),
+                    'encode_ms': encode_ms,
+                    'stage_ms': stage_ms,
+                    'album': self.album_key(album_data),
+                    'image_url': image_url,
+                    'render_key': render_keys[position],
+                    'sha256': hashlib.sha256(output).hexdigest()
+                }
+            return results
+            
+        except Exception as e:
+            logger.error(f"{trace_prefix(trace_id)}Error processing album {album_data.get('name', 'Unknown')}: {e}")
+            albums_skipped.inc(reason='error')
+            return None
+    
+    def render_album_in_memory(self, album_data, index, total, output_format=DEFAULT_OUTPUT_FORMAT,
+                               targets=DEFAULT_TARGETS, effects=DEFAULT_EFFECTS, trace_id=None, deduper=None):
+        """Render a single album to encoded bytes for every target without touching the job's temp directory"""
+        try:
+            source = self._resolve_album_source(album_data, index, total, output_format, targets, effects, trace_id)
+            if not source:
+                return None
+            if deduper and deduper.check_url(source['image_url']):
                 return None
             
-            # Create wallpaper
-            wallpaper = self.create_wallpaper_optimized(album_cover, album_name, artist_name)
-            if not wallpaper:
+            if source['missing']:
+                rendered = self._render_output(
+                    source['image_url'], source['album_name'], source['artist_name'],
+                    [source['render_keys'][position] for position in source['missing']],
+                    output_format, [targets[position] for position in source['missing']], effects, trace_id, deduper
+                )
+                if not rendered:
+                    return None
+                for position, output in zip(source['missing'], rendered):
+                    source['outputs'][position] = output
+            
+            return self._finish_source(source)
+            
+        except Exception as e:
+            logger.error(f"{trace_prefix(trace_id)}Error processing album {album_data.get('name', 'Unknown')}: {e}")
+            albums_skipped.inc(reason='error')
+            return None
+    
+    def iter_wallpapers(self, username, period="overall", limit=10, output_format=DEFAULT_OUTPUT_FORMAT,
+                        targets=DEFAULT_TARGETS, effects=DEFAULT_EFFECTS, trace_id=None):
+        """Return an iterator of rendered wallpapers as {'filename', 'data', 'bytes', 'encode_ms', 'stage_ms'} dicts in completion order.
+
+        Memory is reserved before anything is fetched, so a full budget raises
+        MemoryBudgetExceeded here rather than partway through a response. The
+        reservation is released when the iterator is exhausted, fails or is
+        closed - call close() even if the iterator was never started.
+        """
+        reservation, sequential = self._admit_albums(
+            f"stream for {username}", limit, targets, effects, REQUEST_ADMISSION_TIMEOUT
+        )
+        return ReservedIterator(memory_budget, reservation, self._iter_admitted_wallpapers(
+            sequential, username, period, limit, output_format, targets, effects, trace_id
+        ))
+    
+    def _iter_admitted_wallpapers(self, sequential, username, period, limit, output_format, targets, effects, trace_id):
+        pager = self.iter_top_album_pages(username, period, limit)
+        
+        if sequential:
+            albums = (album for page in pager for album in page)
+            deduper = CoverDeduper(self.cover_index)
+            for i, album in enumerate(albums):
+                results = self.render_album_in_memory(
+                    album, i, pager.expected, output_format, targets, effects, trace_id, deduper
+                )
+                if results:
+                    yield from results
+            return
+        
+        for _, results in self._iter_pipeline(pager, limit, output_format, targets, effects, trace_id):
+            if results:
+                yield from results
+
+    def generate_wallpapers_to_disk(self, username, period="overall", limit=10, temp_dir=None, progress_callback=None,
+                                    output_format=DEFAULT_OUTPUT_FORMAT, targets=DEFAULT_TARGETS, effects=DEFAULT_EFFECTS,
+                                    manifest=None, trace_id=None, album_callback=None):
+        """Generate wallpapers, pipelined or one at a time depending on the memory budget
+
+        progress_callback, if given, is called as progress_callback(done, total)
+        once the album list is known and again after every album.
+        album_callback, if given, is called as album_callback(event, preview)
+        with the album_event of every album as soon as it is finished. Each album
+        produces one saved file per target; each records its size in 'bytes',
+        its encode time in 'encode_ms' and per-stage render times in
+        'stage_ms' (both None when it came from the render cache), plus the
+        'album', 'image_url', 'render_key' and 'sha256' a manifest needs.
+
+        manifest, if given, is the last run's ManifestStore entry for the same
+        settings: albums still on the chart with unchanged covers are copied
+        from it (marked 'reused') and only the rest go through the pipeline.
+
+        Chart pages stream in while earlier albums render, so the total
+        reported to progress_callback is the limit until the first page shows
+        how long the user's chart is.
+
+        Memory for rendering is reserved from memory_budget first, waiting up
+        to JOB_ADMISSION_TIMEOUT; MemoryBudgetExceeded is raised if none frees up.
+        trace_id is passed down to every album so its log lines can be followed.
+        """
+        pager = self.iter_top_album_pages(username, period, limit)
+        pages = iter(pager)
+        # A first page can be empty when every album on it was filtered out; later pages may still have some
+        first_page = next(pages, None)
+        if first_page is None:
+            return [], None
+        
+        # Reserve memory before the temp directory exists, so a full budget leaves nothing behind
+        heartbeat = (lambda: progress_callback(0, pager.expected)) if progress_callback else None
+        reservation, sequential = self._admit_albums(
+            f"wallpapers for {username}", pager.expected, targets, effects, heartbeat=heartbeat
+        )
+        try:
+            if progress_callback:
+                progress_callback(0, pager.expected)
+            
+            if not temp_dir:
+                temp_dir = tempfile.mkdtemp()
+            
+            reused = []
+            reused_albums = 0
+            listed_albums = 0
+            
+            def fresh_pages():
+                nonlocal reused_albums, listed_albums
+                for page in itertools.chain([first_page], pages):
+                    listed_albums += len(page)
+                    if manifest:
+                        fresh, restored = self._restore_from_manifest(page, manifest, temp_dir)
+                        reused.extend(restored)
+                        reused_albums += len(page) - len(fresh)
+                        page = fresh
+                        if album_callback:
+                            albums = {}
+                            for saved_file in restored:
+                                albums.setdefault(saved_file['album'], []).append(saved_file)
+                            for results in albums.values():
+                                album_callback(*self.album_event(results))
+                        if progress_callback and restored:
+                            progress_callback(reused_albums, pager.expected)
+                    yield page
+            
+            def album_progress(done, results):
+                if album_callback:
+                    album_callback(*self.album_event(results))
+                if progress_callback:
+                    progress_callback(reused_albums + done, max(pager.expected, reused_albums + done))
+            
+            callback = album_progress if progress_callback or album_callback else None
+            if sequential:
+                saved_files, temp_dir = self._process_albums_sequential(
+                    fresh_pages(), pager, temp_dir, callback, output_format, targets, effects, trace_id
+                )
+            else:
+                saved_files, temp_dir = self._process_albums_pipelined(
+                    fresh_pages(), pager, temp_dir, callback, output_format, targets, effects, trace_id
+                )
+        finally:
+            memory_budget.release(reservation)
+        if progress_callback:
+            # Duplicates and missing covers can leave the chart short of the first estimate
+            progress_callback(listed_albums, listed_albums)
+        logger.info(f"{trace_prefix(trace_id)}Read {pager.pages_fetched} chart page(s) for {username}: {listed_albums} albums, "
+                    f"{pager.duplicates} duplicate covers and {pager.placeholders} known placeholders skipped")
+        return reused + saved_files, temp_dir
+    
+    def _admit_albums(self, label, album_count, targets=DEFAULT_TARGETS, effects=DEFAULT_EFFECTS,
+                      timeout=JOB_ADMISSION_TIMEOUT, heartbeat=None):
+        """Reserve memory for rendering albums, returning (reservation ID, sequential).
+
+        The pipeline needs room for every cover it keeps in flight; when the
+        shared budget can't cover that, albums are processed one at a time.
+        Raises MemoryBudgetExceeded if not even one album fits before timeout.
+        heartbeat is called periodically while waiting (see MemoryBudget.reserve).
+        """
+        per_album = wallpaper_render.estimate_render_bytes(MAX_IMAGE_SIZE, targets, effects)
+        in_flight = max(1, min(album_count, RENDER_QUEUE_DEPTH))
+        reservation, sequential = memory_budget.admit(label, per_album * in_flight, per_album, timeout, heartbeat)
+        if sequential:
+            logger.info(f"Processing {album_count} albums one at a time within the memory budget")
+        else:
+            logger.info(f"Processing {album_count} albums with {DOWNLOAD_WORKERS} download threads and {RENDER_PROCESSES} render processes")
+        return reservation, sequential
+    
+    def _process_albums_sequential(self, pages, pager, temp_dir, progress_callback=None, output_format=DEFAULT_OUTPUT_FORMAT,
+                                   targets=DEFAULT_TARGETS, effects=DEFAULT_EFFECTS, trace_id=None):
+        """Process albums one by one to minimize memory usage
+
+        pages is an iterable of album lists; progress_callback(done, results) is called after every album.
+        """
+        saved_files = []
+        albums = (album for page in pages for album in page)
+        deduper = CoverDeduper(self.cover_index)
+        
+        for i, album in enumerate(albums):
+            results = self.process_single_album(
+                album, temp_dir, i, pager.expected, output_format, targets, effects, trace_id, deduper
+            )
+            if results:
+                saved_files.extend(results)
+            
+            if progress_callback:
+                progress_callback(i + 1, results)
+        
+        return saved_files, temp_dir
+    
+    def _process_albums_pipelined(self, pages, pager, temp_dir, progress_callback=None, output_format=DEFAULT_OUTPUT_FORMAT,
+                                  targets=DEFAULT_TARGETS, effects=DEFAULT_EFFECTS, trace_id=None):
+        """Process albums through the download/render pipeline, writing wallpapers to temp_dir
+
+        pages is an iterable of album lists; progress_callback(done, saved files) is called after every album.
+        """
+        saved_files = []
+        
+        albums = self._iter_pipeline(pages, pager.expected, output_format, targets, effects, trace_id)
+        for done, (_, results) in enumerate(albums, 1):
+            album_files = []
+            for result in results or ():
+                filepath = os.path.join(temp_dir, result['filename'])
+                try:
+                    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+                    with open(filepath, 'wb') as f:
+                        f.write(result['data'])
+                    saved_file = {key: value for key, value in result.items() if key != 'data'}
+                    saved_file['filepath'] = filepath
+                    album_files.append(saved_file)
+                except OSError as e:
+                    logger.error(f"Error saving {result['filename']}: {e}")
+            saved_files.extend(album_files)
+            
+            if progress_callback:
+                progress_callback(done, album_files)
+        
+        return saved_files, temp_dir
+    
+    def generate_bulk_to_disk(self, charts, limit=10, temp_dir=None, archive_path=None, progress_callback=None,
+                              output_format=DEFAULT_OUTPUT_FORMAT, targets=DEFAULT_TARGETS, effects=DEFAULT_EFFECTS,
+                              trace_id=None):
+        """Generate one archive per (username, period) in charts, rendering each cover only once.
+
+        Every chart is fetched concurrently first. Albums are then grouped by
+        cover URL across all users - render keys depend only on it - so each
+        unique cover is downloaded, rendered and written under temp_dir once,
+        and added to the archive of every user whose chart has it.
+        archive_path(username, period) names each user's ZIP (default: in
+        temp_dir). progress_callback(done, total) counts unique covers.
+
+        Returns (report, temp_dir). report['users'] has an entry per chart with
+        its 'zip_path' and 'count', or an 'error'; the rest of the report gives
+        album and cover counts, the dedup ratio and overall throughput.
+        """
+        start = time.perf_counter()
+        if not temp_dir:
+            temp_dir = tempfile.mkdtemp()
+        
+        fetched = self._fetch_charts(charts, limit)
+        covers_by_url = {}
+        unique_albums = []
+        user_covers = {}
+        for chart in charts:
+            user_covers[chart] = []
+            for album in fetched[chart]:
+                # The pager only hands over albums that have a cover
+                image_url = self.get_best_album_image(album)
+                if image_url not in covers_by_url:
+                    covers_by_url[image_url] = len(unique_albums)
+                    unique_albums.append(album)
+                user_covers[chart].append((covers_by_url[image_url], album))
+        listed = sum(len(covers) for covers in user_covers.values())
+        logger.info(f"{trace_prefix(trace_id)}Bulk of {len(charts)} charts: {listed} albums, {len(unique_albums)} unique covers")
+        
+        # Each unique cover's outputs, written once and shared by every archive that lists it
+        shared_dir = os.path.join(temp_dir, 'covers')
+        os.makedirs(shared_dir, exist_ok=True)
+        extension = wallpaper_render.ENCODERS[output_format]['extension']
+        outputs = {}
+        if unique_albums:
+            heartbeat = (lambda: progress_callback(0, len(unique_albums))) if progress_callback else None
+            reservation, sequential = self._admit_albums(
+                f"bulk of {len(charts)} charts", len(unique_albums), targets, effects, heartbeat=heartbeat
+            )
+            try:
+                # Near-duplicates stay - two users' similar covers each belong in their own archive
+                if sequential:
+                    deduper = CoverDeduper(self.cover_index, deduplicate=False)
+                    results = (
+                        (i, self.render_album_in_memory(
+                            album, i, len(unique_albums), output_format, targets, effects, trace_id, deduper
+                        ))
+                        for i, album in enumerate(unique_albums)
+                    )
+                else:
+                    results = self._iter_pipeline(
+                        [unique_albums], len(unique_albums), output_format, targets, effects, trace_id, deduplicate=False
+                    )
+                for done, (i, rendered) in enumerate(results, 1):
+                    if rendered:
+                        shared = []
+                        for position, result in enumerate(rendered):
+                            filepath = os.path.join(shared_dir, f'{i}-{position}.{extension}')
+                            with open(filepath, 'wb') as f:
+                                f.write(result['data'])
+                            saved_file = {key: value for key, value in result.items() if key != 'data'}
+                            saved_file['filepath'] = filepath
+                            shared.append(saved_file)
+                        outputs[i] = shared
+                    if progress_callback:
+                        progress_callback(done, len(unique_albums))
+            finally:
+                memory_budget.release(reservation)
+        
+        users = []
+        wallpapers = 0
+        for username, period in charts:
+            entry = {'username': username, 'period': period, 'count': 0}
+            users.append(entry)
+            covers = user_covers[(username, period)]
+            if not covers:
+                entry['error'] = 'No albums found for this user'
+                continue
+            saved_files = []
+            for i, album in covers:
+                filename = self.album_filename(album, output_format)
+                for target, shared in zip(targets, outputs.get(i, ())):
+                    saved_files.append(dict(shared, filename=target_filename(filename, target, targets)))
+            if not saved_files:
+                entry['error'] = 'No wallpapers could be generated'
+                continue
+            zip_path = archive_path(username, period) if archive_path else os.path.join(
+                temp_dir, f"{username}_{period}_wallpapers.zip"
+            )
+            package_wallpapers_zip(saved_files, temp_dir, username, zip_path=zip_path, remove_files=False)
+            entry.update({'count': len(saved_files), 'zip_path': zip_path})
+            wallpapers += len(saved_files)
+        shutil.rmtree(shared_dir, ignore_errors=True)
+        
+        elapsed = time.perf_counter() - start
+        rendered = sum(1 for shared in outputs.values() if any(f['encode_ms'] is not None for f in shared))
+        report = {
+            'users': users,
+            'users_failed': sum(1 for entry in users if 'error' in entry),
+            'albums': listed,
+            'unique_covers': len(unique_albums),
+            'rendered': rendered,
+            'cached': len(outputs) - rendered,
+            'skipped': len(unique_albums) - len(outputs),
+            'dedup_ratio': round(listed / len(unique_albums), 2) if unique_albums else None,
+            'wallpapers': wallpapers,
+            'elapsed_seconds': round(elapsed, 2),
+            'wallpapers_per_second': round(wallpapers / elapsed, 2) if elapsed else None
+        }
+        logger.info(f"{trace_prefix(trace_id)}Bulk finished: {wallpapers} wallpapers for {len(users)} charts in "
+                    f"{elapsed:.1f}s, dedup ratio {report['dedup_ratio']}")
+        return report, temp_dir
+    
+    def _fetch_charts(self, charts, limit):
+        """Fetch every (username, period) chart at once, returning {chart: albums}; failed charts are empty"""
+        def fetch(chart):
+            username, period = chart
+            return [album for page in self.iter_top_album_pages(username, period, limit) for album in page]
+        
+        with ThreadPoolExecutor(max_workers=BULK_CHART_CONCURRENCY, thread_name_prefix='bulk-charts') as executor:
+            return dict(zip(charts, executor.map(fetch, charts)))
+    
+    def _resolve_album_source(self, album_data, index, total, output_format=DEFAULT_OUTPUT_FORMAT,
+                              targets=DEFAULT_TARGETS, effects=DEFAULT_EFFECTS, trace_id=None):
+        """Resolve an album to its cached renders and the targets still to render from its cover URL
+
+        'outputs' holds (bytes, encode_ms, stage_ms) per target, None for the
+        positions listed in 'missing'.
+        """
+        try:
+            prepared = self._prepare_album(album_data, index, total, output_format, targets, trace_id)
+            if not prepared:
                 return None
+            album_name, artist_name, image_url, filenames = prepared
             
-            # Save as high-quality PNG
-            filename = f"{artist_name} - {album_name}".replace('/', '_').replace('\\', '_')[:100] + '.png'
-            filepath = os.path.join(temp_dir, filename)
-            
-            # Save with PNG optimization
-            wallpaper.save(filepath, 'PNG', optimize=True, compress_level=6)
-            
-            # Clean up memory immediately
-            del wallpaper
-            del album_cover
-            gc.collect()
+            render_keys = self._render_keys(image_url, output_format, targets, effects)
+            outputs = []
+            for render_key in render_keys:
+                output = self.render_cache.get(render_key)
+                outputs.append((output, None, None) if output else None)
+            missing = [position for position, output in enumerate(outputs) if output is None]
+            if not missing:
+                logger.info(f"{trace_prefix(trace_id)}Using cached wallpaper for {artist_name} - {album_name}")
             
             return {
-                'filename': filename,
-                'filepath': filepath
+                'album_key': self.album_key(album_data),
+                'album_name': album_name,
+                'artist_name': artist_name,
+                'image_url': image_url,
+                'filenames': filenames,
+                'render_keys': render_keys,
+                'outputs': outputs,
+                'missing': missing
             }
             
         except Exception as e:
-            logger.error(f"Error processing album {album_data.get('name', 'Unknown')}: {e}")
+            logger.error(f"{trace_prefix(trace_id)}Error preparing album {album_data.get('name', 'Unknown')}: {e}")
+            albums_skipped.inc(reason='error')
             return None
+    
+    def _finish_source(self, source):
+        return [
+            {
+                'filename': filename,
+                'title': f"{source['artist_name']} - {source['album_name']}",
+                'data': output,
+                'bytes': len(output),
+                'encode_ms': encode_ms,
+                'stage_ms': stage_ms,
+                'album': source['album_key'],
+                'image_url': source['image_url'],
+                'render_key': render_key,
+                'sha256': hashlib.sha256(output).hexdigest()
+            }
+            for filename, render_key, (output, encode_ms, stage_ms)
+            in zip(source['filenames'], source['render_keys'], source['outputs'])
+        ]
+    
+    def _iter_pipeline(self, pages, total, output_format=DEFAULT_OUTPUT_FORMAT, targets=DEFAULT_TARGETS,
+                       effects=DEFAULT_EFFECTS, trace_id=None, deduplicate=True):
+        """Yield (index, results) for every album as soon as it finishes.
 
-    def generate_wallpapers_to_disk(self, username, period="overall", limit=10, temp_dir=None):
-        """Generate wallpapers with memory-aware processing"""
-        albums = self.get_user_top_albums(username, period, limit)
-        if not albums:
-            return [], None
+        pages is an iterable of album lists, read on a helper thread: each
+        page's covers join the download queue as soon as it arrives, while
+        albums from earlier pages are already downloading and rendering. Up to
+        DOWNLOAD_QUEUE_DEPTH covers are downloading or downloaded and waiting
+        to render at once, more being requested as renders finish; they are
+        downloaded concurrently by the asyncio cover fetcher; the compressed
+        bytes are then decoded once, resized to every target and encoded on
+        the process pool so rendering scales past the GIL. results is a list
+        of {'filename', 'data', 'bytes', 'encode_ms', 'stage_ms'} in targets
+        order, or None if the album was skipped. total is only used for logging.
+
+        Each downloaded cover is perceptually hashed before it is queued for
+        rendering, and placeholder art - plus, with deduplicate, artwork
+        already in this run - is skipped; covers the cover index knows are
+        judged without a download.
+        """
+        fetcher = get_cover_fetcher()
+        deduper = CoverDeduper(self.cover_index, deduplicate)
+        render_pool = get_render_pool()
+        # Bound queued renders so finished wallpapers don't pile up ahead of the consumer
+        max_renders = RENDER_QUEUE_DEPTH
+        # ...and downloads, so a long chart doesn't pull every cover into memory ahead of the renders
+        max_downloads = DOWNLOAD_QUEUE_DEPTH
+        
+        pages = iter(pages)
+        page_reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix='album-pages')
+        next_page = page_reader.submit(next, pages, None)
+        album_count = 0
+        downloads = {}
+        
+        pending = deque()
+        ready = deque()
+        
+        def start_downloads():
+            while pending and len(downloads) + len(ready) < max_downloads:
+                i, source = pending.popleft()
+                downloads[fetcher.submit(self, source['image_url'])] = (i, source)
+        
+        try:
+            renders = {}
             
+            while next_page or pending or downloads or ready or renders:
+                start_downloads()
+                while ready and len(renders) < max_renders:
+                    i, source = ready.popleft()
+                    future = render_pool.submit(
+                        wallpaper_render.render_cover_set_with_preview,
+                        source['cover'], MAX_IMAGE_SIZE, source['targets'], SHARPNESS_FACTOR, output_format, effects
+                    )
+                    renders[future] = (i, source)
+                
+                waiting = list(downloads) + list(renders) + ([next_page] if next_page else [])
+                done, _ = wait(waiting, return_when=FIRST_COMPLETED)
+                if next_page in done:
+                    page = next_page.result()
+                    next_page = page_reader.submit(next, pages, None) if page is not None else None
+                    # Start this page's downloads before yielding anything from it
+                    finished = []
+                    for album in page or ():
+                        i = album_count
+                        album_count += 1
+                        source = self._resolve_album_source(album, i, total, output_format, targets, effects, trace_id)
+                        if source is None or deduper.check_url(source['image_url']):
+                            finished.append((i, None))
+                        elif not source['missing']:
+                            finished.append((i, self._finish_source(source)))
+                        else:
+                            pending.append((i, source))
+                    start_downloads()
+                    yield from finished
+                
+                for future in done:
+                    if future not in downloads and future not in renders:
+                        continue  # The page read handled above
+                    if future in downloads:
+                        i, source = downloads.pop(future)
+                        source['cover'] = future.result()
+                        if not source['cover']:
+                            albums_skipped.inc(reason='download_failed')
+                            yield i, None
+                        elif deduper.check_cover(source['image_url'], source['cover']):
+                            yield i, None
+                        else:
+                            source['targets'] = [targets[position] for position in source['missing']]
+                            ready.append((i, source))
+                        continue
+                    
+                    i, source = renders.pop(future)
+                    try:
+                        rendered, preview = future.result()
+                    except futures_process.BrokenProcessPool:
+                        # A worker died (e.g. OOM killed) - render this one here and start a fresh pool
+                        logger.error("Render pool broke, restarting it")
+                        reset_render_pool()
+                        render_pool = get_render_pool()
+                        try:
+                            rendered, preview = wallpaper_render.render_cover_set_with_preview(
+                                source['cover'], MAX_IMAGE_SIZE, source['targets'], SHARPNESS_FACTOR, output_format, effects
+                            )
+                        except Exception as e:
+                            logger.error(f"{trace_prefix(trace_id)}Error rendering {source['filenames'][0]}: {e}")
+                            albums_skipped.inc(reason='render_failed')
+                            yield i, None
+                            continue
+                    except Exception as e:
+                        logger.error(f"{trace_prefix(trace_id)}Error rendering {source['filenames'][0]}: {e}")
+                        albums_skipped.inc(reason='render_failed')
+                        yield i, None
+                        continue
+                    
+                    self._observe_render(trace_id, source['artist_name'], source['album_name'], rendered)
+                    self._cache_render(
+                        source['image_url'], [source['render_keys'][position] for position in source['missing']], rendered, preview
+                    )
+                    for position, output in zip(source['missing'], rendered):
+                        source['outputs'][position] = output
+                    yield i, self._finish_source(source)
+            if deduper.skipped:
+                skipped = ', '.join(f"{count} {reason.replace('_', ' ')}" for reason, count in deduper.skipped.items())
+                logger.info(f"{trace_prefix(trace_id)}Skipped covers by perceptual hash: {skipped}")
+        finally:
+            # The consumer went away (e.g. a streaming client disconnected)
+            for future in downloads:
+                future.cancel()
+            if next_page:
+                next_page.cancel()
+            page_reader.shutdown(wait=False)
+
+    def generate_collage_to_disk(self, username, period="overall", grid=DEFAULT_COLLAGE_GRID, wallpaper_size=WALLPAPER_SIZE,
+                                 temp_dir=None, progress_callback=None, output_format=DEFAULT_OUTPUT_FORMAT, trace_id=None):
+        """Render a collage into temp_dir, returning (saved_files, temp_dir) like generate_wallpapers_to_disk"""
+        result = self.render_collage(
+            username, period, grid, wallpaper_size, output_format, progress_callback, trace_id=trace_id
+        )
+        if not result:
+            return [], None
+        
         if not temp_dir:
             temp_dir = tempfile.mkdtemp()
+        filepath = os.path.join(temp_dir, result['filename'])
+        with open(filepath, 'wb') as f:
+            f.write(result['data'])
+        return [{
+            'filename': result['filename'],
+            'filepath': filepath,
+            'bytes': result['bytes'],
+            'encode_ms': result['encode_ms'],
+            'stage_ms': result['stage_ms']
+        }], temp_dir
+    
+    def get_tile_cache_key(self, image_url, tile_size):
+        """Cache key for one resized collage tile, independent of its position in the grid"""
+        return DiskCache.make_key(
+            'tile', CACHE_VERSION, image_url, list(tile_size),
+            {'sharpness': SHARPNESS_FACTOR, 'resample': 'lanczos', 'mode': 'crop-center'}
+        )
+    
+    def _render_tile_inline(self, data, tile_size):
+        try:
+            return wallpaper_render.render_tile(data, tile_size, SHARPNESS_FACTOR)
+        except Exception as e:
+            logger.error(f"Error rendering collage tile: {e}")
+            return None
+    
+    def _render_tiles(self, image_urls, tile_size, sequential=False):
+        """Download and resize covers missing from the tile cache, returning {url: raw tile or None}.
+
+        sequential resizes the covers here one at a time instead of on the render pool.
+        """
+        fetcher = get_cover_fetcher()
+        downloads = [(url, fetcher.submit(self, url)) for url in image_urls]
+        render_pool = None if sequential else get_render_pool()
         
-        # Check available memory and decide processing strategy
-        available_memory_gb = psutil.virtual_memory().available / (1024**3)
-        memory_percent = psutil.virtual_memory().percent
+        renders = []
+        tiles = {}
+        for url, download in downloads:
+            data = download.result()
+            if not data:
+                tiles[url] = None
+            elif render_pool is None:
+                tiles[url] = self._render_tile_inline(data, tile_size)
+            else:
+                renders.append((url, data, render_pool.submit(wallpaper_render.render_tile, data, tile_size, SHARPNESS_FACTOR)))
         
-        # Use sequential processing if memory is constrained
-        if memory_percent > 60 or available_memory_gb < 1.5:
-            logger.info(f"Memory constrained ({memory_percent}%), using sequential processing for {len(albums)} albums")
-            return self._process_albums_sequential(albums, temp_dir)
-        else:
-            # Use parallel processing with limited workers
-            max_workers = min(MAX_WORKERS, max(1, int(available_memory_gb)))
-            logger.info(f"Processing {len(albums)} albums with {max_workers} workers")
-            return self._process_albums_parallel(albums, temp_dir, max_workers)
-    
-    def _process_albums_sequential(self, albums, temp_dir):
-        """Process albums one by one to minimize memory usage"""
-        saved_files = []
+        for url, data, future in renders:
+            try:
+                tiles[url] = future.result()
+            except futures_process.BrokenProcessPool:
+                logger.error("Render pool broke, restarting it")
+                reset_render_pool()
+                tiles[url] = self._render_tile_inline(data, tile_size)
+            except Exception as e:
+                logger.error(f"Error rendering collage tile: {e}")
+                tiles[url] = None
         
-        for i, album in enumerate(albums):
-            # Force garbage collection before each album
-            gc.collect()
+        for url, tile in tiles.items():
+            if tile:
+                self.tile_cache.put(self.get_tile_cache_key(url, tile_size), tile)
+        return tiles
+    
+    def render_collage(self, username, period="overall", grid=DEFAULT_COLLAGE_GRID, wallpaper_size=WALLPAPER_SIZE,
+                       output_format=DEFAULT_OUTPUT_FORMAT, progress_callback=None, admission_timeout=JOB_ADMISSION_TIMEOUT,
+                       trace_id=None):
+        """Render one wallpaper from a cols x rows grid of the user's top album covers.
+
+        Tiles are cached per (cover, tile size), so after a chart change only
+        new covers are downloaded and resized. Cells fill in chart order;
+        covers that can't be fetched are replaced by the next albums down the
+        chart. Returns {'filename', 'data', 'bytes', 'encode_ms', 'stage_ms',
+        'tiles'} or None if no tile could be made. progress_callback, if given,
+        is called as progress_callback(tiles ready, cells).
+
+        Memory for the tiles and canvas is reserved from memory_budget first,
+        waiting up to admission_timeout before raising MemoryBudgetExceeded.
+        """
+        cells = grid[0] * grid[1]
+        reservation, sequential = memory_budget.admit(
+            f"collage for {username}",
+            wallpaper_render.estimate_collage_bytes(wallpaper_size, grid, RENDER_PROCESSES),
+            wallpaper_render.estimate_collage_bytes(wallpaper_size, grid),
+            admission_timeout,
+            (lambda: progress_callback(0, cells)) if progress_callback else None
+        )
+        try:
+            timings = {}
+            with wallpaper_effects.timed(timings, 'tiles'):
+                albums = self.get_user_top_albums(username, period, cells + COLLAGE_SPARE_ALBUMS)
+                image_urls = []
+                for album in albums:
+                    image_url = self.get_best_album_image(album)
+                    if image_url and image_url not in image_urls:
+                        image_urls.append(image_url)
+                
+                tile_size = wallpaper_render.grid_tile_size(wallpaper_size, grid)
+                tiles = {}
+                ready = cached = 0
+                candidates = image_urls
+                # Look up the first cells covers, then spares for any that failed, until the grid is full
+                while candidates and ready < cells:
+                    batch, candidates = candidates[:cells - ready], candidates[cells - ready:]
+                    missing = []
+                    for image_url in batch:
+                        tile = self.tile_cache.get(self.get_tile_cache_key(image_url, tile_size))
+                        if tile:
+                            tiles[image_url] = tile
+                            ready += 1
+                            cached += 1
+                        else:
+                            missing.append(image_url)
+                    if missing:
+                        if progress_callback:
+                            progress_callback(ready, cells)
+                        rendered = self._render_tiles(missing, tile_size, sequential)
+                        tiles.update(rendered)
+                        ready += sum(1 for tile in rendered.values() if tile)
+                    if progress_callback:
+                        progress_callback(ready, cells)
+                
+                chosen = [image_url for image_url in image_urls if tiles.get(image_url)][:cells]
+            if not chosen:
+                return None
             
-            # Check memory before processing each album
-            if not self.check_memory_usage():
-                logger.warning(f"Stopping processing due to memory constraints after {i} albums")
-                break
+            encoder = wallpaper_render.ENCODERS[output_format]
+            filename = f"{username} - collage {grid[0]}x{grid[1]}".replace('/', '_').replace('\\', '_') + f".{encoder['extension']}"
+            result = {
+                'filename': filename,
+                'tiles': {'cells': cells, 'filled': len(chosen), 'cached': cached, 'rendered': len(chosen) - cached}
+            }
             
-            result = self.process_single_album(album, temp_dir, i, len(albums))
-            if result:
-                saved_files.append(result)
+            # The same chart renders to the same collage
+            render_key = DiskCache.make_key(
+                'collage', CACHE_VERSION, chosen, list(wallpaper_size), list(grid),
+                {'sharpness': SHARPNESS_FACTOR, 'encoder': output_format, 'options': encoder['options']}
+            )
+            output = self.render_cache.get(render_key)
+            if output:
+                logger.info(f"{trace_prefix(trace_id)}Using cached collage for {username}")
+                result.update({'data': output, 'bytes': len(output), 'encode_ms': None, 'stage_ms': None})
+                return result
             
-            # Force cleanup after each album
-            gc.collect()
-        
-        return saved_files, temp_dir
-    
-    def _process_albums_parallel(self, albums, temp_dir, max_workers):
-        """Process albums in parallel with memory monitoring"""
-        saved_files = []
-        
-        # Process albums in parallel with limited workers
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # Submit all tasks
-            future_to_album = {
-                executor.submit(self.process_single_album, album, temp_dir, i, len(albums)): album 
-                for i, album in enumerate(albums)
-            }
+            canvas = canvas_pool.acquire(wallpaper_size)
+            try:
+                with wallpaper_effects.timed(timings, 'composite'):
+                    boxes = wallpaper_render.grid_boxes(wallpaper_size, grid)
+                    wallpaper_render.compose_grid(canvas, boxes, [tiles[image_url] for image_url in chosen] + [None] * (cells - len(chosen)))
+                with wallpaper_effects.timed(timings, 'encode'):
+                    output = wallpaper_render.encode(Image.fromarray(canvas), output_format)
+            finally:
+                canvas_pool.release(canvas)
             
-            # Collect results as they complete
-            for future in as_completed(future_to_album):
-                try:
-                    result = future.result(timeout=60)  # 60 second timeout per album
-                    if result:
-                        saved_files.append(result)
-                except Exception as e:
-                    album = future_to_album[future]
-                    logger.error(f"Error processing album {album.get('name', 'Unknown')}: {e}")
-                
-                # Force garbage collection after each completion
-                gc.collect()
-        
-        return saved_files, temp_dir
+            self.render_cache.put(render_key, output)
+            for stage, ms in timings.items():
+                render_stage_latency.observe(ms / 1000, stage=f'collage_{stage}')
+            stages = ', '.join(f"{stage} {ms:.0f}ms" for stage, ms in timings.items())
+            logger.info(f"{trace_prefix(trace_id)}Rendered collage for {username}: {stages}")
+            result.update({
+                'data': output,
+                'bytes': len(output),
+                'encode_ms': timings['encode'],
+                'stage_ms': {stage: round(ms, 2) for stage, ms in timings.items()}
+            })
+            return result
+        finally:
+            memory_budget.release(reservation)
 
     def get_best_album_image(self, album_data):
         """Get the best quality image URL from album data"""
@@ -423,8 +2893,645 @@ class LastFMWallpaperGenerator:
         
         return image_url
 
+def parse_grid(spec):
+    """Parse a collage grid like '5x5' or [5, 5] into (columns, rows), or None when not requested"""
+    if not spec:
+        return None
+    try:
+        columns, rows = (int(value) for value in (spec.lower().split('x') if isinstance(spec, str) else spec))
+    except (ValueError, TypeError, AttributeError):
+        raise ValueError(f'Invalid collage grid: {spec}')
+    if not (0 < columns <= MAX_COLLAGE_GRID and 0 < rows <= MAX_COLLAGE_GRID):
+        raise ValueError(f'Collage grids are at most {MAX_COLLAGE_GRID}x{MAX_COLLAGE_GRID}')
+    return columns, rows
+
+def parse_effects(specs):
+    """Parse requested styling effects into a tuple in pipeline order.
+
+    Accepts a list or comma-separated string of wallpaper_effects.EFFECTS.
+    Raises ValueError for unknown effects or more than one background.
+    """
+    if not specs:
+        return DEFAULT_EFFECTS
+    if isinstance(specs, str):
+        specs = specs.split(',')
+    if not isinstance(specs, list):
+        raise ValueError('effects must be a list')
+    
+    requested = {str(spec).strip() for spec in specs}
+    unknown = requested - set(wallpaper_effects.EFFECTS)
+    if unknown:
+        raise ValueError(f'Unknown effect: {sorted(unknown)[0]}')
+    if len(requested & set(wallpaper_effects.BACKGROUND_EFFECTS)) > 1:
+        raise ValueError('Choose at most one background effect')
+    return tuple(effect for effect in wallpaper_effects.EFFECTS if effect in requested)
+
+def parse_bulk_charts(specs, default_period='overall'):
+    """Parse a bulk request's users into unique (username, period) pairs.
+
+    Each spec is a username, 'username:period', or a dict with 'username'
+    and optional 'period'. Raises ValueError for an empty or oversized list.
+    """
+    if isinstance(specs, str):
+        specs = specs.split(',')
+    if not isinstance(specs, list) or not specs:
+        raise ValueError('users must be a non-empty list')
+    
+    charts = []
+    for spec in specs:
+        if isinstance(spec, dict):
+            username, period = str(spec.get('username', '')), str(spec.get('period') or default_period)
+        else:
+            username, _, period = str(spec).partition(':')
+            period = period or default_period
+        username = username.strip()
+        if not username:
+            raise ValueError('Every user needs a username')
+        if (username, period.strip()) not in charts:
+            charts.append((username, period.strip()))
+    if len(charts) > BULK_MAX_USERS:
+        raise ValueError(f'At most {BULK_MAX_USERS} users per bulk request')
+    return charts
+
+def parse_render_targets(specs, default_mode=DEFAULT_ASPECT_MODE):
+    """Parse requested wallpaper sizes into (width, height, mode) targets.
+
+    Each spec is a preset name or WIDTHxHEIGHT, optionally followed by
+    ':mode' (e.g. '4k', '2560x1440', 'phone:crop-center'), or a dict with
+    'width'/'height' or 'preset', and 'mode'. Specs without a mode use
+    default_mode. Duplicates are dropped. Raises ValueError describing the
+    first bad spec.
+    """
+    if not specs:
+        return [(WALLPAPER_SIZE[0], WALLPAPER_SIZE[1], default_mode)]
+    if isinstance(specs, str):
+        specs = specs.split(',')
+    if not isinstance(specs, list):
+        raise ValueError('sizes must be a list')
+    
+    targets = []
+    for spec in specs:
+        if isinstance(spec, dict):
+            size, mode = spec.get('preset'), spec.get('mode', default_mode)
+            if size is None:
+                size = f"{spec.get('width')}x{spec.get('height')}"
+        else:
+            size, _, mode = str(spec).strip().partition(':')
+            mode = mode or default_mode
+        
+        if size in SIZE_PRESETS:
+            width, height = SIZE_PRESETS[size]
+        else:
+            try:
+                width, height = (int(value) for value in str(size).lower().split('x'))
+            except ValueError:
+                raise ValueError(f'Invalid size: {spec}')
+        if not (0 < width <= MAX_TARGET_DIMENSION and 0 < height <= MAX_TARGET_DIMENSION):
+            raise ValueError(f'Size out of range: {spec}')
+        if mode not in wallpaper_render.ASPECT_MODES:
+            raise ValueError(f'Unknown aspect mode: {mode}')
+        
+        target = (width, height, mode)
+        if target not in targets:
+            targets.append(target)
+    
+    if len(targets) > MAX_RENDER_TARGETS:
+        raise ValueError(f'At most {MAX_RENDER_TARGETS} sizes per request')
+    return targets
+
+def default_aspect_mode(effects):
+    """Background effects only show around a letterboxed cover, so they default sizes to 'fit'"""
+    if any(effect in wallpaper_effects.BACKGROUND_EFFECTS for effect in effects):
+        return 'fit'
+    return DEFAULT_ASPECT_MODE
+
+def new_trace_id():
+    """Short random ID tying together the log lines of one job or request"""
+    return uuid.uuid4().hex[:16]
+
+def trace_prefix(trace_id):
+    return f"[{trace_id}] " if trace_id else ""
+
+def target_filename(filename, target, targets):
+    """Output path for one target - a single-size request keeps the plain filename"""
+    if len(targets) == 1:
+        return filename
+    width, height, mode = target
+    folder = f'{width}x{height}' if mode == DEFAULT_ASPECT_MODE else f'{width}x{height}-{mode}'
+    return f'{folder}/{filename}'
+
+def file_sha256(path):
+    """SHA-256 of a file's contents, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def build_manifest(saved_files):
+    """Manifest entries for a finished run: {album key: {'image_url', 'files'}}"""
+    albums = {}
+    for saved_file in saved_files:
+        entry = albums.setdefault(saved_file['album'], {'image_url': saved_file['image_url'], 'files': []})
+        entry['files'].append({
+            'filename': saved_file['filename'],
+            'render_key': saved_file['render_key'],
+            'sha256': saved_file['sha256'],
+            'bytes': saved_file['bytes']
+        })
+    return albums
+
+def summarize_incremental(saved_files, previous):
+    """Album counts for a run against the previous manifest: reused, rendered fresh, served from the shared cache"""
+    albums = {saved_file['album'] for saved_file in saved_files}
+    reused = {saved_file['album'] for saved_file in saved_files if saved_file.get('reused')}
+    rendered = {saved_file['album'] for saved_file in saved_files if saved_file.get('encode_ms') is not None}
+    previous_albums = set(previous or {})
+    return {
+        'albums': len(albums),
+        'reused': len(reused),
+        'rendered': len(rendered),
+        'cached': len(albums - reused - rendered),
+        'new': len(albums - previous_albums),
+        'dropped': len(previous_albums - albums)
+    }
+
+def summarize_encoding(saved_files, output_format):
+    """Aggregate per-wallpaper encode time and output size for a job report"""
+    encode_times = [f['encode_ms'] for f in saved_files if f.get('encode_ms') is not None]
+    total_bytes = sum(f.get('bytes', 0) for f in saved_files)
+    stage_totals = {}
+    for saved_file in saved_files:
+        for stage, ms in (saved_file.get('stage_ms') or {}).items():
+            stage_totals[stage] = stage_totals.get(stage, 0) + ms
+    return {
+        'format': output_format,
+        'files': len(saved_files),
+        'encoded': len(encode_times),
+        'cached': len(saved_files) - len(encode_times),
+        'encode_ms_total': round(sum(encode_times), 1),
+        'encode_ms_avg': round(sum(encode_times) / len(encode_times), 1) if encode_times else None,
+        'bytes_total': total_bytes,
+        'bytes_avg': total_bytes // len(saved_files) if saved_files else 0,
+        'stage_ms_total': {stage: round(ms, 1) for stage, ms in stage_totals.items()}
+    }
+
+def package_wallpapers_zip(saved_files, temp_dir, username, zip_path=None, remove_files=True):
+    """Bundle generated wallpapers into a ZIP, deleting the loose files as they are added unless remove_files is off"""
+    # Every output format is already compressed, so store entries as-is
+    zip_path = zip_path or os.path.join(temp_dir, f"{username}_wallpapers.zip")
+    with zip_latency.time(), zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_STORED) as zipf:
+        for saved_file in saved_files:
+            zipf.write(saved_file['filepath'], saved_file['filename'])
+            # Remove individual files after adding to zip
+            if remove_files:
+                try:
+                    os.remove(saved_file['filepath'])
+                except:
+                    pass
+    return zip_path
+
+class _ZipStreamBuffer(io.RawIOBase):
+    """Write-only, unseekable sink that lets zipfile emit an archive piece by piece"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def stream_wallpapers_zip(wallpapers):
+    """Yield a ZIP archive chunk by chunk as wallpapers arrive.
+
+    Wallpapers are already compressed, so entries are STORED rather than deflated.
+    zipfile falls back to data descriptors on an unseekable sink, so nothing
+    has to be buffered beyond the wallpaper currently being written.
+    """
+    sink = _ZipStreamBuffer()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as zipf:
+        for wallpaper in wallpapers:
+            info = zipfile.ZipInfo(wallpaper['filename'], date_time=time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            zipf.writestr(info, wallpaper['data'])
+            yield sink.drain()
+    # Closing the archive writes the central directory
+    yield sink.drain()
+
+class JobStore:
+    """SQLite-backed job table shared by every gunicorn worker"""
+
+    COLUMNS = (
+        'id', 'username', 'period', 'limit_count', 'status', 'albums_done', 'albums_total',
+        'count', 'error', 'zip_path', 'validation_message', 'created_at', 'updated_at',
+        'options', 'stats', 'trace_id'
+    )
+    # Columns added after the first release, created on existing databases at startup
+    ADDED_COLUMNS = {
+        'options': 'TEXT',  # JSON of per-request render options
+        'stats': 'TEXT',  # JSON report written when the job finishes
+        'trace_id': 'TEXT'  # Prefixes the job's log lines
+    }
+
+    def __init__(self, path=JOB_DB_PATH):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    username TEXT NOT NULL,
+                    period TEXT NOT NULL,
+                    limit_count INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    albums_done INTEGER NOT NULL DEFAULT 0,
+                    albums_total INTEGER NOT NULL DEFAULT 0,
+                    count INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    zip_path TEXT,
+                    validation_message TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)')
+            # Per-album progress; the autoincrement ID doubles as the SSE event ID
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS job_events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id TEXT NOT NULL,
+                    event TEXT NOT NULL,
+                    preview BLOB,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.execute('CREATE INDEX IF NOT EXISTS job_events_job ON job_events (job_id, id)')
+            existing = {row[1] for row in conn.execute('PRAGMA table_info(jobs)')}
+            for column, column_type in self.ADDED_COLUMNS.items():
+                if column not in existing:
+                    conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {column_type}')
+
+    def _connect(self):
+        # One short-lived connection per call keeps this safe across threads and processes
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def create(self, username, period, limit, validation_message=None, options=None, max_active=JOB_QUEUE_LIMIT,
+               trace_id=None):
+        """Insert a queued job and return its ID, or None if the queue is full"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM jobs WHERE updated_at < ?', (now - JOB_RETENTION_SECONDS,))
+            conn.execute('DELETE FROM job_events WHERE created_at < ?', (now - JOB_RETENTION_SECONDS,))
+            active = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running') AND updated_at >= ?",
+                (now - JOB_STALE_SECONDS,)
+            ).fetchone()[0]
+            if active >= max_active:
+                conn.execute('ROLLBACK')
+                return None
+            conn.execute(
+                "INSERT INTO jobs (id, username, period, limit_count, status, validation_message, options, trace_id, "
+                "created_at, updated_at) VALUES (?, ?, ?, ?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, username, period, limit, validation_message, json.dumps(options or {}), trace_id, now, now)
+            )
+            conn.execute('COMMIT')
+            return job_id
+        finally:
+            conn.close()
+
+    def claim(self):
+        """Atomically move the oldest queued job to running and return it"""
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                conn.execute('ROLLBACK')
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ?",
+                (time.time(), row['id'])
+            )
+            conn.execute('COMMIT')
+            return dict(row)
+        finally:
+            conn.close()
+
+    def update(self, job_id, **fields):
+        fields['updated_at'] = time.time()
+        assignments = ', '.join(f'{name} = ?' for name in fields if name in self.COLUMNS)
+        values = [value for name, value in fields.items() if name in self.COLUMNS]
+        conn = self._connect()
+        try:
+            conn.execute(f'UPDATE jobs SET {assignments} WHERE id = ?', values + [job_id])
+        finally:
+            conn.close()
+
+    def fail_running(self, job_ids, error):
+        """Mark jobs failed unless they finished in the meantime, returning how many were marked"""
+        if not job_ids:
+            return 0
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                f"UPDATE jobs SET status = 'failed', error = ?, updated_at = ? "
+                f"WHERE status = 'running' AND id IN ({', '.join('?' * len(job_ids))})",
+                [error, time.time()] + list(job_ids)
+            )
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    def add_event(self, job_id, event, preview=None):
+        conn = self._connect()
+        try:
+            conn.execute(
+                'INSERT INTO job_events (job_id, event, preview, created_at) VALUES (?, ?, ?, ?)',
+                (job_id, json.dumps(event), preview, time.time())
+            )
+        finally:
+            conn.close()
+
+    def events(self, job_id, after=0):
+        """A job's events newer than the given event ID, as (ID, event, preview) in order"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                'SELECT id, event, preview FROM job_events WHERE job_id = ? AND id > ? ORDER BY id', (job_id, after)
+            ).fetchall()
+        finally:
+            conn.close()
+        return [(row['id'], json.loads(row['event']), row['preview']) for row in rows]
+
+    def get(self, job_id):
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+
+        job = dict(row)
+        job['options'] = json.loads(job['options']) if job.get('options') else {}
+        job['stats'] = json.loads(job['stats']) if job.get('stats') else None
+        # The worker that owned this job died without finishing it
+        if job['status'] == 'running' and time.time() - job['updated_at'] > JOB_STALE_SECONDS:
+            job['status'] = 'failed'
+            job['error'] = 'Job stopped responding - please try again'
+        return job
+
+class JobQueue:
+    """Bounded pool of background threads that run queued generate jobs"""
+
+    def __init__(self, store, workers=JOB_WORKERS):
+        self.store = store
+        self.workers = max(1, workers)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._running = set()
+        self._pid = None
+
+    def start(self):
+        """Start the worker threads once per process (gunicorn forks after import)"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._threads = []
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker_loop, name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            logger.info(f"Started {self.workers} job workers in process {self._pid}")
+
+    def stop(self, timeout):
+        """Stop claiming jobs and wait up to timeout seconds for running ones to finish.
+
+        Called as a gunicorn worker exits, so recycling it doesn't cut a job
+        off mid-render. Jobs still running after timeout die with the process,
+        so they are marked failed rather than left 'running' for clients to
+        poll until they go stale. Returns True if every running job finished.
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                return True
+            threads = self._threads
+        self._stopping.set()
+        self._wakeup.set()
+        deadline = time.monotonic() + timeout
+        for thread in threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        with self._lock:
+            unfinished = list(self._running)
+        if unfinished:
+            failed = self.store.fail_running(unfinished, 'Server restarted while the job was running - please try again')
+            logger.warning(f"{failed} jobs still running in process {self._pid} after {timeout}s were marked failed")
+        return not unfinished
+
+    def submit(self, username, period, limit, validation_message=None, options=None, trace_id=None):
+        """Queue a generate job, returning its ID or None if the queue is full"""
+        self.start()
+        job_id = self.store.create(username, period, limit, validation_message, options, trace_id=trace_id)
+        if job_id:
+            self._wakeup.set()
+        return job_id
+
+    def _worker_loop(self):
+        while not self._stopping.is_set():
+            try:
+                job = self.store.claim()
+            except Exception as e:
+                logger.error(f"Failed to claim job: {e}")
+                job = None
+
+            if job is None:
+                # Jobs queued by other gunicorn workers are picked up on the next poll
+                self._wakeup.wait(JOB_POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+
+            with self._lock:
+                self._running.add(job['id'])
+            try:
+                self._run(job)
+            finally:
+                with self._lock:
+                    self._running.discard(job['id'])
+
+    def _run(self, job):
+        job_id = job['id']
+        username = job['username']
+        trace_id = job.get('trace_id')
+        temp_dir = None
+        outcome = 'failed'
+        logger.info(f"{trace_prefix(trace_id)}Running job {job_id} for {username}")
+        # Work directories expire unless progress keeps pushing them back, so a dead job's are still reaped
+        work_artifacts = [job_id]
+        extended_at = time.monotonic()
+
+        def report_progress(done, total):
+            nonlocal extended_at
+            self.store.update(job_id, albums_done=done, albums_total=total)
+            if time.monotonic() - extended_at >= ARTIFACT_REAP_INTERVAL:
+                extended_at = time.monotonic()
+                for artifact_id in list(work_artifacts):
+                    artifact_store.expire_within(artifact_id, JOB_STALE_SECONDS + ARTIFACT_TTL, extend=True)
+
+        def report_album(event, preview):
+            self.store.add_event(job_id, event, preview)
+
+        options = json.loads(job['options']) if job.get('options') else {}
+        output_format = options.get('format', DEFAULT_OUTPUT_FORMAT)
+        targets = [tuple(target) for target in options.get('sizes', DEFAULT_TARGETS)]
+        effects = tuple(options.get('effects', DEFAULT_EFFECTS))
+        collage = options.get('collage')
+        bulk = options.get('bulk')
+        signature = ManifestStore.signature(output_format, targets, effects)
+        previous = None
+
+        try:
+            # Registered before anything is written, so the reaper finds it even if this worker dies
+            temp_dir = artifact_store.create(job_id, username, ttl=JOB_STALE_SECONDS + ARTIFACT_TTL)
+            generator = get_generator()
+            if bulk:
+                outcome = self._run_bulk(
+                    job, generator, [tuple(chart) for chart in bulk], temp_dir, report_progress, output_format, targets, effects,
+                    work_artifacts
+                )
+                return
+            if collage:
+                saved_files, temp_dir = generator.generate_collage_to_disk(
+                    username, job['period'], tuple(collage), targets[0][:2], temp_dir=temp_dir,
+                    progress_callback=report_progress, output_format=output_format, trace_id=trace_id
+                )
+            else:
+                previous = manifest_store.get(username, job['period'], signature)
+                saved_files, temp_dir = generator.generate_wallpapers_to_disk(
+                    username, job['period'], job['limit_count'], temp_dir=temp_dir, progress_callback=report_progress,
+                    output_format=output_format, targets=targets, effects=effects, manifest=previous, trace_id=trace_id,
+                    album_callback=report_album
+                )
+
+            if not saved_files:
+                outcome = 'empty'
+                artifact_store.remove(job_id)
+                self.store.update(
+                    job_id, status='failed',
+                    error='No wallpapers could be generated. The user might not have enough album data.'
+                )
+                return
+
+            stats = {'encoding': summarize_encoding(saved_files, output_format)}
+            if not collage:
+                stats['incremental'] = summarize_incremental(saved_files, previous)
+                manifest_store.put(username, job['period'], signature, build_manifest(saved_files))
+            zip_path = package_wallpapers_zip(saved_files, temp_dir, username)
+            artifact_store.publish(job_id, zip_path)
+            self.store.update(
+                job_id, status='done', count=len(saved_files), zip_path=zip_path, stats=json.dumps(stats)
+            )
+            outcome = 'done'
+            logger.info(f"{trace_prefix(trace_id)}Job {job_id} finished with {len(saved_files)} wallpapers")
+
+        except Exception as e:
+            logger.error(f"{trace_prefix(trace_id)}Error running job {job_id}: {str(e)}")
+            # Clean up any temporary files on error
+            if temp_dir:
+                artifact_store.remove(job_id)
+            self.store.update(job_id, status='failed', error=f'Error generating wallpapers: {str(e)}')
+        finally:
+            # Includes the time spent queued, as the client sees it
+            generate_latency.observe(time.time() - job['created_at'], outcome=outcome)
+
+    def _run_bulk(self, job, generator, charts, temp_dir, progress_callback, output_format, targets, effects,
+                  work_artifacts):
+        """Render a bulk job, registering every user's archive as its own artifact, and return the job outcome.
+
+        Each archive's ID is added to work_artifacts so progress keeps it alive until it is published.
+        """
+        job_id = job['id']
+        trace_id = job.get('trace_id')
+        archive_ids = {}
+
+        def archive_path(username, period):
+            archive_id = f'{job_id}-{len(archive_ids)}'
+            archive_ids[(username, period)] = archive_id
+            work_artifacts.append(archive_id)
+            directory = artifact_store.create(archive_id, username, ttl=JOB_STALE_SECONDS + ARTIFACT_TTL)
+            return os.path.join(directory, f'{username}_wallpapers.zip')
+
+        try:
+            report, _ = generator.generate_bulk_to_disk(
+                charts, job['limit_count'], temp_dir, archive_path, progress_callback, output_format, targets, effects,
+                trace_id
+            )
+        finally:
+            # Only the shared renders live in the job's own directory
+            artifact_store.remove(job_id)
+
+        for entry in report['users']:
+            zip_path = entry.pop('zip_path', None)
+            if zip_path:
+                archive_id = archive_ids[(entry['username'], entry['period'])]
+                artifact_store.publish(archive_id, zip_path)
+                entry['download_url'] = f"/download/{entry['username']}?job={archive_id}"
+
+        stats = json.dumps({'bulk': report})
+        if not report['wallpapers']:
+            self.store.update(job_id, status='failed', error='No wallpapers could be generated for any user.', stats=stats)
+            return 'empty'
+        self.store.update(job_id, status='done', count=report['wallpapers'], stats=stats)
+        logger.info(f"{trace_prefix(trace_id)}Bulk job {job_id} finished with {report['wallpapers']} wallpapers "
+                    f"for {len(charts) - report['users_failed']}/{len(charts)} users")
+        return 'done'
+
 # Initialize the generator
 lastfm_generator = None
+job_queue = JobQueue(JobStore())
+
+def get_generator():
+    """This worker's generator - credentials are read once rather than on every request"""
+    global lastfm_generator
+    if lastfm_generator is None:
+        lastfm_generator = LastFMWallpaperGenerator()
+    return lastfm_generator
+
+def warm_up():
+    """Load everything the first request would, so it doesn't pay for it.
+
+    Meant for gunicorn's master with preload_app (see gunicorn.conf.py): the
+    imported modules are then shared copy-on-write by every forked worker.
+    Starts no threads and opens no connections, which wouldn't survive a fork.
+    """
+    start = time.perf_counter()
+    wallpaper_lazy.warm_up(requests, psutil, asyncio, multiprocessing, futures_process, Image)
+    wallpaper_lazy.warm_up(wallpaper_render.np, wallpaper_render.Image, wallpaper_render.ImageEnhance, wallpaper_effects.np)
+    for name in ('requests.adapters', 'urllib3.util.retry'):
+        importlib.import_module(name)
+    try:
+        get_generator()
+    except ValueError as e:
+        logger.warning(f"Warm-up could not create the generator: {e}")
+    logger.info(f"Warmed up in {(time.perf_counter() - start) * 1000:.0f}ms")
 
 @app.route('/')
 def index():
@@ -435,10 +3542,20 @@ def health_check():
     """Health check endpoint"""
     try:
         # Test if we can create a generator instance
-        generator = LastFMWallpaperGenerator()
+        generator = get_generator()
         return jsonify({
             'status': 'healthy',
             'message': 'Server is running and API credentials are configured',
+            'http_pool': http_pool.stats(),
+            'cache': {
+                'covers': cover_cache.stats(), 'wallpapers': render_cache.stats(),
+                'tiles': tile_cache.stats(), 'api': api_cache.stats()
+            },
+            'url_patterns': variant_index.pattern_stats(),
+            'cover_hashes': cover_index.stats(),
+            'memory': memory_budget.stats(),
+            'artifacts': artifact_store.stats(),
+            'rate_limits': rate_limiter.stats(),
             'timestamp': time.time()
         })
     except Exception as e:
@@ -449,6 +3566,17 @@ def health_check():
             'timestamp': time.time()
         }), 500
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics merged across every worker"""
+    budget = memory_budget.stats()
+    body = metrics.render(gauges=[
+        ('memory_budget_bytes', 'Decoded pixel memory shared by all workers', budget['budget_bytes']),
+        ('memory_reserved_bytes', 'Memory currently reserved by running work', budget['reserved_bytes']),
+        ('lastfm_api_tokens', 'Last.fm API calls that can be sent right now', rate_limiter.tokens(LASTFM_API_BUCKET))
+    ])
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
 @app.route('/validate', methods=['POST'])
 def validate_user():
     """Validate Last.fm username"""
@@ -466,7 +3594,12 @@ def validate_user():
         if not username:
             return jsonify({'valid': False, 'message': 'Username is required'}), 400
         
-        generator = LastFMWallpaperGenerator()
+        # Only the client is charged - the page validates as the user types
+        limited = rate_limit()
+        if limited:
+            return limited
+        
+        generator = get_generator()
         is_valid, message = generator.validate_username(username)
         
         return jsonify({
@@ -474,14 +3607,55 @@ def validate_user():
             'message': message
         })
     
+    except RateLimited as e:
+        return upstream_busy_response(e)
     except Exception as e:
         logger.error(f"Error in validate_user: {str(e)}")
         return jsonify({'valid': False, 'message': f'Validation error: {str(e)}'}), 500
 
+def clamp_limit(limit):
+    """Keep the album limit within 1..MAX_ALBUM_LIMIT - memory is handled by admission control"""
+    if limit > MAX_ALBUM_LIMIT:
+        logger.warning(f"Limited to {MAX_ALBUM_LIMIT} wallpapers")
+        limit_clamps.inc()
+    return max(1, min(limit, MAX_ALBUM_LIMIT))
+
+def busy_response(error):
+    """503 for requests turned away by admission control"""
+    response = jsonify({'error': f'Server is busy - please try again shortly ({error})'})
+    response.headers['Retry-After'] = str(REQUEST_ADMISSION_TIMEOUT)
+    return response, 503
+
+def client_address():
+    """Address requests are rate limited by - the original client's when a trusted proxy forwards it"""
+    if TRUST_X_FORWARDED_FOR and request.access_route:
+        return request.access_route[0]
+    return request.remote_addr or 'unknown'
+
+def rate_limit(username=None):
+    """Charge the request to its client's bucket and the Last.fm user's, returning a 429 if either is empty"""
+    buckets = [(f'client:{client_address()}', CLIENT_RATE_PER_MINUTE / 60, CLIENT_BURST)]
+    if username:
+        buckets.append((f'user:{username.lower()}', USER_RATE_PER_HOUR / 3600, USER_BURST))
+    retry_after, limited_by = rate_limiter.acquire(buckets)
+    if not limited_by:
+        return None
+    scope = limited_by.split(':', 1)[0]
+    rate_limit_rejections.inc(scope=scope)
+    seconds = math.ceil(retry_after)
+    subject = 'this Last.fm user' if scope == 'user' else 'you'
+    response = jsonify({'error': f'Too many requests for {subject} - please try again in {seconds} seconds'})
+    response.headers['Retry-After'] = str(seconds)
+    return response, 429
+
+def upstream_busy_response(error):
+    """503 for requests whose Last.fm API calls were held back to stay under Last.fm's limit"""
+    response = jsonify({'error': 'Last.fm is busy - please try again shortly'})
+    response.headers['Retry-After'] = str(math.ceil(error.retry_after))
+    return response, 503
+
 @app.route('/generate', methods=['POST'])
 def generate_wallpapers():
-    global lastfm_generator
-    
     try:
         # Ensure we have JSON data
         if not request.is_json:
@@ -493,6 +3667,7 @@ def generate_wallpapers():
         
         username = data.get('username', '').strip()
         period = data.get('period', 'overall')
+        output_format = data.get('format', DEFAULT_OUTPUT_FORMAT)
         
         # Safely convert limit to int
         try:
@@ -503,130 +3678,379 @@ def generate_wallpapers():
         if not username:
             return jsonify({'error': 'Username is required'}), 400
         
-        # Adjust limit based on available memory - be more conservative
-        available_memory_gb = psutil.virtual_memory().available / (1024**3)
-        memory_percent = psutil.virtual_memory().percent
+        if output_format not in wallpaper_render.ENCODERS:
+            return jsonify({'error': f'Unknown format: {output_format}'}), 400
+        
+        try:
+            effects = parse_effects(data.get('effects'))
+            targets = parse_render_targets(data.get('sizes'), default_aspect_mode(effects))
+            collage = parse_grid(data.get('collage'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        if collage and len(targets) > 1:
+            return jsonify({'error': 'Collages are rendered at a single size'}), 400
+        
+        limit = clamp_limit(limit)
         
-        # More aggressive memory-based limits
-        if memory_percent > 70 or available_memory_gb < 1:
-            limit = min(limit, 5)
-            logger.warning(f"Limited to 5 wallpapers due to high memory usage ({memory_percent}%)")
-        elif memory_percent > 60 or available_memory_gb < 1.5:
-            limit = min(limit, 10)
-            logger.warning(f"Limited to 10 wallpapers due to memory constraints ({memory_percent}%)")
-        elif available_memory_gb < 2:
-            limit = min(limit, 15)
-            logger.warning(f"Limited to 15 wallpapers due to low memory")
-        elif limit > 25:
-            limit = 25
-            logger.warning(f"Limited to 25 wallpapers for performance")
+        limited = rate_limit(username)
+        if limited:
+            return limited
         
         try:
-            lastfm_generator = LastFMWallpaperGenerator()
+            generator = get_generator()
             
             # Validate username first
-            is_valid, validation_message = lastfm_generator.validate_username(username)
+            is_valid, validation_message = generator.validate_username(username)
             if not is_valid:
                 return jsonify({'error': validation_message}), 400
             
-            # Force garbage collection before starting
-            gc.collect()
-            
-            saved_files, temp_dir = lastfm_generator.generate_wallpapers_to_disk(username, period, limit)
-            
-            if not saved_files:
-                return jsonify({'error': 'No wallpapers could be generated. The user might not have enough album data.'}), 400
-            
-            # Create zip file with optimal compression for PNGs
-            zip_path = os.path.join(temp_dir, f"{username}_wallpapers.zip")
-            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=6) as zipf:
-                for saved_file in saved_files:
-                    zipf.write(saved_file['filepath'], saved_file['filename'])
-                    # Remove individual files after adding to zip
-                    try:
-                        os.remove(saved_file['filepath'])
-                    except:
-                        pass
-            
-            # Force garbage collection after processing
-            gc.collect()
+            # Rendering happens in the background; the client polls the status URL
+            trace_id = new_trace_id()
+            job_id = job_queue.submit(
+                username, period, limit, validation_message, options={'format': output_format, 'sizes': targets, 'effects': effects, 'collage': collage},
+                trace_id=trace_id
+            )
+            if not job_id:
+                return jsonify({'error': 'Server is busy - please try again in a minute'}), 503
             
             return jsonify({
                 'success': True,
-                'count': len(saved_files),
-                'download_url': f'/download/{username}',
+                'job_id': job_id,
+                'trace_id': trace_id,
+                'status_url': f'/jobs/{job_id}',
+                'events_url': f'/jobs/{job_id}/events',
                 'validation_message': validation_message
-            })
+            }), 202
             
+        except RateLimited as e:
+            return upstream_busy_response(e)
         except Exception as e:
-            logger.error(f"Error generating wallpapers: {str(e)}")
-            # Clean up any temporary files on error
-            try:
-                if 'temp_dir' in locals() and temp_dir and os.path.exists(temp_dir):
-                    shutil.rmtree(temp_dir)
-            except:
-                pass
-            gc.collect()
+            logger.error(f"Error queueing wallpaper job: {str(e)}")
             return jsonify({'error': f'Error generating wallpapers: {str(e)}'}), 500
             
     except Exception as e:
         logger.error(f"Error in generate_wallpapers: {str(e)}")
         return jsonify({'error': f'Request processing error: {str(e)}'}), 500
 
-def cleanup_old_temp_files():
-    """Clean up old temporary files to prevent disk space issues"""
+@app.route('/bulk', methods=['POST'])
+def bulk_generate():
+    """Queue one job that renders an archive per user, downloading and rendering shared covers once"""
     try:
-        current_time = time.time()
-        temp_base = tempfile.gettempdir()
-        
-        for item in os.listdir(temp_base):
-            if item.startswith('tmp'):
-                item_path = os.path.join(temp_base, item)
-                if os.path.isdir(item_path):
-                    # Remove directories older than 30 minutes
-                    if current_time - os.path.getctime(item_path) > 1800:
-                        try:
-                            shutil.rmtree(item_path)
-                            logger.info(f"Cleaned up old temp directory: {item_path}")
-                        except:
-                            pass
+        data = request.get_json(silent=True)
+        if not data:
+            return jsonify({'error': 'No JSON data provided'}), 400
+        
+        output_format = data.get('format', DEFAULT_OUTPUT_FORMAT)
+        if output_format not in wallpaper_render.ENCODERS:
+            return jsonify({'error': f'Unknown format: {output_format}'}), 400
+        try:
+            limit = int(data.get('limit', 10))
+        except (ValueError, TypeError):
+            limit = 10
+        
+        try:
+            # No per-user validate call - a user without a chart is reported in the job's results
+            charts = parse_bulk_charts(data.get('users'), data.get('period', 'overall'))
+            effects = parse_effects(data.get('effects'))
+            targets = parse_render_targets(data.get('sizes'), default_aspect_mode(effects))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        limited = rate_limit()
+        if limited:
+            return limited
+        
+        trace_id = new_trace_id()
+        job_id = job_queue.submit(
+            'bulk', charts[0][1], clamp_limit(limit), f'{len(charts)} users',
+            options={'format': output_format, 'sizes': targets, 'effects': effects, 'bulk': charts}, trace_id=trace_id
+        )
+        if not job_id:
+            return jsonify({'error': 'Server is busy - please try again in a minute'}), 503
+        
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'trace_id': trace_id,
+            'users': len(charts),
+            'status_url': f'/jobs/{job_id}'
+        }), 202
+    except Exception as e:
+        logger.error(f"Error queueing bulk job: {str(e)}")
+        return jsonify({'error': f'Request processing error: {str(e)}'}), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Report progress of a queued generate job"""
+    try:
+        # Make sure this worker also helps drain the shared queue
+        job_queue.start()
+        
+        job = job_queue.store.get(job_id)
+        if not job:
+            return jsonify({'error': 'Job not found or expired'}), 404
+        
+        return jsonify(job_response(job))
     except Exception as e:
-        logger.error(f"Error cleaning up temp files: {e}")
+        logger.error(f"Error reading job {job_id}: {str(e)}")
+        return jsonify({'error': f'Error reading job status: {str(e)}'}), 500
+
+def job_response(job):
+    """A job's status as /jobs/<id> reports it, also sent as the last event of its event stream"""
+    response = {
+        'job_id': job['id'],
+        'trace_id': job['trace_id'],
+        'status': job['status'],
+        'albums_done': job['albums_done'],
+        'albums_total': job['albums_total'],
+        'format': job['options'].get('format', DEFAULT_OUTPUT_FORMAT),
+        'sizes': job['options'].get('sizes', [list(target) for target in DEFAULT_TARGETS]),
+        'effects': job['options'].get('effects', list(DEFAULT_EFFECTS)),
+        'collage': job['options'].get('collage'),
+        'validation_message': job['validation_message']
+    }
+    if job['stats'] and 'bulk' in job['stats']:
+        # One archive per user, each with its own download_url
+        response['bulk'] = job['stats']['bulk']
+    if job['status'] == 'done':
+        response['success'] = True
+        response['count'] = job['count']
+        response['encoding'] = job['stats'].get('encoding')
+        response['incremental'] = job['stats'].get('incremental')
+        if 'bulk' not in job['stats']:
+            response['download_url'] = f"/download/{job['username']}?job={job['id']}"
+    elif job['status'] == 'failed':
+        response['error'] = job['error']
+    return response
+
+def sse_message(event, data, event_id=None):
+    """One text/event-stream message with a JSON payload"""
+    lines = [f'event: {event}']
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'data: {json.dumps(data)}')
+    return '\n'.join(lines) + '\n\n'
+
+def iter_job_events(job_id, last_event_id=0):
+    """Yield a job's events as server-sent events until it finishes or the stream has run its course.
+
+    Every finished album is an 'album' event carrying its preview as a data
+    URI; 'progress' follows whenever the album counts change, and the job's
+    final status is sent as a 'done' or 'failed' event carrying job_response.
+    """
+    started = time.monotonic()
+    last_sent = started
+    last_progress = None
+    # Reconnect promptly after the stream is cut off at JOB_EVENT_STREAM_SECONDS
+    yield f'retry: {int(JOB_EVENT_POLL_INTERVAL * 1000)}\n\n'
+    while True:
+        job = job_queue.store.get(job_id)
+        # Read after the job, so the events of a finished job are all there
+        for event_id, event, preview in job_queue.store.events(job_id, last_event_id):
+            if preview:
+                event['preview'] = 'data:image/jpeg;base64,' + base64.b64encode(preview).decode('ascii')
+            yield sse_message('album', event, event_id)
+            last_event_id = event_id
+            last_sent = time.monotonic()
+        
+        if job is None:
+            yield sse_message('failed', {'error': 'Job not found or expired'})
+            return
+        progress = (job['status'], job['albums_done'], job['albums_total'])
+        if progress != last_progress:
+            last_progress = progress
+            yield sse_message('progress', {
+                'status': job['status'], 'albums_done': job['albums_done'], 'albums_total': job['albums_total']
+            })
+            last_sent = time.monotonic()
+        if job['status'] in ('done', 'failed'):
+            yield sse_message(job['status'], job_response(job))
+            return
+        
+        now = time.monotonic()
+        if now - started > JOB_EVENT_STREAM_SECONDS:
+            return
+        if now - last_sent > JOB_EVENT_KEEPALIVE:
+            yield ': keep-alive\n\n'
+            last_sent = now
+        time.sleep(JOB_EVENT_POLL_INTERVAL)
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Stream a job's progress as server-sent events, resuming after Last-Event-ID on reconnect"""
+    try:
+        job_queue.start()
+        if not job_queue.store.get(job_id):
+            return jsonify({'error': 'Job not found or expired'}), 404
+        
+        try:
+            last_event_id = int(request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or 0)
+        except ValueError:
+            last_event_id = 0
+        return Response(
+            stream_with_context(iter_job_events(job_id, last_event_id)),
+            mimetype='text/event-stream',
+            # Proxies such as nginx would otherwise buffer the events
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+    except Exception as e:
+        logger.error(f"Error streaming events for job {job_id}: {str(e)}")
+        return jsonify({'error': f'Error reading job events: {str(e)}'}), 500
+
+def send_artifact(artifact, download_name):
+    """Send an archive with its content hash as a strong ETag, honoring Range and conditional headers.
+
+    With DOWNLOAD_OFFLOAD the front-end server sends the bytes itself, ranges
+    included, and this worker is free as soon as the headers are out.
+    """
+    if DOWNLOAD_OFFLOAD != 'x-accel':
+        # send_file answers If-None-Match / If-Range / Range itself; X-Sendfile is added when configured
+        return send_file(
+            artifact['zip_path'], mimetype='application/zip', as_attachment=True, download_name=download_name,
+            conditional=True, etag=artifact['etag'] or True
+        )
+
+    etag = artifact['etag']
+    if etag and request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        relative = os.path.relpath(artifact['zip_path'], artifact_store.root)
+        response = Response(mimetype='application/zip')
+        response.headers['X-Accel-Redirect'] = ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + relative.replace(os.sep, '/')
+        response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+    if etag:
+        response.set_etag(etag)
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
 
 @app.route('/download/<username>')
 def download_wallpapers(username):
     try:
-        # Clean up old files first
-        cleanup_old_temp_files()
-        
-        # Find the zip file in temp directory
-        temp_dirs = [d for d in os.listdir('/tmp') if d.startswith('tmp')]
-        for temp_dir in temp_dirs:
-            zip_path = os.path.join('/tmp', temp_dir, f"{username}_wallpapers.zip")
-            if os.path.exists(zip_path):
-                def remove_file_after_send():
-                    try:
-                        # Schedule cleanup after file is sent
-                        def cleanup():
-                            time.sleep(30)  # Wait 30 seconds before cleanup
-                            try:
-                                if os.path.exists(zip_path):
-                                    os.remove(zip_path)
-                                if os.path.exists(os.path.dirname(zip_path)):
-                                    shutil.rmtree(os.path.dirname(zip_path))
-                            except:
-                                pass
-                        threading.Thread(target=cleanup, daemon=True).start()
-                    except:
-                        pass
-                
-                remove_file_after_send()
-                return send_file(zip_path, as_attachment=True, download_name=f"{username}_wallpapers.zip")
+        # Jobs know their archive; without one, serve the user's newest
+        job_id = request.args.get('job')
+        artifact = artifact_store.get(job_id) if job_id else artifact_store.latest(username)
+        if artifact and artifact['username'] == username and artifact['zip_path'] and os.path.exists(artifact['zip_path']):
+            # The reaper deletes it shortly after; each resumed range request keeps it around a little longer
+            artifact_store.expire_within(artifact['id'], ARTIFACT_DOWNLOAD_GRACE, extend=request.range is not None)
+            return send_artifact(artifact, f"{username}_wallpapers.zip")
         
         return jsonify({'error': 'Wallpapers not found or expired'}), 404
     except Exception as e:
         logger.error(f"Error downloading wallpapers: {str(e)}")
         return jsonify({'error': f'Error downloading wallpapers: {str(e)}'}), 500
 
+@app.route('/download/<username>/stream')
+def stream_wallpapers(username):
+    """Render wallpapers and stream them straight into a ZIP response"""
+    try:
+        username = username.strip()
+        period = request.args.get('period', 'overall')
+        output_format = request.args.get('format', DEFAULT_OUTPUT_FORMAT)
+        
+        # Safely convert limit to int
+        try:
+            limit = int(request.args.get('limit', 10))
+        except (ValueError, TypeError):
+            limit = 10
+        
+        if output_format not in wallpaper_render.ENCODERS:
+            return jsonify({'error': f'Unknown format: {output_format}'}), 400
+        
+        try:
+            effects = parse_effects(request.args.get('effects'))
+            targets = parse_render_targets(request.args.get('sizes'), default_aspect_mode(effects))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        limit = clamp_limit(limit)
+        
+        limited = rate_limit(username)
+        if limited:
+            return limited
+        
+        generator = get_generator()
+        
+        # Validate before the first byte goes out - errors can't be reported mid-stream
+        is_valid, validation_message = generator.validate_username(username)
+        if not is_valid:
+            return jsonify({'error': validation_message}), 400
+        
+        trace_id = new_trace_id()
+        try:
+            wallpapers = generator.iter_wallpapers(
+                username, period, limit, output_format=output_format, targets=targets, effects=effects, trace_id=trace_id
+            )
+        except MemoryBudgetExceeded as e:
+            return busy_response(e)
+        response = Response(
+            stream_with_context(stream_wallpapers_zip(wallpapers)),
+            mimetype='application/zip',
+            headers={'Content-Disposition': f'attachment; filename="{username}_wallpapers.zip"', 'X-Trace-Id': trace_id}
+        )
+        # The ZIP generator may never start (HEAD, or a client gone before the first chunk)
+        response.call_on_close(wallpapers.close)
+        return response
+    except RateLimited as e:
+        return upstream_busy_response(e)
+    except Exception as e:
+        logger.error(f"Error streaming wallpapers: {str(e)}")
+        return jsonify({'error': f'Error streaming wallpapers: {str(e)}'}), 500
+
+@app.route('/collage/<username>')
+def collage_wallpaper(username):
+    """Render a single collage wallpaper from the user's top albums and return the image"""
+    try:
+        username = username.strip()
+        period = request.args.get('period', 'overall')
+        output_format = request.args.get('format', DEFAULT_OUTPUT_FORMAT)
+        
+        if output_format not in wallpaper_render.ENCODERS:
+            return jsonify({'error': f'Unknown format: {output_format}'}), 400
+        
+        try:
+            grid = parse_grid(request.args.get('grid')) or DEFAULT_COLLAGE_GRID
+            targets = parse_render_targets(request.args.get('size'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        if len(targets) > 1:
+            return jsonify({'error': 'Collages are rendered at a single size'}), 400
+        
+        limited = rate_limit(username)
+        if limited:
+            return limited
+        
+        generator = get_generator()
+        is_valid, validation_message = generator.validate_username(username)
+        if not is_valid:
+            return jsonify({'error': validation_message}), 400
+        
+        trace_id = new_trace_id()
+        try:
+            result = generator.render_collage(
+                username, period, grid, targets[0][:2], output_format, admission_timeout=REQUEST_ADMISSION_TIMEOUT,
+                trace_id=trace_id
+            )
+        except MemoryBudgetExceeded as e:
+            return busy_response(e)
+        if not result:
+            return jsonify({'error': 'No album covers found for this user'}), 404
+        
+        return Response(
+            result['data'],
+            mimetype=wallpaper_render.ENCODERS[output_format]['mimetype'],
+            headers={
+                'Content-Disposition': f'attachment; filename="{result["filename"]}"',
+                'X-Collage-Tiles': json.dumps(result['tiles']),
+                'X-Trace-Id': trace_id
+            }
+        )
+    except RateLimited as e:
+        return upstream_busy_response(e)
+    except Exception as e:
+        logger.error(f"Error rendering collage: {str(e)}")
+        return jsonify({'error': f'Error rendering collage: {str(e)}'}), 500
+
 if __name__ == '__main__':
     app.run(debug=False, host='0.0.0.0', port=PORT)
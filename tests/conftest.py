@@ -0,0 +1,17 @@
+"""
+Shared setup: the app's modules are imported from the repository root with
+throwaway caches and dummy credentials, so tests never touch a real cache.
+"""
+
+import os
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+_work_dir = tempfile.mkdtemp(prefix='wallpaper-tests-')
+os.environ['WALLPAPER_CACHE_DIR'] = os.path.join(_work_dir, 'cache')
+os.environ['JOB_DB_PATH'] = os.path.join(_work_dir, 'jobs.sqlite3')
+os.environ.setdefault('LASTFM_API_KEY', 'test')
+os.environ.setdefault('LASTFM_SHARED_SECRET', 'test')
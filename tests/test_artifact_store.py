@@ -0,0 +1,43 @@
+import os
+import time
+
+import pytest
+
+from lastfm_wallpaper import ArtifactStore
+
+@pytest.fixture
+def artifacts(tmp_path):
+    return ArtifactStore(str(tmp_path / 'artifacts.sqlite3'), str(tmp_path / 'artifacts'))
+
+def test_reaps_expired(artifacts):
+    directory = artifacts.create('job-1', 'alice', ttl=60)
+    assert os.path.isdir(directory)
+    assert artifacts.reap() == 0
+    assert artifacts.reap(now=time.time() + 61) == 1
+    assert not os.path.exists(directory)
+    assert artifacts.get('job-1') is None
+
+def test_publish_and_expire_within(artifacts):
+    directory = artifacts.create('job-1', 'alice', ttl=60)
+    zip_path = os.path.join(directory, 'alice_wallpapers.zip')
+    with open(zip_path, 'wb') as f:
+        f.write(b'zip')
+    artifacts.publish('job-1', zip_path, ttl=600)
+    assert artifacts.latest('alice')['zip_path'] == zip_path
+    assert artifacts.get('job-1')['etag']
+
+    # Downloads shorten the expiry but never lengthen it, unless extending
+    artifacts.expire_within('job-1', 30)
+    expires_at = artifacts.get('job-1')['expires_at']
+    artifacts.expire_within('job-1', 300)
+    assert artifacts.get('job-1')['expires_at'] == expires_at
+    artifacts.expire_within('job-1', 300, extend=True)
+    assert artifacts.get('job-1')['expires_at'] > expires_at + 200
+
+def test_remove(artifacts):
+    directory = artifacts.create('job-1', 'alice')
+    artifacts.remove('job-1')
+    assert artifacts.get('job-1') is None
+    # The reaper thread may get there first
+    artifacts.reap()
+    assert not os.path.exists(directory)
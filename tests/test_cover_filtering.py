@@ -0,0 +1,75 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+import wallpaper_render
+from lastfm_wallpaper import COVER_HASH_DISTANCE, MIN_COVER_DETAIL, CoverDeduper, TopAlbumPager, hash_distance
+from test_pager import FakeGenerator, names
+
+def artwork(seed, size=300, quality=90, fmt='JPEG'):
+    """Blocky random art, like a cover with a few large shapes"""
+    blocks = np.random.default_rng(seed).integers(0, 256, (8, 8, 3), dtype=np.uint8)
+    image = Image.fromarray(blocks).resize((size, size), Image.Resampling.NEAREST)
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, quality=quality)
+    return buffer.getvalue()
+
+def solid(color=(40, 40, 40)):
+    buffer = io.BytesIO()
+    Image.new('RGB', (300, 300), color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+def test_cover_hash_matches_resized_recompressed_copies():
+    original, _ = wallpaper_render.cover_hash(artwork(1))
+    copy, _ = wallpaper_render.cover_hash(artwork(1, size=1200, quality=60))
+    assert hash_distance(original, copy) <= COVER_HASH_DISTANCE
+
+def test_cover_hash_separates_different_art():
+    hashes = [wallpaper_render.cover_hash(artwork(seed))[0] for seed in range(5)]
+    for i, a in enumerate(hashes):
+        for b in hashes[i + 1:]:
+            assert hash_distance(a, b) > COVER_HASH_DISTANCE
+
+def test_cover_hash_detail_flags_blank_covers():
+    assert wallpaper_render.cover_hash(solid())[1] < MIN_COVER_DETAIL
+    assert wallpaper_render.cover_hash(artwork(1))[1] > MIN_COVER_DETAIL
+
+class FakeIndex:
+    """Cover index that knows nothing and classifies from a url -> (hash, reason) table"""
+
+    def __init__(self, verdicts):
+        self.verdicts = verdicts
+
+    def lookup(self, url):
+        return None
+
+    def classify(self, url, data):
+        return self.verdicts[url]
+
+def test_deduper_threshold_is_inclusive():
+    base = 0
+    near = (1 << COVER_HASH_DISTANCE) - 1  # Differs in exactly COVER_HASH_DISTANCE bits
+    far = (1 << (COVER_HASH_DISTANCE + 1)) - 1
+    deduper = CoverDeduper(FakeIndex({'a': (base, None), 'b': (near, None), 'c': (far, None)}))
+    assert deduper.check_cover('a', b'') is None
+    assert deduper.check_cover('b', b'') == 'near_duplicate'
+    assert deduper.check_cover('c', b'') is None
+    assert deduper.skipped == {'near_duplicate': 1}
+
+def test_deduper_without_deduplicate_keeps_repeats_but_not_placeholders():
+    deduper = CoverDeduper(FakeIndex({'a': (0, None), 'b': (0, None), 'p': (0, 'placeholder')}), deduplicate=False)
+    assert deduper.check_cover('a', b'') is None
+    assert deduper.check_cover('b', b'') is None
+    assert deduper.check_cover('p', b'') == 'placeholder'
+
+def test_deduper_judges_each_url_once():
+    deduper = CoverDeduper(FakeIndex({'a': (0, None)}))
+    assert deduper.check_cover('a', b'') is None
+    assert deduper.check_cover('a', b'') is None
+
+def test_pager_drops_known_placeholders():
+    generator = FakeGenerator([[('a', 'u1'), ('b', 'star')], [('c', 'star'), ('d', 'u2')]], placeholders={'star'})
+    pager = TopAlbumPager(generator, 'alice', limit=4, page_size=2)
+    assert names(pager) == [['a'], ['d']]
+    assert pager.placeholders == 2
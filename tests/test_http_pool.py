@@ -0,0 +1,18 @@
+from lastfm_wallpaper import HTTPSessionPool
+
+def retried_statuses(pool, url):
+    return set(pool.session.get_adapter(url).max_retries.status_forcelist)
+
+def test_api_host_leaves_429_to_the_rate_limiter():
+    pool = HTTPSessionPool()
+    assert 429 not in retried_statuses(pool, 'http://ws.audioscrobbler.com/2.0/')
+    assert 503 in retried_statuses(pool, 'http://ws.audioscrobbler.com/2.0/')
+
+def test_other_hosts_retry_429():
+    pool = HTTPSessionPool()
+    assert 429 in retried_statuses(pool, 'https://lastfm.freetls.fastly.net/i/u/300x300/cover.jpg')
+    assert 429 in retried_statuses(pool, 'https://example.com/cover.jpg')
+
+def test_custom_api_host_gets_its_own_adapter():
+    pool = HTTPSessionPool(api_host='127.0.0.1')
+    assert 429 not in retried_statuses(pool, 'http://127.0.0.1:8080/2.0/')
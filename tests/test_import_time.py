@@ -0,0 +1,13 @@
+import os
+import subprocess
+import sys
+
+from conftest import ROOT
+
+def test_import_within_budget_and_deferred():
+    # Fresh interpreters, like the benchmark; a warm sys.modules here would hide eager imports
+    result = subprocess.run(
+        [sys.executable, os.path.join(ROOT, 'benchmarks', 'import_time.py'), '--runs', '3', '--budget-ms', '350'],
+        capture_output=True, text=True, timeout=120
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
@@ -0,0 +1,45 @@
+import threading
+import time
+
+import pytest
+
+from lastfm_wallpaper import JobQueue, JobStore
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / 'jobs.sqlite3'))
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+def test_stop_waits_for_running_jobs(store, monkeypatch):
+    queue = JobQueue(store, workers=1)
+    finished = []
+    monkeypatch.setattr(queue, '_run', lambda job: (time.sleep(0.2), finished.append(job['id'])))
+    job_id = queue.submit('alice', 'overall', 5)
+    wait_for(lambda: store.get(job_id)['status'] == 'running')
+    assert queue.stop(5)
+    assert finished == [job_id]
+
+def test_stop_marks_unfinished_jobs_failed(store, monkeypatch):
+    queue = JobQueue(store, workers=1)
+    release = threading.Event()
+    monkeypatch.setattr(queue, '_run', lambda job: release.wait(5))
+    job_id = queue.submit('alice', 'overall', 5)
+    wait_for(lambda: store.get(job_id)['status'] == 'running')
+    assert not queue.stop(0.1)
+    job = store.get(job_id)
+    assert job['status'] == 'failed'
+    assert 'restarted' in job['error']
+    release.set()
+
+def test_stopped_queue_claims_nothing(store, monkeypatch):
+    queue = JobQueue(store, workers=1)
+    queue.start()
+    assert queue.stop(5)
+    job_id = store.create('bob', 'overall', 5)
+    time.sleep(0.2)
+    assert store.get(job_id)['status'] == 'queued'
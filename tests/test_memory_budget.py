@@ -0,0 +1,44 @@
+import threading
+import time
+
+import pytest
+
+import lastfm_wallpaper
+from lastfm_wallpaper import MemoryBudget, MemoryBudgetExceeded
+
+@pytest.fixture
+def budget(tmp_path):
+    return MemoryBudget(str(tmp_path / 'memory.sqlite3'), budget=100)
+
+def test_reserve_and_release(budget):
+    first = budget.try_reserve(60, 'first')
+    assert first
+    assert budget.try_reserve(60, 'second') is None
+    budget.release(first)
+    assert budget.try_reserve(60, 'second')
+
+def test_oversized_work_is_admitted_alone(budget):
+    assert budget.try_reserve(1000, 'huge')
+    assert budget.try_reserve(1, 'small') is None
+
+def test_wait_is_woken_by_release(budget):
+    held = budget.try_reserve(100, 'held')
+    threading.Timer(0.1, budget.release, [held]).start()
+    start = time.monotonic()
+    assert budget.reserve(50, 'waiting', timeout=5)
+    assert time.monotonic() - start < 1
+
+def test_admit_modes(budget):
+    reservation, sequential = budget.admit('parallel', 80, 20)
+    assert reservation and not sequential
+    second, sequential = budget.admit('sequential', 80, 20, timeout=0)
+    assert second and sequential
+    with pytest.raises(MemoryBudgetExceeded):
+        budget.admit('rejected', 80, 20, timeout=0)
+
+def test_heartbeat_while_waiting(budget, monkeypatch):
+    monkeypatch.setattr(lastfm_wallpaper, 'MEMORY_WAIT_HEARTBEAT', 0.1)
+    budget.try_reserve(100, 'held')
+    beats = []
+    assert budget.reserve(50, 'waiting', timeout=0.6, heartbeat=lambda: beats.append(1)) is None
+    assert len(beats) >= 2
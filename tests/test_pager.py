@@ -0,0 +1,60 @@
+import pytest
+
+import lastfm_wallpaper
+from lastfm_wallpaper import TopAlbumPager
+
+class FakeGenerator:
+    """Serves user.gettopalbums pages from lists of (album name, image URL)"""
+
+    api_key = 'test'
+
+    def __init__(self, pages, placeholders=()):
+        self.pages = pages
+        self.placeholders = set(placeholders)
+        self.cover_index = self
+        self.requested = []
+
+    def _api_get(self, params, timeout, ttl):
+        page = params['page']
+        self.requested.append(page)
+        albums = self.pages[page - 1] if page <= len(self.pages) else []
+        return {'topalbums': {
+            'album': [{'name': name, 'image_url': url} for name, url in albums],
+            '@attr': {'totalPages': len(self.pages), 'total': sum(len(albums) for albums in self.pages)}
+        }}
+
+    def get_best_album_image(self, album):
+        return album['image_url']
+
+    def rejected(self, urls):
+        return {url for url in urls if url in self.placeholders}
+
+def names(pages):
+    return [[album['name'] for album in page] for page in pages]
+
+def test_drops_albums_without_covers_and_duplicates():
+    generator = FakeGenerator([[('a', 'u1'), ('b', None), ('c', 'u1')], [('d', 'u2'), ('e', 'u3')]])
+    pager = TopAlbumPager(generator, 'alice', limit=5, page_size=3)
+    assert names(pager) == [['a'], ['d', 'e']]
+    assert (pager.duplicates, pager.expected) == (1, 5)
+
+def test_keeps_going_after_an_empty_page():
+    generator = FakeGenerator([[('a', None), ('b', None)], [('c', 'u1'), ('d', 'u2')]])
+    assert names(TopAlbumPager(generator, 'alice', limit=4, page_size=2)) == [[], ['c', 'd']]
+
+def test_stops_at_the_limit():
+    generator = FakeGenerator([[(f'{page}-{i}', f'u{page}-{i}') for i in range(2)] for page in range(10)])
+    pager = TopAlbumPager(generator, 'alice', limit=3, page_size=2)
+    assert sum(len(page) for page in pager) == 3
+    assert max(generator.requested) <= 2 + lastfm_wallpaper.TOP_ALBUMS_PAGE_CONCURRENCY
+
+def test_narrows_expected_to_short_charts():
+    pager = TopAlbumPager(FakeGenerator([[('a', 'u1'), ('b', 'u2')]]), 'alice', limit=50, page_size=10)
+    assert names(pager) == [['a', 'b']]
+    assert pager.expected == 2
+
+@pytest.mark.parametrize('limit', [1, 2])
+def test_small_limit_is_one_request(limit):
+    generator = FakeGenerator([[('a', 'u1'), ('b', 'u2')], [('c', 'u3')]])
+    list(TopAlbumPager(generator, 'alice', limit=limit))
+    assert generator.requested == [1]
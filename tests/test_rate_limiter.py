@@ -0,0 +1,54 @@
+import threading
+
+import pytest
+
+import lastfm_wallpaper
+from lastfm_wallpaper import RateLimiter
+
+@pytest.fixture
+def limiter(tmp_path):
+    return RateLimiter(str(tmp_path / 'ratelimits.sqlite3'))
+
+def test_allows_burst_then_limits(limiter):
+    bucket = ('client:a', 1.0, 3)
+    assert [limiter.acquire([bucket]) for _ in range(3)] == [(0, None)] * 3
+    retry_after, limited_by = limiter.acquire([bucket])
+    assert limited_by == 'client:a'
+    assert 0 < retry_after <= 1
+
+def test_takes_from_all_buckets_or_none(limiter):
+    client, user = ('client:a', 1.0, 5), ('user:bob', 1.0, 1)
+    assert limiter.acquire([client, user]) == (0, None)
+    assert limiter.acquire([client, user])[1] == 'user:bob'
+    # The refused request took nothing from the client bucket
+    assert limiter.tokens(client) == pytest.approx(4, abs=0.1)
+
+def test_zero_rate_is_unlimited(limiter):
+    bucket = ('client:a', 0, 1)
+    assert all(limiter.acquire([bucket]) == (0, None) for _ in range(5))
+    limiter.drain(bucket, 30)
+    assert limiter.acquire([bucket]) == (0, None)
+
+def test_drain(limiter):
+    bucket = ('upstream:example', 2.0, 10)
+    limiter.drain(bucket, 5)
+    retry_after, limited_by = limiter.acquire([bucket])
+    assert limited_by == 'upstream:example'
+    assert retry_after == pytest.approx(5.5, abs=0.1)
+
+def test_wait_raises_past_timeout(limiter):
+    bucket = ('client:a', 0.1, 1)
+    limiter.wait([bucket], timeout=0)
+    with pytest.raises(lastfm_wallpaper.RateLimited):
+        limiter.wait([bucket], timeout=1)
+
+def test_concurrent_acquires(limiter):
+    bucket = ('client:a', 0.001, 20)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(limiter.acquire([bucket]))) for _ in range(30)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(1 for _, limited_by in results if limited_by is None) == 20
+    assert limiter._acquired == 30
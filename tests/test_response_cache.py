@@ -0,0 +1,51 @@
+import threading
+import time
+
+import pytest
+
+from lastfm_wallpaper import TTLResponseCache
+
+def test_coalesces_concurrent_fetches():
+    cache = TTLResponseCache()
+    calls = []
+    release = threading.Event()
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return {'albums': 3}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_fetch('chart', 60, fetch))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert results == [{'albums': 3}] * 8
+    assert cache.stats()['coalesced'] == 7
+    assert cache.get_or_fetch('chart', 60, fetch) == {'albums': 3}
+    assert len(calls) == 1
+
+def test_errors_are_shared_but_not_stored():
+    cache = TTLResponseCache()
+    with pytest.raises(ValueError):
+        cache.get_or_fetch('chart', 60, lambda: (_ for _ in ()).throw(ValueError('upstream')))
+    assert cache.get_or_fetch('chart', 60, lambda: 'fresh') == 'fresh'
+
+def test_respects_cacheable_and_ttl():
+    cache = TTLResponseCache()
+    assert cache.get_or_fetch('error', 60, lambda: {'error': 29}, cacheable=lambda value: 'error' not in value)
+    assert cache.get_or_fetch('error', 60, lambda: 'retried', cacheable=lambda value: True) == 'retried'
+    cache.get_or_fetch('short', 0.05, lambda: 'old')
+    time.sleep(0.1)
+    assert cache.get_or_fetch('short', 60, lambda: 'new') == 'new'
+
+def test_evicts_least_recent():
+    cache = TTLResponseCache(max_entries=2)
+    for key in ('a', 'b', 'c'):
+        cache.get_or_fetch(key, 60, lambda: key)
+    assert cache.stats()['entries'] == 2
+    assert cache.get_or_fetch('a', 60, lambda: 'refetched') == 'refetched'
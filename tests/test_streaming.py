@@ -0,0 +1,47 @@
+import pytest
+
+import lastfm_wallpaper
+from lastfm_wallpaper import MemoryBudget
+
+@pytest.fixture
+def budget(tmp_path, monkeypatch):
+    budget = MemoryBudget(str(tmp_path / 'memory.sqlite3'), budget=1 << 30)
+    monkeypatch.setattr(lastfm_wallpaper, 'memory_budget', budget)
+    return budget
+
+@pytest.fixture
+def generator(monkeypatch):
+    generator = lastfm_wallpaper.LastFMWallpaperGenerator()
+    # No chart at all, so iterating never reaches the network
+    monkeypatch.setattr(generator, 'iter_top_album_pages', lambda *args: iter(()))
+    return generator
+
+def test_stream_reservation_released_when_closed_before_start(budget, generator):
+    wallpapers = generator.iter_wallpapers('someone', limit=10)
+    assert budget.stats()['reservations'] == 1
+    wallpapers.close()
+    assert budget.stats()['reservations'] == 0
+    wallpapers.close()
+
+def test_stream_reservation_released_when_exhausted(budget, generator):
+    assert list(generator.iter_wallpapers('someone', limit=10)) == []
+    assert budget.stats()['reservations'] == 0
+
+def test_stream_reservation_released_on_error(budget, generator, monkeypatch):
+    def broken(*args):
+        raise ValueError('chart unavailable')
+        yield
+    monkeypatch.setattr(generator, '_iter_admitted_wallpapers', broken)
+    with pytest.raises(ValueError):
+        next(generator.iter_wallpapers('someone', limit=10))
+    assert budget.stats()['reservations'] == 0
+
+def test_streamed_response_releases_reservation_without_a_body(budget, generator, monkeypatch):
+    monkeypatch.setattr(lastfm_wallpaper, 'get_generator', lambda: generator)
+    monkeypatch.setattr(generator, 'validate_username', lambda username: (True, None))
+    monkeypatch.setattr(lastfm_wallpaper, 'rate_limit', lambda username: None)
+    client = lastfm_wallpaper.app.test_client()
+    response = client.head('/download/someone/stream?limit=10')
+    assert response.status_code == 200
+    response.close()
+    assert budget.stats()['reservations'] == 0
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Deferred imports for heavy dependencies.
+numpy, Pillow, requests and psutil take most of the app's import time but are
+only needed once real work starts, so modules bind them to a LazyModule that
+imports on first attribute access. warm_up() loads them all ahead of time.
+"""
+
+import importlib
+
+class LazyModule:
+    """Stand-in for a module, imported the first time one of its attributes is used"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            # The import system serializes threads racing to import the same module
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f'<lazy module {self._name!r} ({state})>'
+
+def warm_up(*modules):
+    """Import every given LazyModule now, e.g. before gunicorn forks its workers"""
+    for module in modules:
+        if isinstance(module, LazyModule) and module._module is None:
+            module._module = importlib.import_module(module._name)
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Minimal Prometheus-style counters and histograms, rendered in the text exposition format.
+Each gunicorn worker keeps its own registry and writes a snapshot of it to a shared
+directory every few seconds; /metrics merges the snapshots of every worker. Snapshots
+of workers that have exited are folded into one cumulative file.
+"""
+
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Seconds - covers a cache hit through a multi-minute generate job
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SNAPSHOT_INTERVAL = 5  # Seconds between snapshot writes while a worker is recording
+EXITED_SNAPSHOT = 'exited.json'  # Running totals of every worker that has exited
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonic count per label set"""
+
+    kind = 'counter'
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        self.registry.changed()
+
+    def snapshot(self):
+        return {json.dumps(key): value for key, value in self._values.items()}
+
+    @staticmethod
+    def merge(into, samples):
+        for key, value in samples.items():
+            into[key] = into.get(key, 0) + value
+
+    def render(self, samples):
+        for key, value in sorted(samples.items()):
+            labels = zip(self.labelnames, json.loads(key))
+            yield f'{self.name}{_format_labels(labels)} {_format_value(value)}'
+
+class Histogram:
+    """Cumulative-bucket latency histogram per label set, observed in seconds"""
+
+    kind = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # key -> [count per bucket..., count in +Inf, sum]
+
+    _key = Counter._key
+
+    def observe(self, seconds, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    values[i] += 1
+                    break
+            else:
+                values[len(self.buckets)] += 1
+            values[-1] += seconds
+        self.registry.changed()
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time of the block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        return {json.dumps(key): list(values) for key, values in self._values.items()}
+
+    @staticmethod
+    def merge(into, samples):
+        for key, values in samples.items():
+            if key in into:
+                into[key] = [a + b for a, b in zip(into[key], values)]
+            else:
+                into[key] = list(values)
+
+    def render(self, samples):
+        for key, values in sorted(samples.items()):
+            labels = list(zip(self.labelnames, json.loads(key)))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values):
+                cumulative += count
+                yield f'{self.name}_bucket{_format_labels(labels, [("le", _format_value(bound))])} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(labels)} {_format_value(values[-1])}'
+            yield f'{self.name}_count{_format_labels(labels)} {cumulative}'
+
+class Registry:
+    """Metrics of one process, shared with other workers through snapshot files in directory"""
+
+    def __init__(self, directory=None, interval=SNAPSHOT_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self.lock = threading.Lock()
+        self._metrics = {}
+        self._dirty = threading.Event()
+        self._flusher_pid = None
+        self._worker_pid = None
+        self._worker_id = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(self, name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self, name, documentation, labelnames, buckets))
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Duplicate metric {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def changed(self):
+        self._dirty.set()
+        if self.directory and self._flusher_pid != os.getpid():
+            self._start_flusher()
+
+    def _start_flusher(self):
+        with self.lock:
+            # Threads don't survive a fork - each worker starts its own
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            self._dirty.wait()
+            time.sleep(self.interval)
+            self._dirty.clear()
+            try:
+                self.write_snapshot()
+            except OSError:
+                pass
+
+    def snapshot(self):
+        with self.lock:
+            return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    def _snapshot_name(self):
+        # Unique per process start, so a reused PID never overwrites an exited worker's snapshot
+        if self._worker_pid != os.getpid():
+            self._worker_pid = os.getpid()
+            self._worker_id = f'{os.getpid()}-{uuid.uuid4().hex[:12]}'
+        return f'{self._worker_id}.json'
+
+    def _write_json(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.part-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def write_snapshot(self):
+        """Atomically publish this process's metrics for the other workers to merge"""
+        self._write_json(os.path.join(self.directory, self._snapshot_name()), self.snapshot())
+
+    @staticmethod
+    def _read_json(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _is_running(name):
+        try:
+            pid = int(name.split('-', 1)[0].split('.', 1)[0])
+        except ValueError:
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def _merge_into(self, merged, snapshot):
+        for name, samples in snapshot.items():
+            if name in self._metrics:
+                self._metrics[name].merge(merged.setdefault(name, {}), samples)
+
+    @contextmanager
+    def _folding(self):
+        # Held while snapshots are folded or read, so none is counted twice or missed mid-fold
+        with open(os.path.join(self.directory, '.fold.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _fold_exited(self, names):
+        """Add the snapshots of workers that are no longer running to EXITED_SNAPSHOT and remove them"""
+        exited = [name for name in names if name != EXITED_SNAPSHOT and not self._is_running(name)]
+        if not exited:
+            return names
+        totals = self._read_json(os.path.join(self.directory, EXITED_SNAPSHOT)) or {}
+        for name in exited:
+            self._merge_into(totals, self._read_json(os.path.join(self.directory, name)) or {})
+        self._write_json(os.path.join(self.directory, EXITED_SNAPSHOT), totals)
+        for name in exited:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+        return [name for name in names if name not in exited] + [EXITED_SNAPSHOT]
+
+    def collect(self):
+        """Merge the live metrics of this process with the last snapshot of every other one.
+
+        Exited workers' snapshots are folded into one running total first, so
+        counters don't go backwards when a worker is recycled and the
+        directory doesn't grow with every restart.
+        """
+        snapshots = [self.snapshot()]
+        if self.directory:
+            own = self._snapshot_name()
+            with self._folding():
+                names = [name for name in os.listdir(self.directory) if name.endswith('.json') and name != own]
+                try:
+                    names = self._fold_exited(names)
+                except OSError:
+                    pass
+                for name in set(names):
+                    snapshot = self._read_json(os.path.join(self.directory, name))
+                    if snapshot:
+                        snapshots.append(snapshot)
+
+        merged = {name: {} for name in self._metrics}
+        for snapshot in snapshots:
+            self._merge_into(merged, snapshot)
+        return merged
+
+    def render(self, gauges=()):
+        """Text exposition of every metric, plus (name, documentation, value) gauges read at scrape time"""
+        lines = []
+        for name, samples in self.collect().items():
+            metric = self._metrics[name]
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            lines.extend(metric.render(samples))
+        for name, documentation, value in gauges:
+            lines.append(f'# HELP {name} {documentation}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+"""
+CPU-bound wallpaper rendering steps.
+Kept free of Flask and network imports so process pool workers start quickly.
+"""
+
+import functools
+import io
+import threading
+from fractions import Fraction
+import wallpaper_effects
+from wallpaper_lazy import LazyModule
+from wallpaper_effects import timed
+
+# Loaded on first use, so importing this module for ENCODERS and ASPECT_MODES stays cheap
+np = LazyModule('numpy')
+Image = LazyModule('PIL.Image')
+ImageEnhance = LazyModule('PIL.ImageEnhance')
+
+# Let resize() shrink by whole factors with reduce() before the final LANCZOS pass
+REDUCING_GAP = 3.0
+
+# Output encoder presets, selectable per request
+ENCODERS = {
+    # Original output: smallest lossless PNG, slowest to encode
+    'png': {
+        'format': 'PNG', 'extension': 'png', 'mimetype': 'image/png',
+        'options': {'optimize': True, 'compress_level': 6}
+    },
+    # No optimize pass and a low zlib level - several times faster, somewhat larger files
+    'png-fast': {
+        'format': 'PNG', 'extension': 'png', 'mimetype': 'image/png',
+        'options': {'compress_level': 1}
+    },
+    'jpeg': {
+        'format': 'JPEG', 'extension': 'jpg', 'mimetype': 'image/jpeg',
+        'options': {'quality': 92, 'subsampling': 0, 'progressive': True}
+    },
+    'webp': {
+        'format': 'WEBP', 'extension': 'webp', 'mimetype': 'image/webp',
+        'options': {'quality': 90, 'method': 4}
+    },
+    'webp-lossless': {
+        'format': 'WEBP', 'extension': 'webp', 'mimetype': 'image/webp',
+        'options': {'lossless': True, 'quality': 60, 'method': 4}
+    },
+}
+DEFAULT_ENCODER = 'png'
+
+# How a cover is fitted to a target size:
+#   fill        - stretch to the exact size (the original behavior)
+#   crop-center - scale to cover the target, keeping aspect ratio, and crop the overflow evenly
+#   fit         - scale to fit inside the target, keeping aspect ratio, and letterbox the rest
+ASPECT_MODES = ('fill', 'crop-center', 'fit')
+DEFAULT_ASPECT_MODE = 'fill'
+LETTERBOX_COLOR = (0, 0, 0)
+
+# Spare canvases kept per size for collage compositing
+CANVAS_POOL_PER_SIZE = 2
+
+# Memory estimates - draft() may leave a JPEG up to twice the requested size per side,
+# and encoded photos are assumed to take at most half their raw size
+DRAFT_OVERSHOOT_AREA = 4
+ENCODED_FRACTION = 0.5
+
+# Progress previews - made from the decoded cover, small enough to send inline in an event
+PREVIEW_SIZE = (160, 160)
+PREVIEW_QUALITY = 70
+
+# Perceptual hashing - the lowest HASH_SIZE x HASH_SIZE DCT frequencies of a small grayscale sample
+HASH_SAMPLE_SIZE = 32
+HASH_SIZE = 8
+
+def open_at_size(data, max_size):
+    """Open image bytes, letting JPEGs decode near the size they'd be capped to.
+
+    The cover only needs as much detail as fits in max_size, so draft() makes
+    libjpeg decode at 1/2, 1/4 or 1/8 scale while staying at or above that
+    size. A 5000x5000 cover capped at 1920x1080 decodes as 1250x1250 instead
+    of 25 megapixels. Other formats are opened unchanged.
+    """
+    image = Image.open(io.BytesIO(data))
+    if image.format == 'JPEG':
+        width, height = image.size
+        scale = min(max_size[0] / width, max_size[1] / height, 1)
+        image.draft('RGB', (max(1, int(width * scale)), max(1, int(height * scale))))
+    return image
+
+def to_rgb(image):
+    # Convert to RGB immediately
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return image
+
+def decode_cover(data, max_size):
+    """Decode raw image bytes into a size-limited RGB image"""
+    # Load and immediately optimize image
+    image = open_at_size(data, max_size)
+
+    # Limit image size to prevent memory issues
+    if image.size[0] > max_size[0] or image.size[1] > max_size[1]:
+        image.thumbnail(max_size, Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+
+    return to_rgb(image)
+
+def make_preview(cover, size=PREVIEW_SIZE):
+    """Encode a small JPEG of an already decoded cover, keeping its aspect ratio"""
+    scale = min(size[0] / cover.size[0], size[1] / cover.size[1], 1)
+    preview = cover.resize(
+        (max(1, round(cover.size[0] * scale)), max(1, round(cover.size[1] * scale))),
+        Image.Resampling.BILINEAR, reducing_gap=REDUCING_GAP
+    )
+    buffer = io.BytesIO()
+    preview.save(buffer, 'JPEG', quality=PREVIEW_QUALITY)
+    return buffer.getvalue()
+
+@functools.lru_cache(maxsize=None)
+def _dct_matrix(size):
+    """Orthonormal DCT-II basis, so a 2D DCT is two matrix products"""
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(2 / size)
+    matrix[0] /= np.sqrt(2)
+    return matrix.astype(np.float32)
+
+def cover_hash(data):
+    """Perceptual hash and detail score of compressed cover bytes, as (64-bit int, float).
+
+    JPEGs decode at 1/8 scale via draft(). The cover is boxed down to a
+    HASH_SAMPLE_SIZE square grayscale sample; each of its lowest DCT
+    frequencies sets one bit by being above their median, so recompressed,
+    resized or slightly retouched copies of the same art hash within a few
+    bits of each other. The detail score is the sample's standard deviation -
+    near 0 for a blank, single-color image.
+    """
+    image = Image.open(io.BytesIO(data))
+    image.draft('L', (HASH_SAMPLE_SIZE, HASH_SAMPLE_SIZE))
+    sample = np.asarray(
+        image.convert('L').resize((HASH_SAMPLE_SIZE, HASH_SAMPLE_SIZE), Image.Resampling.BOX), dtype=np.float32
+    )
+    dct = _dct_matrix(HASH_SAMPLE_SIZE)
+    low = (dct @ sample @ dct.T)[:HASH_SIZE, :HASH_SIZE].ravel()
+    # The DC term is overall brightness and would dominate the median
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big'), float(sample.std())
+
+def sharpen(image, factor):
+    """Apply the minimal sharpness enhancement"""
+    return ImageEnhance.Sharpness(image).enhance(factor)
+
+def fill_wallpaper(image, wallpaper_size):
+    """Resize the cover to fill the entire wallpaper - NO BORDERS"""
+    return image.resize(wallpaper_size, Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+
+def crop_center(image, wallpaper_size):
+    """Scale the cover to cover the wallpaper without distortion, cropping the overflow evenly"""
+    width, height = image.size
+    scale = max(wallpaper_size[0] / width, wallpaper_size[1] / height)
+    # Crop in source pixels so resize() only resamples the part that is kept
+    crop_width, crop_height = wallpaper_size[0] / scale, wallpaper_size[1] / scale
+    left, top = (width - crop_width) / 2, (height - crop_height) / 2
+    return image.resize(
+        wallpaper_size, Image.Resampling.LANCZOS,
+        box=(left, top, left + crop_width, top + crop_height), reducing_gap=REDUCING_GAP
+    )
+
+def fit_wallpaper(image, wallpaper_size, background=LETTERBOX_COLOR):
+    """Scale the cover to fit inside the wallpaper without distortion, letterboxing the rest"""
+    width, height = image.size
+    scale = min(wallpaper_size[0] / width, wallpaper_size[1] / height)
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    canvas = Image.new('RGB', wallpaper_size, background)
+    canvas.paste(
+        image.resize(size, Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP),
+        ((wallpaper_size[0] - size[0]) // 2, (wallpaper_size[1] - size[1]) // 2)
+    )
+    return canvas
+
+def resize_to_target(image, wallpaper_size, mode=DEFAULT_ASPECT_MODE):
+    """Fit the cover to the wallpaper with one of the ASPECT_MODES"""
+    if mode == 'crop-center':
+        return crop_center(image, wallpaper_size)
+    if mode == 'fit':
+        return fit_wallpaper(image, wallpaper_size)
+    return fill_wallpaper(image, wallpaper_size)
+
+def encode_png(image):
+    """Encode as high-quality PNG with PNG optimization"""
+    return encode(image, 'png')
+
+def encode(image, encoder=DEFAULT_ENCODER):
+    """Encode a wallpaper with one of the ENCODERS presets"""
+    preset = ENCODERS[encoder]
+    buffer = io.BytesIO()
+    image.save(buffer, preset['format'], **preset['options'])
+    return buffer.getvalue()
+
+def style_target(cover, wallpaper_size, mode=DEFAULT_ASPECT_MODE, effects=(), timings=None):
+    """Fit the cover to the wallpaper and apply wallpaper_effects.EFFECTS.
+
+    Without effects this is resize_to_target. Otherwise the wallpaper is
+    built on one uint8 array: a background effect replaces the letterbox of
+    a 'fit' target, the cover is copied into it, and overlays are blended in
+    place. Stage times in ms are added to timings.
+    """
+    timings = {} if timings is None else timings
+    if not effects:
+        with timed(timings, 'resize'):
+            return resize_to_target(cover, wallpaper_size, mode)
+
+    width, height = wallpaper_size
+    background = next((effect for effect in effects if effect in wallpaper_effects.BACKGROUND_EFFECTS), None)
+    color = None
+    if background == 'dominant' or 'gradient' in effects:
+        with timed(timings, 'analyze'):
+            small = cover.resize((wallpaper_effects.ANALYSIS_SIZE, wallpaper_effects.ANALYSIS_SIZE), Image.Resampling.BOX)
+            color = wallpaper_effects.dominant_color(np.asarray(small))
+
+    if mode == 'fit' and background:
+        with timed(timings, 'background'):
+            if background == 'blur':
+                small_size = (max(1, width // wallpaper_effects.BLUR_SCALE), max(1, height // wallpaper_effects.BLUR_SCALE))
+                small = wallpaper_effects.blurred_background(np.asarray(crop_center(cover, small_size)))
+                canvas = np.array(Image.fromarray(small).resize(wallpaper_size, Image.Resampling.BILINEAR))
+            else:
+                canvas = np.empty((height, width, 3), dtype=np.uint8)
+                canvas[:] = color
+        with timed(timings, 'resize'):
+            scale = min(width / cover.size[0], height / cover.size[1])
+            size = (max(1, round(cover.size[0] * scale)), max(1, round(cover.size[1] * scale)))
+            foreground = np.asarray(cover.resize(size, Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP))
+        with timed(timings, 'composite'):
+            left, top = (width - size[0]) // 2, (height - size[1]) // 2
+            canvas[top:top + size[1], left:left + size[0]] = foreground
+    else:
+        with timed(timings, 'resize'):
+            canvas = np.array(resize_to_target(cover, wallpaper_size, mode))
+
+    if 'gradient' in effects or 'vignette' in effects:
+        with timed(timings, 'overlay'):
+            wallpaper_effects.apply_overlays(
+                canvas, gradient_color=color if 'gradient' in effects else None, vignette='vignette' in effects
+            )
+    return Image.fromarray(canvas)
+
+def iter_target_renders(data, max_size, targets, sharpness, effects=(), preview=None):
+    """Decode cover bytes once and yield (position, wallpaper image, stage timings) for every target.
+
+    targets is a sequence of (width, height, mode). The cover is decoded near
+    the largest of max_size and the target sizes. Targets are rendered
+    largest first; a target whose mode and aspect ratio match a larger one
+    already rendered is downscaled from that image instead of the cover, so
+    1440p comes from the 4K render rather than a second fit of the cover.
+    The sharpen pass runs on whichever of cover and canvas has fewer pixels.
+    Timings are ms per stage; shared work (decode, cover sharpening) is
+    counted against the first target rendered. If preview is a dict, its
+    'data' is set to a make_preview JPEG of the decoded cover.
+    """
+    timings = {}
+    decode_size = (
+        max([max_size[0]] + [width for width, _, _ in targets]),
+        max([max_size[1]] + [height for _, height, _ in targets])
+    )
+    with timed(timings, 'decode'):
+        cover = to_rgb(open_at_size(data, decode_size))
+        cover.load()
+    if preview is not None:
+        with timed(timings, 'preview'):
+            preview['data'] = make_preview(cover)
+    cover_pixels = cover.size[0] * cover.size[1]
+    sharpened_cover = None
+    # (mode, aspect ratio) -> (smallest image rendered so far, whether it is already sharpened)
+    bases = {}
+
+    order = sorted(range(len(targets)), key=lambda i: targets[i][0] * targets[i][1], reverse=True)
+    for position in order:
+        width, height, mode = targets[position]
+        key = (mode, Fraction(width, height))
+        if key in bases:
+            image, sharpened = bases[key]
+            if image.size != (width, height):
+                with timed(timings, 'resize'):
+                    image = fill_wallpaper(image, (width, height))
+        elif cover_pixels < width * height:
+            if sharpened_cover is None:
+                with timed(timings, 'sharpen'):
+                    sharpened_cover = sharpen(cover, sharpness)
+            image, sharpened = style_target(sharpened_cover, (width, height), mode, effects, timings), True
+        else:
+            image, sharpened = style_target(cover, (width, height), mode, effects, timings), False
+        bases[key] = (image, sharpened)
+        if not sharpened:
+            with timed(timings, 'sharpen'):
+                image = sharpen(image, sharpness)
+        yield position, image, timings
+        timings = {}
+
+def render_targets(data, max_size, targets, sharpness, effects=()):
+    """Render every target from one decode, returning images in targets order"""
+    images = [None] * len(targets)
+    for position, image, _ in iter_target_renders(data, max_size, targets, sharpness, effects):
+        images[position] = image
+    return images
+
+def render_wallpaper(data, max_size, wallpaper_size, sharpness):
+    """Decode cover bytes straight to a finished wallpaper image.
+
+    Decodes near max_size and resamples exactly once, straight to the
+    wallpaper size.
+    """
+    return render_targets(data, max_size, [(wallpaper_size[0], wallpaper_size[1], 'fill')], sharpness)[0]
+
+def render_cover_set(data, max_size, targets, sharpness, encoder=DEFAULT_ENCODER, effects=(), preview=None):
+    """Full render of compressed cover bytes to one encoded wallpaper per target.
+
+    Returns a list of (encoded bytes, encode time in ms, stage timings in ms)
+    in targets order. Each image is encoded as soon as it is rendered, so
+    only the images later targets may be derived from stay in memory.
+    preview is passed to iter_target_renders.
+    Top-level so it can be shipped to a process pool worker.
+    """
+    outputs = [None] * len(targets)
+    for position, image, timings in iter_target_renders(data, max_size, targets, sharpness, effects, preview):
+        with timed(timings, 'encode'):
+            output = encode(image, encoder)
+        outputs[position] = (output, timings['encode'], {stage: round(ms, 2) for stage, ms in timings.items()})
+    return outputs
+
+def render_cover_set_with_preview(data, max_size, targets, sharpness, encoder=DEFAULT_ENCODER, effects=()):
+    """render_cover_set that also returns a preview of the decoded cover, as (outputs, preview JPEG bytes).
+
+    Top-level so it can be shipped to a process pool worker.
+    """
+    preview = {}
+    outputs = render_cover_set(data, max_size, targets, sharpness, encoder, effects, preview)
+    return outputs, preview['data']
+
+def render_cover(data, max_size, wallpaper_size, sharpness, encoder=DEFAULT_ENCODER):
+    """Full render of compressed cover bytes to encoded wallpaper bytes.
+
+    Returns (encoded bytes, encode time in ms).
+    """
+    output, encode_ms, _ = render_cover_set(
+        data, max_size, [(wallpaper_size[0], wallpaper_size[1], 'fill')], sharpness, encoder
+    )[0]
+    return output, encode_ms
+
+def estimate_render_bytes(max_size, targets, effects=()):
+    """Peak memory in bytes of one render_cover_set call for (width, height, mode) targets.
+
+    Counts the decoded cover, the largest resampled base plus the styled copy
+    being encoded, a float32 band and array copy when effects apply, and
+    every encoded output held until the call returns.
+    """
+    areas = [width * height for width, height, _ in targets]
+    peak = max_size[0] * max_size[1] * 3 * DRAFT_OVERSHOOT_AREA
+    peak += 2 * max(areas) * 3
+    if effects:
+        widest = max(width for width, _, _ in targets)
+        peak += max(areas) * 3 + wallpaper_effects.BAND_ROWS * widest * 3 * 4
+    peak += int(sum(areas) * 3 * ENCODED_FRACTION)
+    return peak
+
+def estimate_collage_bytes(wallpaper_size, grid, concurrent_tiles=1):
+    """Peak memory in bytes of a collage with concurrent_tiles covers decoding at once"""
+    tile_width, tile_height = grid_tile_size(wallpaper_size, grid)
+    side = max(tile_width, tile_height)
+    area = wallpaper_size[0] * wallpaper_size[1]
+    tiles = grid[0] * grid[1] * tile_width * tile_height * 3
+    decodes = concurrent_tiles * side * side * 3 * DRAFT_OVERSHOOT_AREA
+    return tiles + decodes + area * 3 + int(area * 3 * ENCODED_FRACTION)
+
+def grid_tile_size(wallpaper_size, grid):
+    """Size of every collage cell - the same for all cells so cached tiles fit any position"""
+    return (max(1, wallpaper_size[0] // grid[0]), max(1, wallpaper_size[1] // grid[1]))
+
+def grid_boxes(wallpaper_size, grid):
+    """(left, top, right, bottom) of every cell of a cols x rows grid, row by row.
+
+    The grid is centered; the few pixels left over when the wallpaper
+    doesn't divide evenly become a margin.
+    """
+    columns, rows = grid
+    tile_width, tile_height = grid_tile_size(wallpaper_size, grid)
+    left = (wallpaper_size[0] - tile_width * columns) // 2
+    top = (wallpaper_size[1] - tile_height * rows) // 2
+    return [
+        (left + col * tile_width, top + row * tile_height, left + (col + 1) * tile_width, top + (row + 1) * tile_height)
+        for row in range(rows) for col in range(columns)
+    ]
+
+def render_tile(data, tile_size, sharpness):
+    """Decode a cover straight to a cropped, sharpened collage tile as raw RGB bytes.
+
+    Top-level so it can be shipped to a process pool worker; the raw bytes
+    are cached and copied into the canvas without another decode.
+    """
+    side = max(tile_size)
+    image = to_rgb(open_at_size(data, (side, side)))
+    return sharpen(crop_center(image, tile_size), sharpness).tobytes()
+
+class CanvasPool:
+    """Reusable uint8 canvases so collages don't allocate a fresh wallpaper buffer each time"""
+
+    def __init__(self, per_size=CANVAS_POOL_PER_SIZE):
+        self.per_size = per_size
+        self._free = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, wallpaper_size):
+        """Return an HxWx3 array with arbitrary contents - callers overwrite every pixel"""
+        with self._lock:
+            free = self._free.get(wallpaper_size)
+            if free:
+                return free.pop()
+        return np.empty((wallpaper_size[1], wallpaper_size[0], 3), dtype=np.uint8)
+
+    def release(self, canvas):
+        wallpaper_size = (canvas.shape[1], canvas.shape[0])
+        with self._lock:
+            free = self._free.setdefault(wallpaper_size, [])
+            if len(free) < self.per_size:
+                free.append(canvas)
+
+def compose_grid(canvas, boxes, tiles, background=LETTERBOX_COLOR):
+    """Copy raw RGB tiles into their cells of canvas; cells without a tile and margins get the background"""
+    left, top = boxes[0][:2]
+    right, bottom = boxes[-1][2:]
+    if (left, top, right, bottom) != (0, 0, canvas.shape[1], canvas.shape[0]):
+        canvas[:top] = background
+        canvas[bottom:] = background
+        canvas[:, :left] = background
+        canvas[:, right:] = background
+    for (left, top, right, bottom), tile in zip(boxes, tiles):
+        cell = canvas[top:bottom, left:right]
+        if tile is None:
+            cell[:] = background
+        else:
+            cell[:] = np.frombuffer(tile, dtype=np.uint8).reshape(bottom - top, right - left, 3)
+    return canvas